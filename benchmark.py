@@ -0,0 +1,219 @@
+import argparse
+import ctypes
+import ctypes.util
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from types import SimpleNamespace
+
+import numpy as np
+
+from lib.projectM.AudioAnalyzer import AudioAnalyzer
+from lib.projectM.PresetIndex import PRESET_EXTENSIONS, PresetIndex
+from lib.projectM.ProjectMWrapper import ProjectMWrapper
+from lib.projectM.SharedAudioExport import SharedAudioReader, SharedAudioWriter
+
+"""Measure the cost of a callable.
+@param func: the callable to measure
+@param iterations: the number of timed calls
+@returns a tuple of the mean ns/call and the peak transient bytes allocated by a single call
+"""
+def measure(func, iterations):
+    for _ in range(1000):
+        func()
+
+    start = time.perf_counter_ns()
+    for _ in range(iterations):
+        func()
+    ns_per_call = (time.perf_counter_ns() - start) / iterations
+
+    tracemalloc.start()
+    func()
+    tracemalloc.reset_peak()
+    current, _ = tracemalloc.get_traced_memory()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return ns_per_call, peak - current
+
+"""Compare the array based add_pcm with the address based add_pcm_ptr.
+libc's labs() stands in for projectm_pcm_add_float (it ignores the extra arguments), so no OpenGL
+context is needed and the timings isolate the Python/ctypes overhead of each path.
+"""
+def benchmark_add_pcm(args):
+    libc = ctypes.CDLL(ctypes.util.find_library('c'))
+
+    add_float = libc['labs']
+    add_float.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_float), ctypes.c_uint, ctypes.c_int]
+    add_float.restype = None
+
+    add_float_ptr = libc['labs']
+    add_float_ptr.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    add_float_ptr.restype = None
+
+    wrapper = ProjectMWrapper.__new__(ProjectMWrapper)
+    wrapper._projectM = 1
+    wrapper.projectm_lib = SimpleNamespace(projectm_pcm_add_float=add_float)
+    wrapper._pcm_add_float_ptr = add_float_ptr
+
+    samples = np.zeros(args.frames * 2, dtype=np.float32)
+    address = samples.ctypes.data
+
+    results = {
+        'add_pcm': measure(lambda: wrapper.add_pcm(samples, 2), args.iterations),
+        'add_pcm_ptr': measure(lambda: wrapper.add_pcm_ptr(address, args.frames, 2), args.iterations)
+        }
+
+    print(f'{args.iterations} calls with {args.frames} stereo frames per call')
+    for name, (ns_per_call, allocated) in results.items():
+        print(f'{name:<12} {ns_per_call:>10.1f} ns/call {allocated:>8} bytes allocated/call')
+
+"""Publish analysed noise as fast as possible until stopped (writer process).
+@param name: the name of the shared memory block
+@param ready: event set once the shared memory exists
+@param stop: event ending the writer
+"""
+def shared_memory_writer(name, ready, stop):
+    analyzer = AudioAnalyzer()
+    writer = SharedAudioWriter(name, analyzer.fft_size, analyzer.band_count)
+    ready.set()
+
+    samples = np.random.rand(735 * 2).astype(np.float32)
+    while not stop.is_set():
+        analyzer.update(samples.ctypes.data, 735, 2, 44100)
+        writer.publish(analyzer, analyzer.analyze())
+
+    writer.close()
+
+"""Measure the overhead of SharedAudioReader for an external consumer, without and with a writer
+publishing continuously from another process (the worst case for seqlock retries).
+"""
+def benchmark_shm(args):
+    analyzer = AudioAnalyzer()
+    writer = SharedAudioWriter(args.name, analyzer.fft_size, analyzer.band_count)
+
+    samples = np.random.rand(735 * 2).astype(np.float32)
+    address = samples.ctypes.data
+
+    def publish():
+        analyzer.update(address, 735, 2, 44100)
+        writer.publish(analyzer, analyzer.analyze())
+
+    publish()
+    reader = SharedAudioReader(args.name)
+
+    results = {
+        'publish': measure(publish, args.iterations),
+        'read': measure(lambda: reader.read(wait_new=False), args.iterations),
+        'sequence': measure(reader.sequence, args.iterations)
+        }
+
+    reader.close()
+    writer.close()
+
+    print(f'{args.iterations} calls, {analyzer.fft_size} sample window, {analyzer.band_count} bands')
+    for name, (ns_per_call, allocated) in results.items():
+        print(f'{name:<12} {ns_per_call:>10.1f} ns/call {allocated:>8} bytes allocated/call')
+
+    ready = multiprocessing.Event()
+    stop = multiprocessing.Event()
+    process = multiprocessing.Process(target=shared_memory_writer, args=(args.name, ready, stop))
+    process.start()
+    ready.wait()
+
+    reader = SharedAudioReader(args.name)
+    calls = frames = 0
+    start = time.perf_counter_ns()
+    end = start + int(args.duration * 1000000000)
+    while time.perf_counter_ns() < end:
+        calls += 1
+        if reader.read():
+            frames += 1
+    elapsed = time.perf_counter_ns() - start
+
+    print(f'contended    {elapsed / calls:>10.1f} ns/call {frames} new frames in {args.duration}s, {reader.retried} retries')
+
+    reader.close()
+    stop.set()
+    process.join()
+
+"""Compare the startup preset scan: a full directory walk as projectm_playlist_add_path does it, a cold
+start building the preset index, a warm start with an unchanged library and a warm start after a preset
+was added. The index is kept in a temporary state path, the preset directories are only read.
+"""
+def benchmark_preset_index(args):
+    def walk():
+        presets = list()
+        for path in args.paths:
+            for root, _, files in os.walk(path, followlinks=True):
+                presets.extend(os.path.join(root, name) for name in files if name.lower().endswith(PRESET_EXTENSIONS))
+        return presets
+
+    state_path = tempfile.mkdtemp(prefix='projectmar_preset_index_')
+    config = SimpleNamespace(general={'state_path': state_path})
+
+    def indexed(touch=None):
+        if touch:
+            # Invalidate a directory as if a preset had been added to it
+            preset_index = PresetIndex(config)
+            preset_index.directories[touch]['mtime'] = 0
+            preset_index.save()
+
+        start = time.perf_counter()
+        preset_index = PresetIndex(config)
+        presets = preset_index.scan(args.paths)
+        return presets, time.perf_counter() - start, preset_index.stats()
+
+    try:
+        start = time.perf_counter()
+        walked = walk()
+        walk_seconds = time.perf_counter() - start
+
+        results = {'walk': (len(walked), walk_seconds, None)}
+        results['cold'] = indexed()
+        results['warm'] = indexed()
+
+        directory = os.path.abspath(args.paths[0])
+        if os.path.isdir(directory):
+            results['one changed'] = indexed(directory)
+
+        index_size = os.path.getsize(os.path.join(state_path, 'preset_index.json'))
+        print(f'{len(walked)} presets below {", ".join(args.paths)}, index {index_size // 1024} KB')
+        for name, (presets, seconds, stats) in results.items():
+            count = presets if isinstance(presets, int) else len(presets)
+            rescanned = f' {stats["directories_rescanned"]}/{stats["directories"]} directories listed' if stats else ''
+            print(f'{name:<12} {seconds * 1000:>10.1f} ms {count:>8} presets{rescanned}')
+
+    finally:
+        shutil.rmtree(state_path, ignore_errors=True)
+
+"""Parse command line arguments for the projectMAR benchmarks"""
+def parse_args():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    add_pcm_parser = subparsers.add_parser('add_pcm', help='PCM handoff into projectM')
+    add_pcm_parser.add_argument('--frames', type=int, default=735, help='Frames per call')
+    add_pcm_parser.add_argument('--iterations', type=int, default=200000, help='Timed calls per path')
+    add_pcm_parser.set_defaults(func=benchmark_add_pcm)
+
+    shm_parser = subparsers.add_parser('shm', help='Shared memory audio export reader overhead')
+    shm_parser.add_argument('--name', default='projectmar_audio_benchmark', help='Shared memory block name')
+    shm_parser.add_argument('--iterations', type=int, default=100000, help='Timed calls per path')
+    shm_parser.add_argument('--duration', type=float, default=2, help='Seconds to read while another process publishes')
+    shm_parser.set_defaults(func=benchmark_shm)
+
+    preset_index_parser = subparsers.add_parser('preset_index', help='Startup preset scan with and without the preset index')
+    preset_index_parser.add_argument('paths', nargs='+', metavar='PATH', help='Preset directories')
+    preset_index_parser.set_defaults(func=benchmark_preset_index)
+
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    args.func(args)
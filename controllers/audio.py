@@ -9,7 +9,7 @@ from pulsectl.pulsectl import PulseOperationFailed
 
 from lib.abstracts import Controller
 from lib.config import APP_ROOT, Config
-from lib.constants import DeviceCatalog, PluginDevice
+from lib.constants import ACTIVE_SOURCES, DeviceCatalog, PluginDevice
 from lib.common import execute, execute_managed
 
 log = logging.getLogger()
@@ -35,6 +35,9 @@ class AudioCtrl(Controller, threading.Thread):
         self.audio_listener_thread  = None
         self.audio_listener_enabled = self._config.audio_ctrl.get('audio_listener_enabled', True)
 
+        # In direct mode the capture layer records the active sources itself, so nothing is looped into the null sink
+        self.direct_capture         = self._config.get('projectm', 'audio.backend', 'sdl') == 'direct'
+
         config_path = os.path.join(APP_ROOT, 'conf')
 
         self.audio_cards_config     = Config(os.path.join(config_path, 'audio_cards.conf'))
@@ -523,6 +526,7 @@ class AudioCtrl(Controller, threading.Thread):
                     self.source_device = None
 
                 self.devices.source_devices.pop(source_name)
+                ACTIVE_SOURCES.remove(source_name)
 
         for source in sources:
             if self.devices.source_devices.get(source.name):
@@ -533,7 +537,7 @@ class AudioCtrl(Controller, threading.Thread):
             log.debug('Found source device: {} {}'.format(source.name, source))
             if source.name.startswith('alsa_output'):
                 loopback_modules = self.get_modules('module-loopback')
-                if not any(lm.args['source'] == source.name and lm.args['sink'] == self.ar_sink for lm in loopback_modules):
+                if not self.direct_capture and not any(lm.args['source'] == source.name and lm.args['sink'] == self.ar_sink for lm in loopback_modules):
                     # if self.same_card(source.name, self.ar_sink):
                     #     log.info(f"Routing {source.name} -> {self.ar_sink} via null sink (same card)")
                     #     self.route_input_to_output_via_null_sink(source.name, self.ar_sink)
@@ -613,7 +617,7 @@ class AudioCtrl(Controller, threading.Thread):
                     #     self.load_loopback_module(source_device.name, sink.name)
                     self.load_loopback_module(source_device.name, sink.name)
 
-            elif self.sink_device and source_device.type == 'mic':
+            elif self.sink_device and source_device.type == 'mic' and not self.direct_capture:
                 # if self.same_card(source_device.name, self.ar_sink):
                 #     log.info(f"Routing {source_device.name} -> {self.ar_sink} via null sink (same card)")
                 #     self.route_input_to_output_via_null_sink(source_device.name, self.ar_sink)
@@ -875,6 +879,7 @@ class AudioCtrl(Controller, threading.Thread):
                     source_volume
                     )
                 self.devices.source_devices[source_device.name].active = True
+                ACTIVE_SOURCES.add(source_device.name, source_device.type)
 
                 if not self.allow_multiple_sources:
                     break
@@ -909,6 +914,7 @@ class AudioCtrl(Controller, threading.Thread):
         
         self.devices                = DeviceCatalog()
         self.pulse                  = Pulse() 
+        ACTIVE_SOURCES.clear()
 
         # Load null sink
         self.ar_sink = 'platform-project_mar.stereo'
@@ -935,6 +941,8 @@ class AudioCtrl(Controller, threading.Thread):
             if not source_name.startswith('bluez_source'):
                 self.unload_loopback_modules(source_name=source_name)
 
+        ACTIVE_SOURCES.clear()
+
         self.unload_null_sink_modules()
                 
         self.unload_combined_sink_modules()
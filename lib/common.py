@@ -1,4 +1,6 @@
+import json
 import logging
+import os
 
 from subprocess import PIPE, Popen
 
@@ -18,6 +20,50 @@ def get_environment():
                 
     return None
 
+"""Get the directory holding the runtime state persisted between runs.
+@param config: the projectMAR configuration
+"""
+def get_state_path(config):
+    return config.general.get('state_path', '/opt/ProjectMAR/state')
+
+"""Load a value persisted with save_state.
+@param config: the projectMAR configuration
+@param name: the name of the state
+@param default: returned if nothing was persisted or the state cannot be read
+@returns the persisted value
+"""
+def load_state(config, name, default=None):
+    path = os.path.join(get_state_path(config), f'{name}.json')
+    if not os.path.exists(path):
+        return default
+
+    try:
+        with open(path, 'r') as infile:
+            return json.load(infile)
+    except Exception as e:
+        log.warning(f'Unable to load state {path}: {e}')
+        return default
+
+"""Persist a JSON serializable value between runs, the file is replaced atomically.
+@param config: the projectMAR configuration
+@param name: the name of the state
+@param value: the value to persist
+@returns a boolean indicating whether the state was saved
+"""
+def save_state(config, name, value):
+    path = os.path.join(get_state_path(config), f'{name}.json')
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w') as outfile:
+            json.dump(value, outfile)
+        os.replace(path + '.tmp', path)
+    except Exception as e:
+        log.warning(f'Unable to save state {path}: {e}')
+        return False
+
+    return True
+
 """Execute a process.
 @param name: the name of the process
 @param path: the path to the executable
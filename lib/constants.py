@@ -1,3 +1,5 @@
+import threading
+
 class ProcessAttributes:
     """Attributes for a process that is managed by the system.
     @param name: the name of the process
@@ -40,4 +42,47 @@ class DeviceCatalog:
         self.bluetooth_devices      = dict()
         self.plugin_devices         = dict()
         self.unsupported_sinks      = dict()
-        self.unsupported_sources    = dict()
\ No newline at end of file
+        self.unsupported_sources    = dict()
+
+class ActiveSources:
+    """Thread safe registry of the PulseAudio sources AudioCtrl has activated, read by the direct
+    capture backend to open the same sources the loopback chain would otherwise route to projectM.
+    """
+    def __init__(self):
+        self._lock      = threading.Lock()
+        self._sources   = dict()
+        self.version    = 0
+
+    """Register an active source.
+    @param name: the name of the PulseAudio source
+    @param source_type: the source type (aux/mic)
+    """
+    def add(self, name, source_type=None):
+        with self._lock:
+            if self._sources.get(name, False) != source_type:
+                self._sources[name] = source_type
+                self.version += 1
+
+    """Unregister a source.
+    @param name: the name of the PulseAudio source
+    """
+    def remove(self, name):
+        with self._lock:
+            if self._sources.pop(name, False) is not False:
+                self.version += 1
+
+    def clear(self):
+        with self._lock:
+            if self._sources:
+                self._sources.clear()
+                self.version += 1
+
+    """Get the registered sources.
+    @returns a tuple of the registry version and a dict of source names and types
+    """
+    def snapshot(self):
+        with self._lock:
+            return self.version, dict(self._sources)
+
+# Sources activated by AudioCtrl, shared with the capture layer running in the rendering thread
+ACTIVE_SOURCES = ActiveSources()
@@ -0,0 +1,69 @@
+import logging
+import time
+
+log = logging.getLogger()
+
+class AdaptiveBufferSizer:
+    """Track the measured rendering frame rate and suggest a capture buffer size of one frame worth of audio.
+    Suggestions are bounded, only made when the size is off by more than the hysteresis and only after
+    two consecutive evaluations agree, so a short load spike does not reopen the capture device.
+    @param sample_rate: the capture sample rate
+    @param min_frames: the smallest buffer size (in frames) to suggest
+    @param max_frames: the largest buffer size (in frames) to suggest
+    @param hysteresis: the relative size difference that has to be exceeded before resizing
+    @param interval: seconds between two evaluations
+    """
+    def __init__(self, sample_rate, min_frames=256, max_frames=4096, hysteresis=0.25, interval=5):
+        self.sample_rate = sample_rate
+        self.min_frames = min_frames
+        self.max_frames = max_frames
+        self.hysteresis = hysteresis
+
+        self._interval_ns = int(interval * 1000000000)
+        self._last_evaluation = time.perf_counter_ns()
+        self._last_frame = None
+        self._frame_time = None
+        self._pending = None
+
+    """Measured frames per second, None until at least two frames were rendered"""
+    def fps(self):
+        if not self._frame_time:
+            return None
+
+        return 1000000000 / self._frame_time
+
+    """Register a rendered frame and evaluate the buffer size once per interval.
+    @param current_frames: the current capture buffer size in frames
+    @returns the new buffer size in frames, or None if the buffer should be left alone
+    """
+    def frame_rendered(self, current_frames):
+        now = time.perf_counter_ns()
+
+        if self._last_frame is not None:
+            frame_time = now - self._last_frame
+            if self._frame_time is None:
+                self._frame_time = frame_time
+            else:
+                self._frame_time += (frame_time - self._frame_time) * 0.05
+
+        self._last_frame = now
+
+        if now - self._last_evaluation < self._interval_ns or not self._frame_time:
+            return None
+
+        self._last_evaluation = now
+
+        desired = int(min(max(self.sample_rate / self.fps(), self.min_frames), self.max_frames))
+        if abs(desired - current_frames) <= current_frames * self.hysteresis:
+            self._pending = None
+            return None
+
+        # Only act once two consecutive evaluations want to move in the same direction
+        if self._pending is None or (self._pending > current_frames) != (desired > current_frames):
+            self._pending = desired
+            return None
+
+        self._pending = None
+        log.info(f'Rendering at {self.fps():.1f} fps, resizing the capture buffer from {current_frames} to {desired} frames')
+
+        return desired
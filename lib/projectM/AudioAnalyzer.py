@@ -0,0 +1,195 @@
+import ctypes
+import logging
+import time
+
+from collections import namedtuple
+
+import numpy as np
+
+log = logging.getLogger()
+
+"""Read-only snapshot of the audio features of one rendered frame.
+frame: the number of the analysed frame
+timestamp: perf_counter_ns timestamp of the analysis
+rms: RMS level of the analysis window (linear, 0.0 - 1.0)
+peak: peak level of the analysis window (linear, 0.0 - 1.0)
+bands: read-only float32 array of the mean power per log-spaced band
+flux: spectral flux (sum of the magnitude increases since the previous frame)
+onset: whether an onset was detected in this frame
+"""
+AudioFeatures = namedtuple('AudioFeatures', ['frame', 'timestamp', 'rms', 'peak', 'bands', 'flux', 'onset'])
+
+"""Compute the FFT bin ranges of log-spaced bands.
+@param sample_rate: the sample rate of the analysed audio
+@param fft_size: the FFT size
+@param bands: the number of bands
+@param low: the lower edge of the first band in Hz
+@param high: the upper edge of the last band in Hz
+@returns a tuple of the first bin of each band and the number of bins per band
+"""
+def log_band_bins(sample_rate, fft_size, bands, low=40, high=16000):
+    high = min(high, sample_rate / 2)
+    edges = np.geomspace(low, high, bands + 1) * fft_size / sample_rate
+    edges = np.clip(np.round(edges).astype(np.int64), 1, fft_size // 2)
+
+    # Every band covers at least one bin, the low bands are narrower than a bin for small FFT sizes
+    for i in range(1, edges.size):
+        edges[i] = max(edges[i], edges[i - 1] + 1)
+
+    edges = np.minimum(edges, fft_size // 2 + 1)
+    starts = edges[:-1]
+    counts = np.maximum(edges[1:] - starts, 1)
+
+    return starts, counts.astype(np.float32)
+
+class AudioAnalyzer:
+    """Per-frame audio feature engine shared by every subsystem that needs spectral information.
+    The PCM handed to projectM is downmixed into a preallocated history, which is analysed once per
+    rendered frame (windowed FFT, log-spaced band energies, RMS/peak and spectral-flux onsets).
+    The result is published as an immutable AudioFeatures snapshot in self.features.
+    @param fft_size: the analysis window size in samples (a power of two)
+    @param bands: the number of log-spaced bands
+    @param onset_sensitivity: the number of standard deviations the flux has to exceed its recent mean
+    @param onset_history: the number of frames used for the onset threshold
+    """
+    def __init__(self, fft_size=1024, bands=16, onset_sensitivity=1.5, onset_history=43):
+        self.fft_size = fft_size
+        self.band_count = bands
+        self.onset_sensitivity = onset_sensitivity
+
+        self.sample_rate = None
+
+        self._window = np.hanning(fft_size).astype(np.float32)
+        self._history = np.zeros(fft_size, dtype=np.float32)
+        self._history_index = 0
+        self._mono = np.zeros(fft_size, dtype=np.float32)
+        self._mono_weights = dict()
+        self._frame = np.zeros(fft_size, dtype=np.float32)
+
+        bins = fft_size // 2 + 1
+        self._magnitude = np.zeros(bins, dtype=np.float32)
+        self._previous_magnitude = np.zeros(bins, dtype=np.float32)
+        self._difference = np.zeros(bins, dtype=np.float32)
+        self._power = np.zeros(bins, dtype=np.float32)
+
+        self._band_starts = None
+        self._band_counts = None
+        self._band_end = 0
+
+        # Snapshots alternate between two buffers so the previous snapshot stays valid for one more frame
+        self._bands = [np.zeros(bands, dtype=np.float32), np.zeros(bands, dtype=np.float32)]
+        self._band_views = list()
+        for buffer in self._bands:
+            view = buffer.view()
+            view.flags.writeable = False
+            self._band_views.append(view)
+
+        self._flux_history = np.zeros(onset_history, dtype=np.float32)
+        self._last_onset = 0
+
+        self._new_samples = 0
+        self.frames = 0
+
+        # The analysed mono window as a ring (oldest sample at window_index) and the samples added for the last analysis
+        self.window = self._history
+        self.window_index = 0
+        self.window_samples = 0
+        self.onsets = 0
+
+        self.features = AudioFeatures(0, 0, 0.0, 0.0, self._band_views[0], 0.0, False)
+
+    """Precompute the band bin map for a sample rate.
+    @param sample_rate: the sample rate of the analysed audio
+    """
+    def configure(self, sample_rate):
+        self.sample_rate = sample_rate
+        self._band_starts, self._band_counts = log_band_bins(sample_rate, self.fft_size, self.band_count)
+        self._band_end = int(self._band_starts[-1] + self._band_counts[-1])
+
+    """Append float32 samples to the analysis history, called for every block handed to projectM.
+    @param address: the address of the interleaved samples
+    @param frames: the number of frames at the address
+    @param channels: the number of interleaved channels
+    @param sample_rate: the sample rate of the samples
+    """
+    def update(self, address, frames, channels, sample_rate):
+        if not frames:
+            return
+
+        if sample_rate != self.sample_rate:
+            self.configure(sample_rate)
+
+        # Only the most recent window is of interest
+        skip = max(0, frames - self.fft_size)
+        frames -= skip
+
+        samples = np.ctypeslib.as_array(ctypes.cast(address, ctypes.POINTER(ctypes.c_float)), shape=((skip + frames) * channels,))
+        samples = samples[skip * channels:].reshape(frames, channels)
+
+        if channels == 1:
+            mono = samples[:, 0]
+        else:
+            weights = self._mono_weights.get(channels)
+            if weights is None:
+                weights = self._mono_weights[channels] = np.full(channels, 1 / channels, dtype=np.float32)
+
+            mono = np.dot(samples, weights, out=self._mono[:frames])
+
+        start = self._history_index
+        first = min(frames, self.fft_size - start)
+        self._history[start:start + first] = mono[:first]
+        self._history[:frames - first] = mono[first:]
+
+        self._history_index = (start + frames) % self.fft_size
+        self._new_samples += frames
+
+    """Analyse the current window and publish a new snapshot, called once per rendered frame.
+    @returns the published AudioFeatures
+    """
+    def analyze(self):
+        if not self._new_samples or self._band_starts is None:
+            return self.features
+
+        self.window_index = self._history_index
+        self.window_samples = self._new_samples
+        self._new_samples = 0
+        self.frames += 1
+
+        # Unroll the history (oldest sample first) while applying the window
+        split = self.fft_size - self._history_index
+        np.multiply(self._history[self._history_index:], self._window[:split], out=self._frame[:split])
+        np.multiply(self._history[:self._history_index], self._window[split:], out=self._frame[split:])
+
+        peak = max(float(self._history.max()), -float(self._history.min()))
+        rms = float(np.sqrt(np.dot(self._history, self._history) / self.fft_size))
+
+        np.abs(np.fft.rfft(self._frame), out=self._magnitude)
+        np.multiply(self._magnitude, self._magnitude, out=self._power)
+
+        bands = self._bands[self.frames % 2]
+        np.add.reduceat(self._power[:self._band_end], self._band_starts, out=bands)
+        np.divide(bands, self._band_counts, out=bands)
+
+        # Spectral flux: only increases in magnitude indicate a new sound
+        np.subtract(self._magnitude, self._previous_magnitude, out=self._difference)
+        np.maximum(self._difference, 0, out=self._difference)
+        flux = float(self._difference.sum())
+        self._previous_magnitude[:] = self._magnitude
+
+        threshold = self._flux_history.mean() + self.onset_sensitivity * self._flux_history.std()
+        onset = flux > threshold and flux > 0.1 and self.frames - self._last_onset > 3
+        if onset:
+            self._last_onset = self.frames
+            self.onsets += 1
+
+        self._flux_history[self.frames % self._flux_history.size] = flux
+
+        self.features = AudioFeatures(self.frames, time.perf_counter_ns(), rms, peak, self._band_views[self.frames % 2], flux, onset)
+
+        return self.features
+
+    def stats(self):
+        return {
+            'analysis_frames': self.frames,
+            'analysis_onsets': self.onsets
+            }
@@ -1,15 +1,91 @@
 import logging
+import re
 
 log = logging.getLogger()
 
+from lib.common import load_state, save_state
+
+from lib.projectM.AdaptiveBufferSizer import AdaptiveBufferSizer
+from lib.projectM.AudioAnalyzer import AudioAnalyzer
+from lib.projectM.AudioCaptureImpl_Direct import DirectAudioCapture
+from lib.projectM.AudioCaptureImpl_File import FileAudioCapture
+from lib.projectM.AudioCaptureImpl_Journal import JournalAudioCapture
+from lib.projectM.AudioCaptureImpl_Pipe import PipeAudioCapture
 from lib.projectM.AudioCaptureImpl_SDL import SDLAudioCapture
+from lib.projectM.LatencyProbe import LatencyProbe
+from lib.projectM.PCMJournal import PCMJournalWriter
+from lib.projectM.SharedAudioExport import DEFAULT_SHARED_MEMORY_NAME, SharedAudioWriter
+from lib.projectM.SilenceDetector import SilenceDetector
+
+AUDIO_DEVICE_STATE = 'audio_device'
+
+AUDIO_CAPTURE_BACKENDS = {
+    'sdl': SDLAudioCapture,
+    'pipe': PipeAudioCapture,
+    'file': FileAudioCapture,
+    'direct': DirectAudioCapture,
+    'journal': JournalAudioCapture
+    }
 
 class AudioCapture:
     def __init__(self, config, projectm_wrapper):
         self.config = config
         self.projectm_wrapper = projectm_wrapper
 
-        self.audio_capture_impl = SDLAudioCapture(self.config , projectm_wrapper)
+        self.latency_probe = None
+
+        backend = self.config.projectm.get('audio.backend', 'sdl')
+        if backend not in AUDIO_CAPTURE_BACKENDS:
+            log.error(f'Unknown audio.backend "{backend}", falling back to sdl')
+            backend = 'sdl'
+
+        if self.config.projectm.get('audio.latencyprobe', False):
+            log.info('Latency measurement mode: replaying a synthetic impulse train instead of capturing audio')
+            backend = 'file'
+
+            sample_rate = self.config.projectm.get('audio.filesamplerate', 44100)
+            interval = self.config.projectm.get('audio.latencyprobeinterval', 0.5)
+            self.latency_probe = LatencyProbe(sample_rate, int(sample_rate * interval))
+
+        log.info(f'Using the {backend} audio capture backend')
+        self.audio_capture_impl = AUDIO_CAPTURE_BACKENDS[backend](self.config, projectm_wrapper)
+        if self.latency_probe:
+            self.audio_capture_impl.latency_probe = self.latency_probe
+
+        self.silence_detector = None
+        if self.config.projectm.get('audio.idleenabled', False):
+            self.silence_detector = SilenceDetector(
+                self.config.projectm.get('audio.idlethreshold', -60),
+                self.config.projectm.get('audio.idlepeakthreshold', -40),
+                self.config.projectm.get('audio.idlehold', 10)
+                )
+            self.audio_capture_impl.silence_detector = self.silence_detector
+
+        # The shared memory export publishes the analysed window, so it needs the analysis as well
+        shared_memory = self.config.projectm.get('audio.sharedmemory', False)
+
+        self.audio_analyzer = None
+        if self.config.projectm.get('audio.analysisenabled', False) or shared_memory:
+            self.audio_analyzer = AudioAnalyzer(
+                self.config.projectm.get('audio.analysisfftsize', 1024),
+                self.config.projectm.get('audio.analysisbands', 16),
+                self.config.projectm.get('audio.analysisonsetsensitivity', 1.5)
+                )
+            self.audio_capture_impl.audio_analyzer = self.audio_analyzer
+
+        self.shared_export = None
+        if shared_memory:
+            try:
+                self.shared_export = SharedAudioWriter(
+                    self.config.projectm.get('audio.sharedmemoryname', DEFAULT_SHARED_MEMORY_NAME),
+                    self.audio_analyzer.fft_size,
+                    self.audio_analyzer.band_count
+                    )
+            except Exception as e:
+                log.error(f'Unable to create the shared memory audio export: {e}')
+
+        self.audio_capture_impl.on_device_changed = self.save_audio_device
+
         deviceList = self.audio_capture_impl.audio_device_list()
         audioDeviceIndex = self.get_initial_audio_device_index(deviceList)
 
@@ -17,27 +93,159 @@ class AudioCapture:
 
         self.audio_capture_impl.start_recording(audioDeviceIndex)
 
+        self.journal = None
+        journal_path = self.config.projectm.get('audio.journalpath', '')
+        if journal_path and backend != 'journal':
+            try:
+                self.journal = PCMJournalWriter(
+                    journal_path,
+                    int(self.config.projectm.get('audio.journalsize', 64) * 1048576),
+                    self.audio_capture_impl.get_stats().get('sample_rate', 44100),
+                    self.audio_capture_impl.get_output_channels()
+                    )
+                self.audio_capture_impl.journal = self.journal
+            except Exception as e:
+                log.error(f'Unable to record the audio journal to {journal_path}: {e}')
+
+        self.buffer_sizer = None
+        self.buffer_resizes = 0
+
+        if self.config.projectm.get('audio.adaptivebuffer', False) and self.audio_capture_impl.get_buffer_size():
+            self.buffer_sizer = AdaptiveBufferSizer(
+                self.audio_capture_impl.get_stats().get('sample_rate', 44100),
+                self.config.projectm.get('audio.adaptivebuffermin', 256),
+                self.config.projectm.get('audio.adaptivebuffermax', 4096),
+                self.config.projectm.get('audio.adaptivebufferhysteresis', 0.25),
+                self.config.projectm.get('audio.adaptivebufferinterval', 5)
+                )
+
     def output_device_list(self, deviceList):
         log.info(f'Available audio capturing devices:')
 
         for device in deviceList:
             log.info(f' - {device}: {deviceList[device]}')
 
+    """Select the capture device to start with.
+    The device last selected with Ctrl+I is used if it is still present (audio.deviceRemember),
+    otherwise the first device whose name matches audio.device (a regular expression or an index).
+    @param deviceList: a dict of the available device indices and names
+    @returns the index of the device, -1 for the default device
+    """
     def get_initial_audio_device_index(self, deviceList):
-        audioDeviceIndex = -1
+        if self.config.projectm.get('audio.deviceremember', True):
+            name = load_state(self.config, AUDIO_DEVICE_STATE)
+            for index, deviceName in deviceList.items():
+                if name and deviceName == name:
+                    log.info(f'Using the previously selected audio device "{name}"')
+                    return index
+
+        device = self.config.projectm.get('audio.device', '')
+        if device is None or device == '':
+            return -1
+
+        if isinstance(device, int):
+            if device in deviceList:
+                return device
+
+            log.error(f'audio.device {device} does not exist, using the default device')
+            return -1
 
         try:
-            if not deviceList.get(audioDeviceIndex):
-                audioDeviceIndex = -1
-        except Exception as ex:
-            log.error('audio.device is set to non-numerical value.')
+            pattern = re.compile(str(device), re.IGNORECASE)
+        except re.error as e:
+            log.error(f'audio.device "{device}" is not a valid regular expression: {e}')
+            return -1
+
+        for index, deviceName in deviceList.items():
+            if deviceName and pattern.search(deviceName):
+                return index
+
+        log.warning(f'No audio device matches audio.device "{device}", using the default device')
+        return -1
 
-        return audioDeviceIndex
+    """Persist the device selected by the user, so it is used again after a restart.
+    @param name: the name of the device
+    """
+    def save_audio_device(self, name):
+        if name and self.config.projectm.get('audio.deviceremember', True):
+            save_state(self.config, AUDIO_DEVICE_STATE, name)
 
     def next_audio_device(self):
         self.audio_capture_impl.next_audio_device()
 
+    """Feed the audio captured since the previous frame into projectM"""
+    def process_audio(self):
+        if self.journal:
+            self.journal.next_frame()
+
+        self.audio_capture_impl.process_audio()
+
+        if self.audio_analyzer:
+            features = self.audio_analyzer.analyze()
+
+            if self.shared_export:
+                self.shared_export.publish(self.audio_analyzer, features)
+
+    """Get the audio features of the current frame, computed once and shared by every subsystem.
+    @returns the latest AudioFeatures snapshot, or None if the audio analysis is disabled
+    """
+    def get_features(self):
+        if not self.audio_analyzer:
+            return None
+
+        return self.audio_analyzer.features
+
+    """Check whether the input has been silent long enough to throttle rendering"""
+    def is_idle(self):
+        if not self.silence_detector:
+            return False
+
+        return self.silence_detector.is_idle()
+
+    """Let the capture buffer follow the measured frame rate, called once per rendered frame"""
+    def frame_rendered(self):
+        if not self.buffer_sizer:
+            return
+
+        frames = self.buffer_sizer.frame_rendered(self.audio_capture_impl.get_buffer_size())
+        if frames:
+            self.audio_capture_impl.resize_buffer(frames)
+            self.buffer_resizes += 1
+
+    def get_stats(self):
+        stats = self.audio_capture_impl.get_stats()
+
+        if self.buffer_sizer:
+            stats['buffer_size'] = self.audio_capture_impl.get_buffer_size()
+            stats['buffer_resizes'] = self.buffer_resizes
+
+        if self.silence_detector:
+            stats.update(self.silence_detector.stats())
+
+        if self.audio_analyzer:
+            stats.update(self.audio_analyzer.stats())
+
+        if self.shared_export:
+            stats['shared_memory_published'] = self.shared_export.published
+
+        if self.journal:
+            stats.update(self.journal.stats())
+
+        return stats
+
     def uninitialize(self):
         if self.audio_capture_impl:
+            log.info(f'Audio capture statistics: {self.get_stats()}')
+            if self.latency_probe:
+                self.latency_probe.log_report()
+
             self.audio_capture_impl.uninitialize()
-            self.audio_capture_impl = None
\ No newline at end of file
+            self.audio_capture_impl = None
+
+        if self.shared_export:
+            self.shared_export.close()
+            self.shared_export = None
+
+        if self.journal:
+            self.journal.close()
+            self.journal = None
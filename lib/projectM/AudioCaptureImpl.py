@@ -0,0 +1,238 @@
+import logging
+
+import numpy as np
+
+from lib.projectM.ChannelMixer import ChannelMixer, parse_channel_map
+from lib.projectM.DriftCompensator import DriftCompensator
+from lib.projectM.PCMRingBuffer import PCMRingBuffer
+
+log = logging.getLogger()
+
+PROJECTM_STEREO = 2
+
+NO_SAMPLES = np.zeros(0, dtype=np.float32)
+
+class AudioCaptureImpl:
+    """Base class for the audio capture backends.
+    Backends with their own capture thread write interleaved float32 audio into self.ring_buffer,
+    backends without one override read_audio() to pull the audio once per rendered frame.
+    @param config: the projectMAR configuration
+    @param projectm_wrapper: the projectM wrapper receiving the captured audio
+    @param sample_rate: the requested sample rate
+    @param channels: the requested number of channels
+    """
+    name = None
+
+    def __init__(self, config, projectm_wrapper, sample_rate=44100, channels=2):
+        self.config = config
+        self.projectm_wrapper = projectm_wrapper
+
+        self._channels = channels
+        self._sampleRate = sample_rate
+
+        self._ringBufferFrames = config.projectm.get('audio.ringbufferframes', 8192)
+        self.ring_buffer = None
+
+        self._outputChannels = config.projectm.get('audio.channels', PROJECTM_STEREO)
+        self._channelMap = parse_channel_map(config.projectm.get('audio.channelmap', None))
+        self.mixer = None
+
+        self._driftCompensation = config.projectm.get('audio.driftcompensation', False)
+        self.drift_compensator = None
+
+        # Set by AudioCapture when the idle mode, the audio analysis or the audio journal are enabled
+        self.silence_detector = None
+        self.audio_analyzer = None
+        self.journal = None
+
+        # Set by AudioCapture to persist the device selected by the user
+        self.on_device_changed = None
+
+    def audio_device_list(self):
+        return {
+            -1: "Default capturing device"
+            }
+
+    """Start capturing from a device.
+    @param index: the index of the device in audio_device_list
+    @returns whether recording started
+    """
+    def start_recording(self, index):
+        log.error(f'{type(self).__name__} cannot record audio')
+        return False
+
+    def stop_recording(self):
+        pass
+
+    def next_audio_device(self):
+        pass
+
+    """Name of the device currently recorded from"""
+    def get_audio_device_name(self):
+        return None
+
+    """Notify AudioCapture that the user switched to another device.
+    @param name: the name of the device now recorded from
+    """
+    def device_changed(self, name):
+        if self.on_device_changed:
+            self.on_device_changed(name)
+
+    def uninitialize(self):
+        self.stop_recording()
+
+    """Size (in frames) of the blocks the capture device delivers, None if the backend cannot resize it"""
+    def get_buffer_size(self):
+        return None
+
+    """Change the size of the blocks the capture device delivers.
+    @param frames: the new block size in frames
+    """
+    def resize_buffer(self, frames):
+        pass
+
+    """Number of channels handed to projectM"""
+    def get_output_channels(self):
+        if self.mixer and not self.mixer.passthrough:
+            return self.mixer.out_channels
+
+        return self._channels
+
+    """Prepare the buffers for a stream format, must be called before any audio is captured.
+    @param channels: the number of interleaved channels delivered by the backend
+    @param sample_rate: the sample rate delivered by the backend
+    @param ring_buffer: whether the backend delivers audio through the ring buffer, or the PCMRingBuffer to use
+    """
+    def configure_stream(self, channels, sample_rate, ring_buffer=True):
+        self._channels = channels
+        self._sampleRate = sample_rate
+
+        if not self.mixer or self.mixer.in_channels != channels:
+            self.mixer = ChannelMixer(channels, self._outputChannels, self._ringBufferFrames, self._channelMap)
+
+        if isinstance(ring_buffer, PCMRingBuffer):
+            self.ring_buffer = ring_buffer
+        elif not ring_buffer:
+            self.ring_buffer = None
+        elif not self.ring_buffer or self.ring_buffer.channels != channels:
+            self.ring_buffer = PCMRingBuffer(self._ringBufferFrames, channels)
+        else:
+            self.ring_buffer.clear()
+
+        if self.ring_buffer and self._driftCompensation:
+            self.drift_compensator = DriftCompensator(
+                sample_rate,
+                self.config.projectm.get('audio.drifttarget', 1024),
+                self.config.projectm.get('audio.drifttolerance', 256),
+                self.config.projectm.get('audio.driftblock', 32)
+                )
+        else:
+            self.drift_compensator = None
+
+    """Pull the audio captured since the previous frame.
+    @returns a tuple of a float32 array of interleaved samples and the address of its first sample
+    """
+    def read_audio(self):
+        samples = self.ring_buffer.read()
+        return samples, self.ring_buffer.output_address
+
+    """Hand float32 samples to projectM.
+    @param address: the address of the interleaved samples
+    @param frames: the number of frames at the address
+    @param channels: the number of interleaved channels
+    """
+    def add_pcm(self, address, frames, channels):
+        self.projectm_wrapper.add_pcm_ptr(address, frames, channels)
+
+        if self.silence_detector:
+            self.silence_detector.update(address, frames, channels)
+
+        if self.audio_analyzer:
+            self.audio_analyzer.update(address, frames, channels, self._sampleRate)
+
+        if self.journal:
+            self.journal.record(address, frames, channels)
+
+    """Drain the captured audio into projectM, called once per rendered frame"""
+    def process_audio(self):
+        if not self.mixer:
+            return
+
+        if self.ring_buffer and self.drift_compensator:
+            self.process_audio_paced()
+            return
+
+        if self.ring_buffer and self.mixer.passthrough:
+            # Hand the ring buffer memory straight to projectM, in two runs when the data wraps around
+            address, count, wrapped = self.ring_buffer.peek()
+            if count:
+                self.add_pcm(address, count // self._channels, self._channels)
+            if wrapped:
+                self.add_pcm(self.ring_buffer.address, wrapped // self._channels, self._channels)
+
+            self.ring_buffer.consume(count + wrapped)
+            return
+
+        samples, address = self.read_audio()
+        if not samples.size:
+            return
+
+        if self.mixer.passthrough:
+            self.add_pcm(address, samples.size // self._channels, self._channels)
+        else:
+            frames = self.mixer.mix(samples)
+            self.add_pcm(self.mixer.address, frames, self.mixer.out_channels)
+
+    """Drain the audio due by the render clock into projectM, dropping or duplicating a small block
+    whenever the drift compensator asks for it to hold the backlog at its target level
+    """
+    def process_audio_paced(self):
+        backlog = self.ring_buffer.available() // self._channels
+        frames, correction = self.drift_compensator.update(backlog)
+
+        dropped = duplicated = 0
+        if correction > 0:
+            dropped = max(0, min(correction, backlog - frames))
+            self.ring_buffer.consume(dropped * self._channels)
+        elif correction < 0:
+            # Take less from the backlog and make up for it by repeating a block of what is handed over
+            duplicated = min(-correction, frames // 2)
+            frames -= duplicated
+
+        if self.mixer.passthrough:
+            address, count, wrapped = self.ring_buffer.peek(frames * self._channels)
+            if count:
+                self.add_pcm(address, count // self._channels, self._channels)
+            if wrapped:
+                self.add_pcm(self.ring_buffer.address, wrapped // self._channels, self._channels)
+            duplicated = min(duplicated, count // self._channels)
+            if duplicated:
+                self.add_pcm(address, duplicated, self._channels)
+
+            self.ring_buffer.consume(count + wrapped)
+            delivered = (count + wrapped) // self._channels
+        else:
+            samples = self.ring_buffer.read(frames * self._channels)
+            delivered = self.mixer.mix(samples) if samples.size else 0
+            if delivered:
+                self.add_pcm(self.mixer.address, delivered, self.mixer.out_channels)
+            duplicated = min(duplicated, delivered)
+            if duplicated:
+                self.add_pcm(self.mixer.address, duplicated, self.mixer.out_channels)
+
+        self.drift_compensator.record(delivered, dropped, duplicated)
+
+    def get_stats(self):
+        stats = {
+            'backend': self.name,
+            'channels': self._channels,
+            'sample_rate': self._sampleRate
+            }
+
+        if self.ring_buffer:
+            stats.update(self.ring_buffer.stats())
+
+        if self.drift_compensator:
+            stats.update(self.drift_compensator.stats())
+
+        return stats
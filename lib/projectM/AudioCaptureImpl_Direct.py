@@ -0,0 +1,178 @@
+import logging
+import time
+
+import numpy as np
+
+from lib.constants import ACTIVE_SOURCES
+from lib.projectM.AudioCaptureImpl import AudioCaptureImpl, NO_SAMPLES, PROJECTM_STEREO
+from lib.projectM.AudioCaptureImpl_Pipe import PipeReader, get_record_command
+from lib.projectM.PCMRingBuffer import PCMRingBuffer
+
+log = logging.getLogger()
+
+# Seconds to wait before retrying sources that failed to start recording
+SOURCE_RETRY_INTERVAL = 2
+
+class DirectAudioCapture(AudioCaptureImpl):
+    """Capture backend recording the sources activated by AudioCtrl directly and in parallel, mixing
+    them in process instead of routing them through module-loopback and the projectMAR null sink.
+    Every source gets its own parec reader and ring buffer, the mix is built once per rendered frame.
+    """
+    name = 'direct'
+
+    def __init__(self, config, projectm_wrapper, sample_rate=44100, channels=PROJECTM_STEREO):
+        super().__init__(config, projectm_wrapper, sample_rate, channels)
+
+        self._latency = config.projectm.get('audio.pipelatency', 20)
+        self._blockFrames = int(sample_rate / config.projectm.get('projectm.fps', 60))
+
+        self._sources = dict()
+        self._sourcesVersion = None
+        self._retryVersion = None
+        self._retryTime = 0
+
+        self._mix = np.zeros(self._ringBufferFrames * channels, dtype=np.float32)
+        self._mix_address = self._mix.ctypes.data
+
+        self._recording = False
+        self._reads = 0
+        self._clipped = 0
+
+    def audio_device_list(self):
+        _, sources = ACTIVE_SOURCES.snapshot()
+
+        deviceList = {
+            -1: 'Sources activated by the audio controller'
+            }
+        for i, name in enumerate(sources):
+            deviceList[i] = name
+
+        return deviceList
+
+    def start_recording(self, index):
+        self.configure_stream(self._channels, self._sampleRate, ring_buffer=False)
+        self._recording = True
+        self.update_sources()
+        return True
+
+    def stop_recording(self):
+        self._recording = False
+
+        for name in list(self._sources):
+            self.close_source(name)
+
+        self._sourcesVersion = None
+        self._retryVersion = None
+
+    """Open readers for newly activated sources and close the ones that went away.
+    The version of the active sources is only recorded once every source is recording, sources that failed
+    to start are retried every SOURCE_RETRY_INTERVAL seconds.
+    """
+    def update_sources(self):
+        if ACTIVE_SOURCES.version == self._sourcesVersion:
+            return
+
+        if ACTIVE_SOURCES.version == self._retryVersion and time.monotonic() < self._retryTime:
+            return
+
+        version, sources = ACTIVE_SOURCES.snapshot()
+
+        for name in list(self._sources):
+            if name not in sources:
+                self.close_source(name)
+
+        failed = 0
+        for name, source_type in sources.items():
+            if name not in self._sources and not self.open_source(name, source_type):
+                failed += 1
+
+        if failed:
+            self._retryVersion = version
+            self._retryTime = time.monotonic() + SOURCE_RETRY_INTERVAL
+            return
+
+        self._sourcesVersion = version
+        self._retryVersion = None
+
+    """Start recording a PulseAudio source.
+    @param name: the name of the source
+    @param source_type: the source type (aux/mic)
+    @returns True if the source is recording
+    """
+    def open_source(self, name, source_type=None):
+        ring_buffer = PCMRingBuffer(self._ringBufferFrames, self._channels)
+        reader = PipeReader(get_record_command('parec', name, self._channels, self._sampleRate, self._latency), ring_buffer, self._blockFrames)
+
+        try:
+            reader.start()
+        except:
+            log.exception(f'Failed to record {source_type} source {name}, retrying in {SOURCE_RETRY_INTERVAL} seconds')
+            return False
+
+        log.info(f'Recording {source_type} source {name} directly')
+        self._sources[name] = reader
+        return True
+
+    """Stop recording a PulseAudio source.
+    @param name: the name of the source
+    """
+    def close_source(self, name):
+        reader = self._sources.pop(name)
+        self._reads += reader.reads
+        reader.stop()
+
+        log.info(f'Stopped recording source {name}')
+
+    """Mix the audio of all sources captured since the previous frame"""
+    def read_audio(self):
+        if not self._recording:
+            return NO_SAMPLES, 0
+
+        self.update_sources()
+        if not self._sources:
+            return NO_SAMPLES, 0
+
+        # Sources run on their own clocks, the longest backlog sets the length and shorter ones are padded with silence
+        count = 0
+        readers = list(self._sources.values())
+        for reader in readers:
+            count = max(count, min(reader.ring_buffer.available(), self._mix.size))
+
+        count -= count % self._channels
+        if not count:
+            return NO_SAMPLES, 0
+
+        mix = self._mix[:count]
+        mix.fill(0)
+
+        for reader in readers:
+            samples = reader.ring_buffer.read(count)
+            np.add(mix[:samples.size], samples, out=mix[:samples.size])
+
+        if len(readers) > 1:
+            peak = max(float(mix.max()), -float(mix.min()))
+            if peak > 1:
+                self._clipped += 1
+                np.clip(mix, -1, 1, out=mix)
+
+        return mix, self._mix_address
+
+    def get_stats(self):
+        stats = super().get_stats()
+
+        reads = self._reads
+        overruns = underruns = 0
+        for reader in self._sources.values():
+            reads += reader.reads
+            overruns += reader.ring_buffer.overruns
+            underruns += reader.ring_buffer.underruns
+
+        stats.update({
+            'sources': list(self._sources),
+            'reads': reads,
+            'overruns': overruns,
+            'underruns': underruns,
+            'clipped': self._clipped
+            })
+
+        return stats
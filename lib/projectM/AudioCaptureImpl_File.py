@@ -0,0 +1,177 @@
+import ctypes
+import logging
+import os
+import struct
+import time
+
+import numpy as np
+
+from lib.projectM.AudioCaptureImpl import AudioCaptureImpl, NO_SAMPLES
+from lib.projectM.LatencyProbe import generate_impulse_train
+
+log = logging.getLogger()
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+"""Load a PCM (8/16/24/32 bit) or IEEE float WAV file.
+@param path: the path to the WAV file
+@returns a tuple of the interleaved float32 samples, the channel count and the sample rate
+"""
+def load_wav(path):
+    with open(path, 'rb') as infile:
+        riff, _, wave = struct.unpack('<4sI4s', infile.read(12))
+        if riff != b'RIFF' or wave != b'WAVE':
+            raise ValueError(f'{path} is not a WAV file')
+
+        audio_format = channels = sample_rate = bits = None
+        while True:
+            header = infile.read(8)
+            if len(header) < 8:
+                raise ValueError(f'{path} has no data chunk')
+
+            chunk_id, chunk_size = struct.unpack('<4sI', header)
+            if chunk_id == b'fmt ':
+                fmt = infile.read(chunk_size + (chunk_size & 1))
+                audio_format, channels, sample_rate, _, _, bits = struct.unpack('<HHIIHH', fmt[:16])
+                if audio_format == WAVE_FORMAT_EXTENSIBLE:
+                    audio_format = struct.unpack('<H', fmt[24:26])[0]
+
+            elif chunk_id == b'data':
+                data = infile.read(chunk_size)
+                break
+
+            else:
+                infile.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+    if audio_format == WAVE_FORMAT_IEEE_FLOAT and bits == 32:
+        samples = np.frombuffer(data, dtype='<f4').astype(np.float32)
+    elif audio_format == WAVE_FORMAT_PCM and bits == 8:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif audio_format == WAVE_FORMAT_PCM and bits == 16:
+        samples = np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768
+    elif audio_format == WAVE_FORMAT_PCM and bits == 24:
+        raw = np.frombuffer(data[:len(data) - len(data) % 3], dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        samples = ((raw[:, 0] << 8 | raw[:, 1] << 16 | raw[:, 2] << 24) >> 8).astype(np.float32) / 8388608
+    elif audio_format == WAVE_FORMAT_PCM and bits == 32:
+        samples = np.frombuffer(data, dtype='<i4').astype(np.float32) / 2147483648
+    else:
+        raise ValueError(f'{path} uses an unsupported WAV format {audio_format} ({bits} bit)')
+
+    return samples[:samples.size - samples.size % channels], channels, sample_rate
+
+class FileAudioCapture(AudioCaptureImpl):
+    """Capture backend replaying a WAV or raw float32 file, either in real time or one fixed
+    block per rendered frame so the full capture->render path can run without a sound card.
+    """
+    name = 'file'
+
+    def __init__(self, config, projectm_wrapper, sample_rate=44100, channels=2):
+        super().__init__(config, projectm_wrapper, sample_rate, channels)
+
+        self._path = config.projectm.get('audio.filepath', '')
+        self._realtime = config.projectm.get('audio.filerealtime', True)
+        self._loop = config.projectm.get('audio.fileloop', True)
+        self._fps = config.projectm.get('projectm.fps', 60)
+
+        self._samples = None
+        self._samples_address = None
+        self._frames = 0
+        self._position = 0
+        self._start = None
+
+        self._loops = 0
+        self._delivered_frames = 0
+
+        # Set by AudioCapture in latency measurement mode, the file is replaced by the probe's impulse train
+        self.latency_probe = None
+
+    def audio_device_list(self):
+        return {
+            -1: self._path
+            }
+
+    """Load the configured file into memory.
+    @returns a tuple of the interleaved float32 samples, the channel count and the sample rate
+    """
+    def load_file(self):
+        if self.latency_probe:
+            samples = generate_impulse_train(self.latency_probe.sample_rate, self._channels, self.latency_probe.interval_frames)
+            return samples, self._channels, self.latency_probe.sample_rate
+
+        if self._path.lower().endswith('.wav'):
+            return load_wav(self._path)
+
+        channels = self.config.projectm.get('audio.filechannels', self._channels)
+        sample_rate = self.config.projectm.get('audio.filesamplerate', self._sampleRate)
+        samples = np.fromfile(self._path, dtype='<f4').astype(np.float32)
+
+        return samples[:samples.size - samples.size % channels], channels, sample_rate
+
+    def start_recording(self, index):
+        try:
+            samples, channels, sample_rate = self.load_file()
+        except:
+            log.exception(f'Failed to load audio file {self._path}')
+            return False
+
+        self._samples = np.ascontiguousarray(samples)
+        self._samples_address = self._samples.ctypes.data
+        self._frames = self._samples.size // channels
+        self._position = 0
+        self._start = time.perf_counter_ns()
+
+        self.configure_stream(channels, sample_rate, ring_buffer=False)
+
+        log.info(f'Replaying audio file {self._path} ({self._frames / sample_rate:.1f}s, {channels} channels at {sample_rate} Hz) '
+                 f'{"in real time" if self._realtime else "unthrottled"}')
+        return True
+
+    def stop_recording(self):
+        self._samples = None
+        self._start = None
+
+    """Get the file audio due since the previous frame, a view into the loaded file so nothing is copied"""
+    def read_audio(self):
+        if self._samples is None or self._position >= self._frames:
+            return NO_SAMPLES, 0
+
+        if self._realtime:
+            # Number of frames that would have been captured by now, minus what was already delivered
+            due = (time.perf_counter_ns() - self._start) * self._sampleRate // 1000000000 - self._delivered_frames
+        else:
+            due = int(self._sampleRate / self._fps)
+
+        frames = max(0, min(due, self._frames - self._position, self._ringBufferFrames))
+
+        start = self._position * self._channels
+        samples = self._samples[start:start + frames * self._channels]
+        address = self._samples_address + start * ctypes.sizeof(ctypes.c_float)
+
+        self._position += frames
+        self._delivered_frames += frames
+
+        if self._position >= self._frames and self._loop:
+            self._position = 0
+            self._loops += 1
+
+        return samples, address
+
+    def process_audio(self):
+        first_frame = self._delivered_frames
+        super().process_audio()
+
+        if self.latency_probe and self._delivered_frames > first_frame:
+            self.latency_probe.on_pcm_added(first_frame, self._delivered_frames, self._start)
+
+    def get_stats(self):
+        stats = super().get_stats()
+        stats.update({
+            'realtime': self._realtime,
+            'position': self._position,
+            'delivered_frames': self._delivered_frames,
+            'loops': self._loops
+            })
+
+        return stats
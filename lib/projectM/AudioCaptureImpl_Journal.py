@@ -0,0 +1,129 @@
+import logging
+import time
+
+import numpy as np
+
+from lib.projectM.AudioCaptureImpl import AudioCaptureImpl, NO_SAMPLES
+from lib.projectM.PCMJournal import PCMJournalReader
+
+log = logging.getLogger()
+
+class JournalAudioCapture(AudioCaptureImpl):
+    """Capture backend replaying an audio journal (see PCMJournalWriter) through the regular capture path.
+    In real time mode the entries are replayed at their original timing, otherwise the entries of exactly
+    one recorded frame are replayed per rendered frame, so the rendering runs as fast as projectM.fps
+    allows with the same input per frame as the recording.
+    """
+    name = 'journal'
+
+    def __init__(self, config, projectm_wrapper, sample_rate=44100, channels=2):
+        super().__init__(config, projectm_wrapper, sample_rate, channels)
+
+        self._path = config.projectm.get('audio.journalreplay', '')
+        self._realtime = config.projectm.get('audio.journalrealtime', True)
+        self._loop = config.projectm.get('audio.journalloop', False)
+
+        self._reader = None
+        self._entries = list()
+        self._position = 0
+        self._start = None
+
+        self._output = None
+        self._output_address = None
+
+        self._replayed = 0
+        self._skipped = 0
+        self._loops = 0
+
+    def audio_device_list(self):
+        return {
+            -1: self._path
+            }
+
+    def start_recording(self, index):
+        try:
+            self._reader = PCMJournalReader(self._path)
+        except:
+            log.exception(f'Failed to open audio journal {self._path}')
+            return False
+
+        self._entries = self._reader.entries()
+        self._position = 0
+        self._start = None
+
+        self.configure_stream(self._reader.channels, self._reader.sample_rate, ring_buffer=False)
+
+        self._output = np.zeros(self._ringBufferFrames * self._reader.channels, dtype=np.float32)
+        self._output_address = self._output.ctypes.data
+
+        duration = (self._entries[-1].timestamp - self._entries[0].timestamp) / 1000000000 if self._entries else 0
+        log.info(f'Replaying audio journal {self._path} ({len(self._entries)} entries, {duration:.1f}s) '
+                 f'{"in real time" if self._realtime else "one recorded frame per rendered frame"}')
+        return True
+
+    def stop_recording(self):
+        if self._reader:
+            self._reader.close()
+            self._reader = None
+
+        self._entries = list()
+
+    """Get the entries due for the current rendered frame.
+    @returns the index after the last due entry
+    """
+    def due_entries(self):
+        first = self._entries[self._position]
+
+        end = self._position
+        if self._realtime:
+            if self._start is None:
+                self._start = time.perf_counter_ns() - first.timestamp
+
+            now = time.perf_counter_ns() - self._start
+            while end < len(self._entries) and self._entries[end].timestamp <= now:
+                end += 1
+        else:
+            while end < len(self._entries) and self._entries[end].frame == first.frame:
+                end += 1
+
+        return end
+
+    """Copy the journal entries due for the current frame"""
+    def read_audio(self):
+        if not self._entries:
+            return NO_SAMPLES, 0
+
+        if self._position >= len(self._entries):
+            if not self._loop:
+                return NO_SAMPLES, 0
+
+            self._position = 0
+            self._start = None
+            self._loops += 1
+
+        end = self.due_entries()
+
+        count = 0
+        for entry in self._entries[self._position:end]:
+            # Entries recorded with another channel layout (e.g. while the device changed) cannot be mixed in
+            if entry.channels != self._channels:
+                self._skipped += 1
+                continue
+
+            count += self._reader.read(entry, self._output[count:])
+
+        self._replayed += end - self._position
+        self._position = end
+
+        return self._output[:count], self._output_address
+
+    def get_stats(self):
+        stats = super().get_stats()
+        stats.update({
+            'realtime': self._realtime,
+            'replayed_entries': self._replayed,
+            'skipped_entries': self._skipped,
+            'loops': self._loops
+            })
+
+        return stats
@@ -0,0 +1,203 @@
+import ctypes
+import logging
+import threading
+
+import numpy as np
+
+from subprocess import DEVNULL, PIPE, Popen
+
+from lib.projectM.AudioCaptureImpl import AudioCaptureImpl
+
+log = logging.getLogger()
+
+DEFAULT_PIPE_SOURCE = 'platform-project_mar.stereo.monitor'
+
+"""Build the command line of a recording process writing raw float32 audio to stdout.
+@param program: the recording program (parec or arecord)
+@param source: the PulseAudio source or ALSA device to record from
+@param channels: the number of channels to record
+@param sample_rate: the sample rate to record at
+@param latency: the requested capture latency in milliseconds (parec only)
+@returns the command line as a list
+"""
+def get_record_command(program, source, channels, sample_rate, latency=20):
+    if program == 'arecord':
+        return [
+            'arecord', '-q',
+            '-D', source,
+            '-f', 'FLOAT_LE',
+            '-c', str(channels),
+            '-r', str(sample_rate),
+            '-t', 'raw'
+            ]
+
+    return [
+        'parec',
+        f'--device={source}',
+        '--format=float32le',
+        f'--rate={sample_rate}',
+        f'--channels={channels}',
+        f'--latency-msec={latency}',
+        '--raw'
+        ]
+
+class PipeReader:
+    """Run a recording process and copy its raw float32 output into a ring buffer on a reader thread.
+    @param args: the command line of the recording process
+    @param ring_buffer: the PCMRingBuffer receiving the audio
+    @param block_frames: the number of frames read from the process at once
+    """
+    def __init__(self, args, ring_buffer, block_frames):
+        self.args = args
+        self.ring_buffer = ring_buffer
+        self.block_frames = block_frames
+
+        self._process = None
+        self._thread = None
+        self._stop_event = threading.Event()
+
+        self.reads = 0
+
+    def start(self):
+        log.info(f'Starting audio capture process: {" ".join(self.args)}')
+        self._process = Popen(self.args, stdout=PIPE, stderr=DEVNULL, bufsize=0)
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.read_stream, args=(self._process,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+        if self._process:
+            self._process.kill()
+            self._process.wait()
+            self._process = None
+
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    """Whether the recording process is still running"""
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    """Copy the output of the recording process into the ring buffer (reader thread).
+    @param process: the recording process
+    """
+    def read_stream(self, process):
+        channels = self.ring_buffer.channels
+        frame_bytes = channels * ctypes.sizeof(ctypes.c_float)
+
+        block = np.zeros(self.block_frames * channels, dtype=np.float32)
+        block_address = block.ctypes.data
+        block_view = memoryview(block).cast('B')
+        filled = 0
+
+        while not self._stop_event.is_set():
+            read = process.stdout.readinto(block_view[filled:])
+            if not read:
+                break
+
+            self.reads += 1
+            filled += read
+
+            # Only whole frames are published, a partial frame is kept for the next read
+            complete = filled - (filled % frame_bytes)
+            self.ring_buffer.write(block_address, complete // ctypes.sizeof(ctypes.c_float))
+
+            filled -= complete
+            if filled:
+                ctypes.memmove(block_address, block_address + complete, filled)
+
+        if not self._stop_event.is_set():
+            log.error(f'Audio capture process {self.args[0]} exited with return code {process.poll()}')
+
+class PipeAudioCapture(AudioCaptureImpl):
+    """Capture backend reading raw float32 audio from a recording process (parec or arecord)"""
+    name = 'pipe'
+
+    def __init__(self, config, projectm_wrapper, sample_rate=44100, channels=2):
+        super().__init__(config, projectm_wrapper, sample_rate, channels)
+
+        self._program = config.projectm.get('audio.pipeprogram', 'parec')
+        self._source = config.projectm.get('audio.pipesource', DEFAULT_PIPE_SOURCE)
+        self._latency = config.projectm.get('audio.pipelatency', 20)
+        self._blockFrames = int(sample_rate / config.projectm.get('projectm.fps', 60))
+
+        self._devices = list()
+        self._currentAudioDeviceIndex = -1
+
+        self._reader = None
+        self._reads = 0
+
+    def audio_device_list(self):
+        deviceList = {
+            -1: self._source
+            }
+
+        if self._program == 'parec':
+            try:
+                process = Popen(['pactl', 'list', 'short', 'sources'], stdout=PIPE, stderr=DEVNULL, universal_newlines=True)
+                stdout, _ = process.communicate()
+
+                self._devices = [line.split('\t')[1] for line in stdout.splitlines() if '\t' in line]
+                for i, source in enumerate(self._devices):
+                    deviceList[i] = source
+            except Exception as e:
+                log.warning(f'Unable to list PulseAudio sources: {e}')
+
+        return deviceList
+
+    """Build the command line of the recording process.
+    @param source: the PulseAudio source or ALSA device to record from
+    """
+    def get_command(self, source):
+        return get_record_command(self._program, source, self._channels, self._sampleRate, self._latency)
+
+    def start_recording(self, index):
+        self._currentAudioDeviceIndex = index
+
+        source = self._source
+        if 0 <= index < len(self._devices):
+            source = self._devices[index]
+
+        try:
+            self.configure_stream(self._channels, self._sampleRate)
+
+            self._reader = PipeReader(self.get_command(source), self.ring_buffer, self._blockFrames)
+            self._reader.start()
+        except:
+            log.exception('Failed to start recording!')
+            return False
+
+        return True
+
+    def stop_recording(self):
+        if self._reader:
+            self._reads += self._reader.reads
+            self._reader.stop()
+            self._reader = None
+
+    def next_audio_device(self):
+        self.stop_recording()
+
+        device_id = ((self._currentAudioDeviceIndex + 2) % (len(self._devices) + 1)) - 1
+
+        self.start_recording(device_id)
+        self.device_changed(self.get_audio_device_name())
+
+    def get_audio_device_name(self):
+        if 0 <= self._currentAudioDeviceIndex < len(self._devices):
+            return self._devices[self._currentAudioDeviceIndex]
+
+        return self._source
+
+    def get_stats(self):
+        stats = super().get_stats()
+        stats.update({
+            'program': self._program,
+            'reads': self._reads + (self._reader.reads if self._reader else 0)
+            })
+
+        return stats
@@ -1,21 +1,53 @@
 import sdl2
 import ctypes
 import logging
+import threading
+import time
 import numpy as np
 
+from lib.projectM.AudioCaptureImpl import AudioCaptureImpl
+from lib.projectM.PCMRingBuffer import PCMRingBuffer
+
 log = logging.getLogger()
 
-class SDLAudioCapture:
+CAPTURE_MODE_CALLBACK = 'callback'
+CAPTURE_MODE_QUEUE = 'queue'
+
+# Seconds to wait for the first block of a new device before swapping to it anyway
+SWITCH_TIMEOUT = 1.0
+
+class SDLAudioCapture(AudioCaptureImpl):
+    """Capture backend recording from an SDL audio capture device"""
+    name = 'sdl'
+
     def __init__(self, config, projectm_wrapper, sample_rate=44100, channels=2, samples=1024):
-        self.projectm_wrapper = projectm_wrapper
+        super().__init__(config, projectm_wrapper, sample_rate, channels)
 
         self._currentAudioDeviceIndex = -1
         self._currentAudioDeviceID = 0
-        self._channels = channels
+
+        self._device = None
+        self._pendingDevice = None
+        self._switchThread = None
+        self._switchStart = 0
+        self._reopenDevice = False
+        self.device_switches = 0
         
         self._requestedSampleFrequency = sample_rate
         self._requestedSampleCount = sample_rate / config.projectm.get('projectm.fps', 60)
 
+        self._captureMode = config.projectm.get('audio.capturemode', CAPTURE_MODE_CALLBACK)
+        if self._captureMode not in (CAPTURE_MODE_CALLBACK, CAPTURE_MODE_QUEUE):
+            log.warning(f'Unknown audio.captureMode "{self._captureMode}", using {CAPTURE_MODE_CALLBACK}')
+            self._captureMode = CAPTURE_MODE_CALLBACK
+
+        # Reusable destination for SDL_DequeueAudio in queue mode
+        self._queue_buffer = None
+        self._queue_buffer_address = None
+        self._queue_depth = 0
+        self._queue_depth_max = 0
+        self._queue_overruns = 0
+
         sdl2.SDL_SetHint(sdl2.SDL_HINT_AUDIO_INCLUDE_MONITORS, b"1")
         sdl2.SDL_InitSubSystem(sdl2.SDL_INIT_AUDIO)
 
@@ -36,83 +68,279 @@ class SDLAudioCapture:
         return deviceList
 
     def start_recording(self, index):
-        self._currentAudioDeviceIndex = index
-
         try:
-            if self.open_audio_device():
-                sdl2.SDL_PauseAudioDevice(self._currentAudioDeviceID, False)
+            device = self.open_audio_device(index)
+            if device:
+                self.activate_audio_device(device)
+                return True
         except:
             log.exception('Failed to start recording!')
 
+        return False
+
     def stop_recording(self):
-        if self._currentAudioDeviceID:
-            sdl2.SDL_PauseAudioDevice(self._currentAudioDeviceID, True)
-            sdl2.SDL_CloseAudioDevice(self._currentAudioDeviceID)
-            self._currentAudioDeviceID = 0
+        for device in (self._pendingDevice, self._device):
+            if device:
+                device.close()
 
-    def next_audio_device(self):
-        self.stop_recording()
+        self._pendingDevice = None
+        self._device = None
+        self._currentAudioDeviceID = 0
 
+    def next_audio_device(self):
         device_id = ((self._currentAudioDeviceIndex + 2) % (sdl2.SDL_GetNumAudioDevices(True) + 1)) - 1
 
-        self.start_recording(device_id)
+        self.select_audio_device(device_id)
+
+    """Switch to another capture device without interrupting the audio.
+    The new device is opened and primed on a worker thread while the current device keeps feeding projectM,
+    the render loop swaps them once the new device delivered its first block.
+    @param index: the index of the capture device, -1 for the default device
+    """
+    def select_audio_device(self, index):
+        if self._pendingDevice or (self._switchThread and self._switchThread.is_alive()):
+            log.warning('Still switching the audio recording device, ignoring the request')
+            return
+
+        self._switchStart = time.perf_counter()
+        self._switchThread = threading.Thread(target=self.prepare_audio_device, args=(index,), daemon=True)
+        self._switchThread.start()
+
+    """Open and start a capture device for a later swap (worker thread).
+    @param index: the index of the capture device
+    """
+    def prepare_audio_device(self, index):
+        try:
+            self._pendingDevice = self.open_audio_device(index)
+        except:
+            log.exception('Failed to open the next audio recording device!')
+
+        # Devices that can only be opened once (e.g. ALSA hardware) are reopened the old way
+        if not self._pendingDevice and index == self._currentAudioDeviceIndex:
+            self._reopenDevice = True
+
+    """Swap to the pending device once it is primed (render loop)"""
+    def swap_audio_device(self):
+        device = self._pendingDevice
+
+        if self._captureMode == CAPTURE_MODE_QUEUE:
+            primed = sdl2.SDL_GetQueuedAudioSize(device.device_id) > 0
+        else:
+            primed = device.ring_buffer.available() > 0
+
+        if not primed and time.perf_counter() - self._switchStart < SWITCH_TIMEOUT:
+            return
+
+        previous = self._device
+        self._pendingDevice = None
+        self.activate_audio_device(device)
+
+        # Closing waits for the SDL audio thread of the old device, which must not stall the render loop
+        if previous:
+            threading.Thread(target=previous.close, daemon=True).start()
+
+        self.device_switches += 1
+        log.info(f'Switched to audio recording device "{device.name}" after {(time.perf_counter() - self._switchStart) * 1000:.0f}ms')
+        self.device_changed(device.name)
+
+    """Make an opened device the one feeding projectM.
+    @param device: the opened SDLCaptureDevice
+    """
+    def activate_audio_device(self, device):
+        self._device = device
+        self._currentAudioDeviceIndex = device.index
+        self._currentAudioDeviceID = device.device_id
+
+        self.configure_stream(device.channels, device.sample_rate, ring_buffer=device.ring_buffer or False)
+
+        if device.ring_buffer:
+            # Only keep the most recent block, the rest overlaps with what the previous device delivered
+            excess = device.ring_buffer.available() - int(self._requestedSampleCount) * device.channels
+            if excess > 0:
+                device.ring_buffer.consume(excess - excess % device.channels)
+
+        if self._captureMode == CAPTURE_MODE_QUEUE:
+            if self._queue_buffer is None or self._queue_buffer.size != self._ringBufferFrames * self._channels:
+                self._queue_buffer = np.zeros(self._ringBufferFrames * self._channels, dtype=np.float32)
+                self._queue_buffer_address = self._queue_buffer.ctypes.data
 
     def set_audio_device_index(self, index):
-        if index > 1 and index < sdl2.SDL_GetNumAudioDevices(True):
-            self._currentAudioDeviceID = index
-            self.start_recording()
+        if index >= -1 and index < sdl2.SDL_GetNumAudioDevices(True):
+            self.select_audio_device(index)
 
     def get_audio_device_index(self):
-        return self._currentAudioDeviceID
+        return self._currentAudioDeviceIndex
+
+    def get_audio_device_name(self):
+        return self._device.name if self._device else None
+
+    def get_buffer_size(self):
+        return int(self._requestedSampleCount)
+
+    """Reopen the capture device with a new buffer size. The current device keeps recording until the reopened
+    one delivers audio; the swap starts from the new device's buffer, audio the old device buffered but was not
+    read yet is dropped (configure_stream replaces or clears the ring buffer).
+    @param frames: the new block size in frames
+    """
+    def resize_buffer(self, frames):
+        self._requestedSampleCount = frames
+
+        if self._device:
+            self.select_audio_device(self._currentAudioDeviceIndex)
+
+    """Open and start a capture device, it records into its own buffers until it is activated.
+    @param index: the index of the capture device, -1 for the default device
+    @returns the opened SDLCaptureDevice or None
+    """
+    def open_audio_device(self, index):
+        deviceName = sdl2.SDL_GetAudioDeviceName(index, True) if index >= 0 else None
+        device = SDLCaptureDevice(index, deviceName)
+
+        if not device.open(self._requestedSampleFrequency, self._channels, int(self._requestedSampleCount),
+                           self._ringBufferFrames, self._captureMode == CAPTURE_MODE_QUEUE):
+            log.error(f'Failed to open audio device "{deviceName}" (ID {index}): {sdl2.SDL_GetError()}')
+            return None
+
+        log.info(f'Opened audio recording device "{device.name}" (ID {index}) with {device.channels} channels at {device.sample_rate} Hz in {self._captureMode} mode')
+
+        sdl2.SDL_PauseAudioDevice(device.device_id, False)
+
+        return device
+
+    """Dequeue the audio SDL has captured since the previous frame (queue mode only).
+    @returns a view of the reusable queue buffer holding the dequeued samples
+    """
+    def dequeue_audio(self):
+        sample_size = ctypes.sizeof(ctypes.c_float)
+        capacity_bytes = self._queue_buffer.size * sample_size
+
+        queued_bytes = sdl2.SDL_GetQueuedAudioSize(self._currentAudioDeviceID)
+        self._queue_depth = queued_bytes // sample_size
+        self._queue_depth_max = max(self._queue_depth_max, self._queue_depth)
+
+        # Skip over anything that no longer fits so projectM always gets the most recent audio
+        while queued_bytes > capacity_bytes:
+            self._queue_overruns += 1
+            queued_bytes -= sdl2.SDL_DequeueAudio(self._currentAudioDeviceID, self._queue_buffer_address, capacity_bytes)
+
+        frame_bytes = self._channels * sample_size
+        dequeued_bytes = sdl2.SDL_DequeueAudio(self._currentAudioDeviceID, self._queue_buffer_address, queued_bytes - (queued_bytes % frame_bytes))
+
+        return self._queue_buffer[:dequeued_bytes // sample_size]
+
+    def process_audio(self):
+        if self._pendingDevice:
+            self.swap_audio_device()
+        elif self._reopenDevice:
+            self._reopenDevice = False
+            index = self._currentAudioDeviceIndex
+            self.stop_recording()
+            self.start_recording(index)
+
+        super().process_audio()
+
+    """Pull the queued audio once per frame, the callback mode uses the ring buffer instead"""
+    def read_audio(self):
+        if self._captureMode == CAPTURE_MODE_QUEUE:
+            if not self._currentAudioDeviceID:
+                return self._queue_buffer[:0], self._queue_buffer_address
+
+            return self.dequeue_audio(), self._queue_buffer_address
+
+        return super().read_audio()
+
+    def get_stats(self):
+        stats = super().get_stats()
+        stats.update({
+            'capture_mode': self._captureMode,
+            'device': self.get_audio_device_name(),
+            'device_switches': self.device_switches
+            })
+
+        if self._captureMode == CAPTURE_MODE_QUEUE:
+            stats.update({
+                'queue_depth': self._queue_depth,
+                'queue_depth_max': self._queue_depth_max,
+                'queue_overruns': self._queue_overruns
+                })
+
+        return stats
+
+    def uninitialize(self):
+        self.stop_recording()
+        sdl2.SDL_QuitSubSystem(sdl2.SDL_INIT_AUDIO)
+
+class SDLCaptureDevice:
+    """An SDL capture device recording into its own buffers, so a new device can be opened
+    and primed while the active one keeps feeding projectM.
+    @param index: the index of the capture device, -1 for the default device
+    @param name: the name of the capture device, None for the default device
+    """
+    def __init__(self, index, name):
+        self.index = index
+        self.name = name or 'Default capturing device'
+        self._deviceName = name
+
+        self.device_id = 0
+        self.channels = 0
+        self.sample_rate = 0
+        self.ring_buffer = None
 
-    def open_audio_device(self):
         self.user_data = ctypes.py_object(self)
-        user_data_ptr = ctypes.cast(ctypes.pointer(self.user_data), ctypes.c_void_p)
-
-        requestedSpecs = sdl2.SDL_AudioSpec(
-            self._requestedSampleFrequency, 
-            sdl2.AUDIO_F32SYS, 
-            self._channels, 
-            int(self._requestedSampleCount),
-            audio_callback,
-            user_data_ptr
-            )
+
+    """Open the device paused.
+    @param sample_rate: the requested sample rate
+    @param channels: the requested number of channels
+    @param samples: the requested buffer size in frames
+    @param ring_buffer_frames: the capacity of the ring buffer (callback mode)
+    @param queue: whether SDL should queue the audio instead of calling back into Python
+    @returns a boolean indicating whether the device was opened
+    """
+    def open(self, sample_rate, channels, samples, ring_buffer_frames, queue=False):
+        if queue:
+            # Without a callback SDL queues the captured audio and never calls into Python
+            requestedSpecs = sdl2.SDL_AudioSpec(sample_rate, sdl2.AUDIO_F32SYS, channels, samples)
+        else:
+            user_data_ptr = ctypes.cast(ctypes.pointer(self.user_data), ctypes.c_void_p)
+            requestedSpecs = sdl2.SDL_AudioSpec(sample_rate, sdl2.AUDIO_F32SYS, channels, samples, audio_callback, user_data_ptr)
 
         actualSpecs = sdl2.SDL_AudioSpec(
             freq=0,
             aformat=0,
             channels=0,
-            samples=0            
+            samples=0
             )
 
-        deviceName = sdl2.SDL_GetAudioDeviceName(self._currentAudioDeviceIndex, True)
-        self._currentAudioDeviceID  = sdl2.SDL_OpenAudioDevice(
-            deviceName, True, 
-            requestedSpecs, 
-            actualSpecs, 
+        self.device_id = sdl2.SDL_OpenAudioDevice(
+            self._deviceName, True,
+            requestedSpecs,
+            actualSpecs,
             sdl2.SDL_AUDIO_ALLOW_CHANNELS_CHANGE
             )
 
-        if self._currentAudioDeviceID == 0:
-            log.error(f'Failed to open audio device "{deviceName}" (ID {self._currentAudioDeviceIndex}): {sdl2.SDL_GetError()}')
+        if self.device_id == 0:
             return False
 
-        self._channels = actualSpecs.channels
+        self.channels = actualSpecs.channels
+        self.sample_rate = actualSpecs.freq
 
-        log.info(f'Opened audio recording device "{deviceName}" (ID {self._currentAudioDeviceIndex}) with {actualSpecs.channels} channels at {actualSpecs.freq} Hz')
+        # The device is opened paused, so the ring buffer exists before the callback runs
+        if not queue:
+            self.ring_buffer = PCMRingBuffer(ring_buffer_frames, self.channels)
 
         return True
 
-    def uninitialize(self):
-        self.stop_recording()
-        sdl2.SDL_QuitSubSystem(sdl2.SDL_INIT_AUDIO)
+    def close(self):
+        if self.device_id:
+            sdl2.SDL_PauseAudioDevice(self.device_id, True)
+            sdl2.SDL_CloseAudioDevice(self.device_id)
+            self.device_id = 0
 
 @ctypes.CFUNCTYPE(None, ctypes.c_void_p, ctypes.POINTER(ctypes.c_uint8), ctypes.c_int)
 def audio_callback(userdata, stream, length_bytes):
-    instance = ctypes.cast(userdata, ctypes.POINTER(ctypes.py_object)).contents.value
+    device = ctypes.cast(userdata, ctypes.POINTER(ctypes.py_object)).contents.value
 
     length  = length_bytes // ctypes.sizeof(ctypes.c_float)
-    float_ptr = ctypes.cast(stream, ctypes.POINTER(ctypes.c_float))
-    samples = np.ctypeslib.as_array(float_ptr, shape=(length,)).copy()
 
-    instance.projectm_wrapper.add_pcm(samples, channels=2)
\ No newline at end of file
+    # Only copy into the device's preallocated ring buffer, projectM is fed from the render loop
+    device.ring_buffer.write(ctypes.cast(stream, ctypes.c_void_p).value, length)
@@ -0,0 +1,85 @@
+import logging
+
+import numpy as np
+
+log = logging.getLogger()
+
+"""Parse the audio.channelMap setting into 0-based device channel indices.
+@param value: the configured value, e.g. 3 or "3,4" (1-based channel numbers)
+@returns a list of channel indices, empty if no map is configured
+"""
+def parse_channel_map(value):
+    if value is None or value == '':
+        return list()
+
+    return [int(channel) - 1 for channel in str(value).split(',') if channel.strip()]
+
+class ChannelMixer:
+    """Vectorized up/downmix of interleaved device audio to the mono/stereo layout projectM expects.
+    The mix is a precomputed (device channels x output channels) matrix that is applied with a single
+    matmul into a preallocated output buffer.
+    @param in_channels: the number of channels delivered by the capture device
+    @param out_channels: the number of channels fed into projectM (1 or 2)
+    @param max_frames: the maximum number of frames mixed per call
+    @param channel_map: optional list of 0-based device channels to use, e.g. [2, 3] for channels 3/4
+    """
+    def __init__(self, in_channels, out_channels=2, max_frames=8192, channel_map=None):
+        self.in_channels    = in_channels
+        self.out_channels   = out_channels
+        self.max_frames     = max_frames
+        self.channel_map    = list()
+
+        for channel in channel_map or list():
+            if 0 <= channel < in_channels:
+                self.channel_map.append(channel)
+            else:
+                log.warning(f'Ignoring channel {channel + 1} in audio.channelMap, the device only has {in_channels} channels')
+
+        # Nothing to mix when the device already delivers the layout projectM wants
+        self.passthrough = in_channels == out_channels and self.channel_map in (list(), list(range(in_channels)))
+
+        self._matrix    = self._build_matrix()
+        self._output    = np.zeros((max_frames, out_channels), dtype=np.float32)
+        self.address    = self._output.ctypes.data
+
+    """Build the mixing matrix, each output channel is the average of the device channels routed to it"""
+    def _build_matrix(self):
+        matrix = np.zeros((self.in_channels, self.out_channels), dtype=np.float32)
+
+        if self.channel_map:
+            sources = self.channel_map
+        else:
+            sources = list(range(self.in_channels))
+
+        if self.out_channels == 1 or len(sources) == 1:
+            routing = [sources] * self.out_channels
+        else:
+            # Channel maps alternate left/right in the order given, just like the
+            # device layouts do (FL FR FC LFE BL BR ...)
+            routing = [sources[0::2], sources[1::2]]
+
+        for out_channel, in_channels in enumerate(routing):
+            for in_channel in in_channels:
+                matrix[in_channel, out_channel] = 1.0 / len(in_channels)
+
+        return matrix
+
+    """Mix interleaved device samples into the preallocated output buffer.
+    @param samples: a float32 array of interleaved device samples (whole frames)
+    @returns the number of frames written to the output buffer (at self.address)
+    """
+    def mix(self, samples):
+        frames = samples.size // self.in_channels
+
+        # Keep the most recent audio if more arrived than fits in a single mix
+        if frames > self.max_frames:
+            samples = samples[(frames - self.max_frames) * self.in_channels:]
+            frames = self.max_frames
+
+        np.matmul(
+            samples[:frames * self.in_channels].reshape(frames, self.in_channels),
+            self._matrix,
+            out=self._output[:frames]
+            )
+
+        return frames
@@ -0,0 +1,169 @@
+import logging
+import time
+
+log = logging.getLogger()
+
+# Commands handled by RenderingLoop.execute_commands
+COMMAND_NEXT_PRESET             = 'next_preset'
+COMMAND_PREVIOUS_PRESET         = 'previous_preset'
+COMMAND_DELETE_PRESET           = 'delete_preset'
+COMMAND_CUT_PRESET              = 'cut_preset'
+COMMAND_TOGGLE_FULLSCREEN       = 'toggle_fullscreen'
+COMMAND_TOGGLE_PRESET_LOCK      = 'toggle_preset_lock'
+COMMAND_TOGGLE_SHUFFLE          = 'toggle_shuffle'
+COMMAND_TOGGLE_TIMINGS          = 'toggle_timings'
+COMMAND_BEAT_SENSITIVITY        = 'beat_sensitivity'
+COMMAND_NEXT_AUDIO_DEVICE       = 'next_audio_device'
+COMMAND_QUIT                    = 'quit'
+
+# Preset navigation is merged into a single COMMAND_SKIP_PRESETS with the net number of positions
+COMMAND_SKIP_PRESETS            = 'skip_presets'
+
+# Seconds after which a preset load that was never reported as switched or failed no longer blocks automatic switches
+SWITCH_REPORT_TIMEOUT = 5
+
+TOGGLE_COMMANDS = (COMMAND_TOGGLE_FULLSCREEN, COMMAND_TOGGLE_PRESET_LOCK, COMMAND_TOGGLE_SHUFFLE, COMMAND_TOGGLE_TIMINGS)
+
+class CommandQueue:
+    """Collect the control actions triggered by key presses (SDL and evdev) and the rendering loop, and
+    hand them out coalesced once per frame: next/previous presses add up to a single jump of the net
+    number of positions, toggles pressed an even number of times cancel out and beat sensitivity steps
+    are summed. Preset loads stall rendering, so at most one is handed out per frame and not more often
+    than every preset_interval seconds; presses arriving in between are merged into the next jump.
+    @param preset_interval: the minimum number of seconds between two preset loads
+    """
+    def __init__(self, preset_interval=0.25):
+        self._preset_interval_ns = int(preset_interval * 1000000000)
+        self._last_preset_load = 0
+
+        self._preset_offset = 0
+        self._auto_next = False
+        self._switch_pending = 0
+        self._delete_preset = False
+        self._cut_preset = False
+        self._toggles = dict()
+        self._beat_sensitivity = 0
+        self._audio_devices = 0
+        self._quit = False
+
+        self.received = 0
+        self.executed = 0
+
+    """Queue a command.
+    @param command: one of the COMMAND_* constants
+    @param value: the value of the command (the step of COMMAND_BEAT_SENSITIVITY)
+    """
+    def push(self, command, value=None):
+        self.received += 1
+
+        if command == COMMAND_NEXT_PRESET:
+            self._preset_offset += 1
+        elif command == COMMAND_PREVIOUS_PRESET:
+            self._preset_offset -= 1
+        elif command == COMMAND_DELETE_PRESET:
+            self._delete_preset = True
+        elif command == COMMAND_CUT_PRESET:
+            self._cut_preset = True
+        elif command == COMMAND_BEAT_SENSITIVITY:
+            self._beat_sensitivity += value
+        elif command == COMMAND_NEXT_AUDIO_DEVICE:
+            self._audio_devices += 1
+        elif command == COMMAND_QUIT:
+            self._quit = True
+        elif command in TOGGLE_COMMANDS:
+            self._toggles[command] = not self._toggles.get(command, False)
+        else:
+            log.error(f'Ignoring unknown command {command}')
+
+    """Request the next preset because the current one is displayed too long.
+    Requests are ignored while one is queued and while a handed out preset load has not been
+    reported by preset_switched or preset_switch_failed yet.
+    """
+    def push_auto_next(self):
+        if self._auto_next:
+            return
+
+        if self._switch_pending and time.perf_counter_ns() - self._switch_pending < SWITCH_REPORT_TIMEOUT * 1000000000:
+            return
+
+        self.received += 1
+        self._auto_next = True
+
+    """The projectM wrapper switched to a new preset"""
+    def preset_switched(self):
+        self._switch_pending = 0
+
+    """The projectM wrapper failed to load a preset, the next automatic request loads another one"""
+    def preset_switch_failed(self):
+        self._switch_pending = 0
+
+    """Whether commands are waiting"""
+    def pending(self):
+        return bool(self._preset_offset or self._auto_next or self._delete_preset or self._cut_preset or self._beat_sensitivity
+                    or self._audio_devices or self._quit or any(self._toggles.values()))
+
+    """Get the coalesced commands to execute in this frame.
+    @returns a list of (command, value) tuples
+    """
+    def take(self):
+        commands = list()
+        if not self.pending():
+            return commands
+
+        if self._quit:
+            self._quit = False
+            commands.append((COMMAND_QUIT, None))
+
+        for command, toggled in self._toggles.items():
+            if toggled:
+                commands.append((command, None))
+        self._toggles.clear()
+
+        if self._beat_sensitivity:
+            commands.append((COMMAND_BEAT_SENSITIVITY, self._beat_sensitivity))
+            self._beat_sensitivity = 0
+
+        # Device switches are expensive as well, one per frame
+        if self._audio_devices:
+            self._audio_devices -= 1
+            commands.append((COMMAND_NEXT_AUDIO_DEVICE, None))
+
+        now = time.perf_counter_ns()
+        if now - self._last_preset_load >= self._preset_interval_ns:
+            preset_command = None
+
+            # Deleting loads the next preset, further navigation waits for the next load
+            if self._delete_preset:
+                self._delete_preset = False
+                self._cut_preset = False
+                self._auto_next = False
+                preset_command = (COMMAND_DELETE_PRESET, None)
+
+            # A hard cut away from a preset the watchdog flagged replaces the automatic next preset
+            elif self._cut_preset:
+                self._cut_preset = False
+                self._auto_next = False
+                preset_command = (COMMAND_CUT_PRESET, None)
+
+            elif self._preset_offset:
+                preset_command = (COMMAND_SKIP_PRESETS, self._preset_offset)
+                self._preset_offset = 0
+                self._auto_next = False
+
+            elif self._auto_next:
+                preset_command = (COMMAND_SKIP_PRESETS, 1)
+                self._auto_next = False
+
+            if preset_command:
+                self._last_preset_load = now
+                self._switch_pending = now
+                commands.append(preset_command)
+
+        self.executed += len(commands)
+        return commands
+
+    def stats(self):
+        return {
+            'commands_received': self.received,
+            'commands_executed': self.executed
+            }
@@ -0,0 +1,96 @@
+import logging
+import time
+
+log = logging.getLogger()
+
+class DriftCompensator:
+    """Pace the audio handed to projectM by the render clock and hold the capture backlog at a target level.
+    The capture clock and the render clock are independent, so over a long session the backlog slowly grows or
+    runs dry. Whenever the smoothed backlog leaves the tolerance band, a small block is dropped or duplicated,
+    at most once per correction interval so the correction never outruns the smoothing.
+    @param sample_rate: the capture sample rate
+    @param target_frames: the backlog (in frames) to hold between capture and projectM
+    @param tolerance_frames: the allowed deviation from the target before correcting
+    @param block_frames: the number of frames dropped or duplicated per correction
+    @param correction_interval: the minimum number of seconds between two corrections
+    @param resync_interval: a frame taking longer than this (in seconds) resets the pacing to the target
+    """
+    def __init__(self, sample_rate, target_frames=1024, tolerance_frames=256, block_frames=32, correction_interval=0.25, resync_interval=0.5):
+        self.sample_rate = sample_rate
+        self.target_frames = target_frames
+        self.tolerance_frames = tolerance_frames
+        self.block_frames = block_frames
+
+        self._correction_interval_ns = int(correction_interval * 1000000000)
+        self._resync_interval_ns = int(resync_interval * 1000000000)
+
+        self._last_frame = None
+        self._last_correction = 0
+        self._remainder = 0
+        self._backlog = 0.0
+
+        self.delivered_frames = 0
+        self.dropped_frames = 0
+        self.duplicated_frames = 0
+        self.resyncs = 0
+
+    """Get the amount of audio due for the current frame.
+    @param backlog: the number of captured frames waiting to be handed to projectM
+    @returns a tuple of the number of frames to hand to projectM and the correction in frames,
+    positive to drop and negative to duplicate frames
+    """
+    def update(self, backlog):
+        now = time.perf_counter_ns()
+
+        if self._last_frame is None or now - self._last_frame > self._resync_interval_ns:
+            # First frame or the rendering stalled, deliver everything above the target and start over
+            if self._last_frame is not None:
+                self.resyncs += 1
+                log.debug(f'Audio pacing resynchronised after {(now - self._last_frame) / 1000000:.0f}ms, backlog {backlog} frames')
+
+            self._last_frame = now
+            self._remainder = 0
+            self._backlog = min(backlog, self.target_frames)
+
+            return max(0, backlog - self.target_frames), 0
+
+        due = (now - self._last_frame) * self.sample_rate + self._remainder
+        frames, self._remainder = divmod(due, 1000000000)
+        self._last_frame = now
+
+        self._backlog += (backlog - self._backlog) * 0.05
+        if now - self._last_correction < self._correction_interval_ns:
+            return frames, 0
+
+        drift = self._backlog - self.target_frames
+        if drift > self.tolerance_frames:
+            correction = self.block_frames
+        elif drift < -self.tolerance_frames:
+            correction = -self.block_frames
+        else:
+            return frames, 0
+
+        self._last_correction = now
+        return frames, correction
+
+    """Register the audio actually handed to projectM.
+    @param frames: the number of frames handed to projectM
+    @param dropped: the number of frames dropped
+    @param duplicated: the number of frames duplicated
+    """
+    def record(self, frames, dropped=0, duplicated=0):
+        self.delivered_frames += frames
+        self.dropped_frames += dropped
+        self.duplicated_frames += duplicated
+
+    def stats(self):
+        drift = self.dropped_frames - self.duplicated_frames
+
+        return {
+            'drift_backlog_frames': round(self._backlog),
+            'drift_frames': drift,
+            'drift_ppm': round(drift * 1000000 / self.delivered_frames, 1) if self.delivered_frames else 0,
+            'drift_dropped_frames': self.dropped_frames,
+            'drift_duplicated_frames': self.duplicated_frames,
+            'drift_resyncs': self.resyncs
+            }
@@ -0,0 +1,136 @@
+import logging
+import time
+
+log = logging.getLogger()
+
+class FramePacer:
+    """Pace the rendering loop to a target frame rate using absolute deadlines.
+    Every frame has a deadline one period after the previous one, so the time spent rendering is not
+    added on top of the wait and small oversleeps are made up by the next frames. When the loop falls
+    behind by more than one period, the schedule is moved to the present instead of rendering a burst
+    of frames to catch up. The last spin_wait seconds before a deadline are busy-waited, as sleeping is
+    only accurate to about a millisecond.
+    With vsync the buffer swap already waits for the display, so the pacer only sleeps when the target
+    frame rate is below the refresh rate and never spins.
+    @param fps: the target frame rate
+    @param spin_wait: seconds before a deadline to stop sleeping and busy-wait (0 disables)
+    @param vsync_period: the display refresh period in seconds when vsync is active, otherwise None
+    @param measure_interval: seconds over which the achieved frame rate is measured
+    """
+    def __init__(self, fps=60, spin_wait=0.001, vsync_period=None, measure_interval=1.0):
+        self.fps = fps
+        self._period = int(1000000000 / fps)
+        self._spin = int(spin_wait * 1000000000)
+        self._vsync = int(vsync_period * 1000000000) if vsync_period else None
+        self._measure_interval = int(measure_interval * 1000000000)
+
+        self._deadline = None
+
+        self._measure_start = None
+        self._measure_frames = 0
+        self.achieved_fps = None
+
+        self.frames = 0
+        self.missed = 0
+        self.resyncs = 0
+        self.sleep_ns = 0
+        self.spin_ns = 0
+
+        if self._vsync and self._vsync >= self._period:
+            log.info(f'Frame pacing left to vsync ({1 / vsync_period:.0f} Hz display, {fps} fps target)')
+
+    """Change the target frame rate.
+    @param fps: the new target frame rate
+    """
+    def set_fps(self, fps):
+        self.fps = fps
+        self._period = int(1000000000 / fps)
+        self.reset()
+
+    """Restart the schedule, e.g. after frames were skipped on purpose while idle"""
+    def reset(self):
+        self._deadline = None
+        self._measure_start = None
+        self._measure_frames = 0
+
+    """Wait until the deadline of the frame that was just presented, called once per rendered frame.
+    @returns the newly measured frame rate once per measure interval, otherwise None
+    """
+    def wait(self):
+        now = time.perf_counter_ns()
+        self.frames += 1
+
+        if self._deadline is None:
+            self._deadline = now + self._period
+        elif now > self._deadline:
+            self.missed += 1
+
+            if now - self._deadline > self._period:
+                # Too far behind to catch up without a burst of frames
+                self.resyncs += 1
+                self._deadline = now
+
+            self._deadline += self._period
+        else:
+            self.sleep_until(now, self._deadline)
+            self._deadline += self._period
+
+        return self.measure()
+
+    """Sleep (and spin) until a deadline.
+    @param now: the current perf_counter_ns
+    @param deadline: the perf_counter_ns to wait for
+    """
+    def sleep_until(self, now, deadline):
+        remaining = deadline - now
+
+        if self._vsync:
+            # The next swap blocks until the display refresh, only sleep for whole refresh periods
+            remaining -= self._vsync
+            if remaining > 0:
+                time.sleep(remaining / 1000000000)
+                self.sleep_ns += remaining
+            return
+
+        if remaining > self._spin:
+            time.sleep((remaining - self._spin) / 1000000000)
+            self.sleep_ns += remaining - self._spin
+
+        spin_start = time.perf_counter_ns()
+        while time.perf_counter_ns() < deadline:
+            pass
+
+        self.spin_ns += max(0, time.perf_counter_ns() - spin_start)
+
+    """Update the achieved frame rate.
+    @returns the new frame rate at the end of a measure interval, otherwise None
+    """
+    def measure(self):
+        now = time.perf_counter_ns()
+
+        if self._measure_start is None:
+            self._measure_start = now
+            self._measure_frames = 0
+            return None
+
+        self._measure_frames += 1
+        elapsed = now - self._measure_start
+        if elapsed < self._measure_interval:
+            return None
+
+        self.achieved_fps = self._measure_frames * 1000000000 / elapsed
+        self._measure_start = now
+        self._measure_frames = 0
+
+        return self.achieved_fps
+
+    def stats(self):
+        return {
+            'fps_target': self.fps,
+            'fps_achieved': round(self.achieved_fps, 1) if self.achieved_fps else None,
+            'frames': self.frames,
+            'missed_deadlines': self.missed,
+            'resyncs': self.resyncs,
+            'sleep_seconds': round(self.sleep_ns / 1000000000, 1),
+            'spin_seconds': round(self.spin_ns / 1000000000, 1)
+            }
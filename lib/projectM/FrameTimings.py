@@ -0,0 +1,106 @@
+import logging
+import time
+
+import numpy as np
+
+log = logging.getLogger()
+
+# Stages of RenderingLoop.run in the order they are marked
+STAGE_POLL_EVENTS       = 0
+STAGE_VIEWPORT          = 1
+STAGE_AUDIO             = 2
+STAGE_CLEAR             = 3
+STAGE_RENDER            = 4
+STAGE_SWAP              = 5
+STAGE_PACING            = 6
+STAGE_NAMES = ('poll_events', 'check_viewport_size', 'process_audio', 'clear', 'render_frame', 'swap', 'pacing')
+
+class FrameTimings:
+    """Per-stage timing of the rendering loop, to find out which stage a slow frame was spent in.
+    The duration of every stage is written into a preallocated array holding the last history frames,
+    so timing a frame allocates nothing. The p50/p95/p99/max per stage are logged every report_interval
+    seconds. Timing can be switched on and off at runtime, marks are a no-op while it is off.
+    @param enabled: whether to start timing right away
+    @param history: the number of frames kept for the percentiles
+    @param report_interval: seconds between two logged reports
+    """
+    def __init__(self, enabled=False, history=1024, report_interval=10):
+        self.enabled = enabled
+
+        # One row per stage, the last row holds the whole frame
+        self._durations = np.zeros((len(STAGE_NAMES) + 1, history), dtype=np.float64)
+        self._index = 0
+        self._count = 0
+        self._frame_start = 0
+        self._last_mark = 0
+
+        self._report_interval_ns = report_interval * 1000000000
+        self._last_report = time.perf_counter_ns()
+
+    """Switch timing on or off, the collected frames are dropped when switched on.
+    @param enabled: whether to time the frames
+    """
+    def set_enabled(self, enabled):
+        if enabled and not self.enabled:
+            self._count = 0
+            self._index = 0
+            self._last_report = time.perf_counter_ns()
+
+        self.enabled = enabled
+        log.info(f'Frame stage timing {"enabled" if enabled else "disabled"}')
+
+    """Start timing a frame"""
+    def begin(self):
+        if self.enabled:
+            self._frame_start = self._last_mark = time.perf_counter_ns()
+
+    """Record the duration of a stage since the previous mark.
+    @param stage: the STAGE_* that just finished
+    """
+    def mark(self, stage):
+        if self.enabled:
+            now = time.perf_counter_ns()
+            self._durations[stage, self._index] = now - self._last_mark
+            self._last_mark = now
+
+    """Complete the frame, frames abandoned without end (e.g. while idle) are not counted"""
+    def end(self):
+        if not self.enabled or not self._frame_start:
+            return
+
+        now = time.perf_counter_ns()
+        self._durations[-1, self._index] = now - self._frame_start
+        self._frame_start = 0
+
+        self._index = (self._index + 1) % self._durations.shape[1]
+        self._count += 1
+
+        if now - self._last_report >= self._report_interval_ns:
+            self._last_report = now
+            self.log_report()
+
+    """Summarise the timed frames.
+    @returns a dict of p50/p95/p99/max in milliseconds per stage
+    """
+    def report(self):
+        count = min(self._count, self._durations.shape[1])
+        report = {'frames': self._count}
+        if not count:
+            return report
+
+        durations = self._durations[:, :count] / 1000000
+        percentiles = np.percentile(durations, (50, 95, 99), axis=1)
+        maximums = durations.max(axis=1)
+
+        for stage, name in enumerate(STAGE_NAMES + ('frame',)):
+            report[name] = {
+                'p50': round(percentiles[0, stage], 2),
+                'p95': round(percentiles[1, stage], 2),
+                'p99': round(percentiles[2, stage], 2),
+                'max': round(maximums[stage], 2)
+                }
+
+        return report
+
+    def log_report(self):
+        log.info(f'Frame stage timings (ms): {self.report()}')
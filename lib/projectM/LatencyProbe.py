@@ -0,0 +1,101 @@
+import logging
+import time
+
+import numpy as np
+
+log = logging.getLogger()
+
+"""Generate a synthetic impulse train.
+@param sample_rate: the sample rate of the generated audio
+@param channels: the number of interleaved channels
+@param interval_frames: the number of frames between two impulses
+@param impulse_frames: the length of each impulse in frames
+@param impulses: the number of impulses to generate
+@returns an array of interleaved float32 samples
+"""
+def generate_impulse_train(sample_rate, channels, interval_frames, impulse_frames=64, impulses=120):
+    samples = np.zeros((interval_frames * impulses, channels), dtype=np.float32)
+    for start in range(0, samples.shape[0], interval_frames):
+        samples[start:start + impulse_frames] = 1.0
+
+    return samples.ravel()
+
+class LatencyProbe:
+    """Audio-to-visual latency measurement for a synthetic impulse train.
+    Each impulse is timestamped when it enters the capture layer, when it is handed to projectM
+    and when the first frame rendered after that is swapped to the screen.
+    @param sample_rate: the sample rate of the impulse train
+    @param interval_frames: the number of frames between two impulses
+    @param history: the number of measurements kept for the percentiles
+    @param report_interval: seconds between two logged reports
+    """
+    def __init__(self, sample_rate, interval_frames, history=4096, report_interval=10):
+        self.sample_rate = sample_rate
+        self.interval_frames = interval_frames
+
+        self._interval_ns = interval_frames * 1000000000 // sample_rate
+        self._pending = list()
+
+        self._capture_to_pcm = np.zeros(history, dtype=np.float64)
+        self._pcm_to_frame = np.zeros(history, dtype=np.float64)
+        self._capture_to_frame = np.zeros(history, dtype=np.float64)
+        self._count = 0
+
+        self._report_interval_ns = report_interval * 1000000000
+        self._last_report = time.perf_counter_ns()
+
+    """Register the impulses handed to projectM, called right after add_pcm.
+    @param first_frame: the index of the first frame delivered since the stream started
+    @param end_frame: the index after the last frame delivered
+    @param start_ns: perf_counter_ns timestamp of the first frame of the stream
+    """
+    def on_pcm_added(self, first_frame, end_frame, start_ns):
+        pcm_ns = time.perf_counter_ns()
+
+        first_impulse = -(-first_frame // self.interval_frames)
+        for impulse in range(first_impulse, -(-end_frame // self.interval_frames)):
+            capture_ns = start_ns + impulse * self._interval_ns
+            self._pending.append((capture_ns, pcm_ns))
+
+    """Complete the pending impulses, called right after the frame was swapped"""
+    def frame_presented(self):
+        if self._pending:
+            frame_ns = time.perf_counter_ns()
+            history = self._capture_to_pcm.size
+
+            for capture_ns, pcm_ns in self._pending:
+                index = self._count % history
+                self._capture_to_pcm[index] = (pcm_ns - capture_ns) / 1000000
+                self._pcm_to_frame[index] = (frame_ns - pcm_ns) / 1000000
+                self._capture_to_frame[index] = (frame_ns - capture_ns) / 1000000
+                self._count += 1
+
+            self._pending.clear()
+
+        if time.perf_counter_ns() - self._last_report >= self._report_interval_ns:
+            self._last_report = time.perf_counter_ns()
+            self.log_report()
+
+    """Summarise the measured latencies.
+    @returns a dict of p50/p95/p99/max in milliseconds per stage
+    """
+    def report(self):
+        count = min(self._count, self._capture_to_pcm.size)
+        report = {'impulses': self._count}
+
+        for name, values in (('capture_to_pcm', self._capture_to_pcm), ('pcm_to_frame', self._pcm_to_frame), ('capture_to_frame', self._capture_to_frame)):
+            if not count:
+                continue
+
+            p50, p95, p99 = np.percentile(values[:count], (50, 95, 99))
+            report[name] = {
+                'p50': round(p50, 2),
+                'p95': round(p95, 2),
+                'p99': round(p99, 2),
+                'max': round(values[:count].max(), 2)
+                }
+
+        return report
+
+    def log_report(self):
+        log.info(f'Audio-to-visual latency (ms): {self.report()}')
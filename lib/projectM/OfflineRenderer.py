@@ -0,0 +1,212 @@
+import ctypes
+import logging
+import time
+
+import numpy as np
+
+from OpenGL import GL
+
+from lib.projectM.ChannelMixer import ChannelMixer
+from lib.projectM.RenderScaler import create_framebuffer, delete_framebuffer
+
+log = logging.getLogger()
+
+class PBOFrameReader:
+    """Read rendered frames back from the GPU without stalling the pipeline.
+    glReadPixels into a pixel buffer object returns immediately, the pixels are copied in the
+    background and only mapped one frame later, when the copy has long finished. With two buffers
+    the GPU renders frame n while frame n - 1 is transferred.
+    Frames are returned top row first as a preallocated (height, width, 4) RGBA array, which is
+    overwritten by the next call.
+    @param width: the frame width
+    @param height: the frame height
+    @param buffers: the number of pixel buffer objects
+    """
+    def __init__(self, width, height, buffers=2):
+        self.width = width
+        self.height = height
+        self.size = width * height * 4
+
+        self._pbos = [int(pbo) for pbo in np.atleast_1d(GL.glGenBuffers(buffers))]
+        for pbo in self._pbos:
+            GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo)
+            GL.glBufferData(GL.GL_PIXEL_PACK_BUFFER, self.size, None, GL.GL_STREAM_READ)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+
+        self._index = 0
+        self._pending = 0
+
+        self._raw = np.zeros((height, width, 4), dtype=np.uint8)
+        self._frame = np.zeros((height, width, 4), dtype=np.uint8)
+
+    """Start reading a framebuffer and return the oldest frame in flight once all buffers are busy.
+    @param framebuffer: the framebuffer to read
+    @returns the oldest frame, or None while the buffers are filling up
+    """
+    def read(self, framebuffer):
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, framebuffer)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, self._pbos[self._index])
+        GL.glReadPixels(0, 0, self.width, self.height, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+
+        self._index = (self._index + 1) % len(self._pbos)
+        self._pending += 1
+
+        frame = None
+        if self._pending == len(self._pbos):
+            frame = self.map(self._pbos[self._index])
+            self._pending -= 1
+
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, 0)
+
+        return frame
+
+    """Return the frames still in flight, oldest first"""
+    def flush(self):
+        while self._pending:
+            index = (self._index - self._pending) % len(self._pbos)
+            self._pending -= 1
+
+            frame = self.map(self._pbos[index])
+            GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+
+            yield frame
+
+    """Copy the pixels of a pixel buffer object, which is left bound.
+    @param pbo: the pixel buffer object
+    """
+    def map(self, pbo):
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo)
+        address = GL.glMapBufferRange(GL.GL_PIXEL_PACK_BUFFER, 0, self.size, GL.GL_MAP_READ_BIT)
+        ctypes.memmove(self._raw.ctypes.data, address, self.size)
+        GL.glUnmapBuffer(GL.GL_PIXEL_PACK_BUFFER)
+
+        # OpenGL stores the bottom row first
+        np.copyto(self._frame, self._raw[::-1])
+        return self._frame
+
+    def close(self):
+        GL.glDeleteBuffers(len(self._pbos), self._pbos)
+        self._pbos = list()
+
+class OfflineRenderer:
+    """Render an audio file through projectM as fast as possible with a fixed timestep.
+    Every frame is fed exactly 1 / fps seconds of audio through add_pcm and animated at its position
+    in the audio instead of the wall clock, so the output does not depend on how fast it is rendered.
+    Presets switch every display_duration seconds of audio, like the rendering loop does in real time.
+    @param projectm_wrapper: the ProjectMWrapper rendering the frames
+    @param samples: the interleaved float32 samples of the audio file
+    @param channels: the number of channels of the audio file
+    @param sample_rate: the sample rate of the audio file
+    @param width: the frame width
+    @param height: the frame height
+    @param fps: the output frame rate
+    @param display_duration: seconds of audio per preset (0 keeps the first preset)
+    """
+    def __init__(self, projectm_wrapper, samples, channels, sample_rate, width, height, fps=60, display_duration=60):
+        self.projectm_wrapper = projectm_wrapper
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.display_duration = display_duration
+
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self._samples = samples
+
+        # projectM takes mono or stereo
+        self._mixer = None
+        if channels > 2:
+            self._mixer = ChannelMixer(channels, 2, int(sample_rate / fps) + 1)
+
+        self.total_frames = int(samples.size // channels * fps / sample_rate)
+
+        self._framebuffer, self._texture, self._depth = create_framebuffer(width, height)
+        self.projectm_wrapper.set_window_size(width, height)
+
+        self._reader = PBOFrameReader(width, height)
+        self._fixed_timestep = True
+
+        self.frames = 0
+        self.elapsed = 0
+
+    """Feed the audio of a frame to projectM.
+    @param frame: the index of the frame
+    """
+    def add_audio(self, frame):
+        first = frame * self.sample_rate // self.fps
+        end = (frame + 1) * self.sample_rate // self.fps
+
+        samples = self._samples[first * self.channels:end * self.channels]
+        if self._mixer:
+            frames = self._mixer.mix(samples)
+            self.projectm_wrapper.add_pcm_ptr(self._mixer.address, frames, 2)
+        else:
+            self.projectm_wrapper.add_pcm(samples, self.channels)
+
+    """Render a frame into the offscreen framebuffer.
+    @param frame: the index of the frame
+    """
+    def render(self, frame):
+        if self.display_duration > 0 and frame and frame % int(self.display_duration * self.fps) == 0:
+            self.projectm_wrapper.next_preset()
+
+        self.add_audio(frame)
+
+        if self._fixed_timestep and not self.projectm_wrapper.set_frame_time(frame / self.fps):
+            log.warning('This projectM version has no fixed timestep support, animations follow the wall clock')
+            self._fixed_timestep = False
+
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self._framebuffer)
+        GL.glViewport(0, 0, self.width, self.height)
+        GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+        self.projectm_wrapper.render_frame_fbo(self._framebuffer)
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
+
+    """Render the audio and hand every frame to a callback.
+    @param write_frame: function receiving the frame index and the (height, width, 4) RGBA frame
+    @param max_frames: the maximum number of frames to render
+    @param report_interval: seconds between two throughput reports
+    @returns the number of frames rendered
+    """
+    def run(self, write_frame, max_frames=None, report_interval=5):
+        total = min(self.total_frames, max_frames) if max_frames else self.total_frames
+
+        start = last_report = time.perf_counter()
+        written = 0
+        for frame in range(total):
+            self.render(frame)
+
+            pixels = self._reader.read(self._framebuffer)
+            if pixels is not None:
+                write_frame(written, pixels)
+                written += 1
+
+            self.frames = frame + 1
+
+            now = time.perf_counter()
+            if now - last_report >= report_interval:
+                last_report = now
+                log.info(f'Rendered {self.frames}/{total} frames, {self.frames / (now - start):.1f} frames/sec '
+                         f'({self.frames / (now - start) / self.fps:.2f}x real time)')
+
+        for pixels in self._reader.flush():
+            write_frame(written, pixels)
+            written += 1
+
+        self.elapsed = time.perf_counter() - start
+        return written
+
+    def stats(self):
+        fps = self.frames / self.elapsed if self.elapsed else 0
+
+        return {
+            'frames': self.frames,
+            'seconds': round(self.elapsed, 1),
+            'frames_per_second': round(fps, 1),
+            'real_time_factor': round(fps / self.fps, 2)
+            }
+
+    def uninitialize(self):
+        self._reader.close()
+        delete_framebuffer(self._framebuffer, self._texture, self._depth)
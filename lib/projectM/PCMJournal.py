@@ -0,0 +1,196 @@
+import ctypes
+import logging
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+log = logging.getLogger()
+
+FLOAT_SIZE = ctypes.sizeof(ctypes.c_float)
+
+JOURNAL_MAGIC = b'PMARJRNL'
+JOURNAL_VERSION = 1
+
+# magic, version, sample rate, channels, index capacity (entries), data capacity (samples),
+# samples written, entries written, start timestamp (perf_counter_ns)
+HEADER = struct.Struct('<8sIIIIQQQQ')
+HEADER_SIZE = 64
+COUNTERS = struct.Struct('<QQ')
+COUNTERS_OFFSET = 32
+
+# timestamp (perf_counter_ns), sample position, frames, channels, rendered frame, reserved
+ENTRY = struct.Struct('<QQIIII')
+
+class JournalEntry:
+    """One recorded add_pcm call.
+    @param timestamp: perf_counter_ns timestamp of the call
+    @param frame: the rendered frame the call belonged to
+    @param frames: the number of frames
+    @param channels: the number of interleaved channels
+    @param position: the position of the first sample in the journal's sample stream
+    """
+    __slots__ = ('timestamp', 'frame', 'frames', 'channels', 'position')
+
+    def __init__(self, timestamp, frame, frames, channels, position):
+        self.timestamp  = timestamp
+        self.frame      = frame
+        self.frames     = frames
+        self.channels   = channels
+        self.position   = position
+
+class PCMJournalWriter:
+    """Record the PCM handed to projectM into a memory mapped, size capped ring file.
+    Samples and an index of timestamped entries are copied into the mapping, so recording
+    never waits on file I/O and the oldest audio is overwritten once the file is full.
+    @param path: the path of the journal file
+    @param max_bytes: the size of the journal file
+    @param sample_rate: the sample rate of the recorded audio
+    @param channels: the number of channels of the recorded audio
+    """
+    def __init__(self, path, max_bytes, sample_rate, channels):
+        self.path = path
+
+        # Roughly one index entry per 512 samples, which is far more than one per add_pcm call
+        data_bytes = max_bytes - HEADER_SIZE
+        self.index_capacity = max(1024, data_bytes // (512 * FLOAT_SIZE))
+        index_bytes = self.index_capacity * ENTRY.size
+        self.data_capacity = (data_bytes - index_bytes) // FLOAT_SIZE
+        if self.data_capacity <= 0:
+            raise ValueError(f'Journal size {max_bytes} is too small')
+
+        self._index_offset = HEADER_SIZE
+        self._data_offset = HEADER_SIZE + index_bytes
+        size = self._data_offset + self.data_capacity * FLOAT_SIZE
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with open(path, 'w+b') as outfile:
+            outfile.truncate(size)
+            self._mmap = mmap.mmap(outfile.fileno(), size)
+
+        self._anchor = ctypes.c_char.from_buffer(self._mmap)
+        self._data_address = ctypes.addressof(self._anchor) + self._data_offset
+
+        self._samples_written = 0
+        self._entries_written = 0
+        self.frame = 0
+
+        HEADER.pack_into(self._mmap, 0, JOURNAL_MAGIC, JOURNAL_VERSION, sample_rate, channels,
+                         self.index_capacity, self.data_capacity, 0, 0, time.perf_counter_ns())
+
+        log.info(f'Recording the audio journal to {path} ({size // 1048576} MB, '
+                 f'{self.data_capacity / max(channels, 1) / sample_rate:.0f}s of audio)')
+
+    """Start a new rendered frame, entries recorded until the next call belong to it"""
+    def next_frame(self):
+        self.frame += 1
+
+    """Copy float32 samples into the journal.
+    @param address: the address of the interleaved samples
+    @param frames: the number of frames at the address
+    @param channels: the number of interleaved channels
+    """
+    def record(self, address, frames, channels):
+        count = frames * channels
+        if not count:
+            return
+
+        if count > self.data_capacity:
+            skip = (count - self.data_capacity + channels - 1) // channels
+            address += skip * channels * FLOAT_SIZE
+            frames -= skip
+            count = frames * channels
+
+        start = self._samples_written % self.data_capacity
+        first = min(count, self.data_capacity - start)
+        ctypes.memmove(self._data_address + start * FLOAT_SIZE, address, first * FLOAT_SIZE)
+        if count > first:
+            ctypes.memmove(self._data_address, address + first * FLOAT_SIZE, (count - first) * FLOAT_SIZE)
+
+        entry_offset = self._index_offset + (self._entries_written % self.index_capacity) * ENTRY.size
+        ENTRY.pack_into(self._mmap, entry_offset, time.perf_counter_ns(), self._samples_written, frames, channels, self.frame, 0)
+
+        self._samples_written += count
+        self._entries_written += 1
+        COUNTERS.pack_into(self._mmap, COUNTERS_OFFSET, self._samples_written, self._entries_written)
+
+    def stats(self):
+        return {
+            'journal_entries': self._entries_written,
+            'journal_samples': self._samples_written
+            }
+
+    def close(self):
+        if self._mmap:
+            self._anchor = None
+            self._mmap.flush()
+            self._mmap.close()
+            self._mmap = None
+
+            log.info(f'Audio journal {self.path} closed after {self._entries_written} entries')
+
+class PCMJournalReader:
+    """Read a journal written by PCMJournalWriter.
+    @param path: the path of the journal file
+    """
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, 'rb') as infile:
+            self._mmap = mmap.mmap(infile.fileno(), 0, prot=mmap.PROT_READ)
+
+        (magic, version, self.sample_rate, self.channels, self.index_capacity, self.data_capacity,
+         self.samples_written, self.entries_written, self.start) = HEADER.unpack_from(self._mmap, 0)
+
+        if magic != JOURNAL_MAGIC or version != JOURNAL_VERSION:
+            self.close()
+            raise ValueError(f'{path} is not an audio journal (version {JOURNAL_VERSION})')
+
+        self._index_offset = HEADER_SIZE
+        self._data_offset = HEADER_SIZE + self.index_capacity * ENTRY.size
+        self._data = np.frombuffer(self._mmap, dtype=np.float32, count=self.data_capacity, offset=self._data_offset)
+
+    """Get the entries still held by the journal, oldest first.
+    @returns a list of JournalEntry
+    """
+    def entries(self):
+        entries = list()
+        oldest_sample = self.samples_written - self.data_capacity
+
+        for i in range(max(0, self.entries_written - self.index_capacity), self.entries_written):
+            offset = self._index_offset + (i % self.index_capacity) * ENTRY.size
+            timestamp, position, frames, channels, frame, _ = ENTRY.unpack_from(self._mmap, offset)
+
+            # The samples of the oldest entries may already be overwritten
+            if position >= oldest_sample:
+                entries.append(JournalEntry(timestamp, frame, frames, channels, position))
+
+        return entries
+
+    """Copy the samples of an entry.
+    @param entry: the JournalEntry
+    @param out: the float32 array to copy the samples into
+    @returns the number of samples copied
+    """
+    def read(self, entry, out):
+        count = min(entry.frames * entry.channels, out.size)
+
+        start = entry.position % self.data_capacity
+        first = min(count, self.data_capacity - start)
+        out[:first] = self._data[start:start + first]
+        if count > first:
+            out[first:count] = self._data[:count - first]
+
+        return count
+
+    def close(self):
+        self._data = None
+
+        if self._mmap:
+            self._mmap.close()
+            self._mmap = None
@@ -0,0 +1,142 @@
+import ctypes
+import logging
+
+import numpy as np
+
+log = logging.getLogger()
+
+FLOAT_SIZE = ctypes.sizeof(ctypes.c_float)
+
+class PCMRingBuffer:
+    """Preallocated single-producer/single-consumer float32 ring buffer for interleaved PCM.
+    The producer (SDL audio thread) only advances the write index and the consumer (render loop)
+    only advances the read index, so neither side takes a lock or allocates memory.
+    @param frames: the minimum capacity in frames (rounded up to a power of two)
+    @param channels: the number of interleaved channels per frame
+    """
+    def __init__(self, frames, channels=2):
+        capacity_frames = 1
+        while capacity_frames < frames:
+            capacity_frames <<= 1
+
+        # A whole number of frames keeps every frame contiguous, even across the wrap point
+        self.channels   = channels
+        self.capacity   = capacity_frames * channels
+
+        self._buffer            = np.zeros(self.capacity, dtype=np.float32)
+        self.address            = self._buffer.ctypes.data
+        self._output            = np.zeros(self.capacity, dtype=np.float32)
+        self.output_address     = self._output.ctypes.data
+
+        self._write_index   = 0
+        self._read_index    = 0
+
+        self.overruns           = 0
+        self.underruns          = 0
+        self.dropped_samples    = 0
+        self.written_samples    = 0
+
+    """Number of samples waiting to be read"""
+    def available(self):
+        return self._write_index - self._read_index
+
+    """Fraction of the buffer currently filled (0.0 - 1.0)"""
+    def fill_level(self):
+        return self.available() / self.capacity
+
+    """Copy samples from native memory into the ring buffer (producer side).
+    @param address: the address of the float32 samples to copy
+    @param count: the number of samples available at the address
+    @returns the number of samples written
+    """
+    def write(self, address, count):
+        free = self.capacity - (self._write_index - self._read_index)
+        if count > free:
+            self.overruns += 1
+            self.dropped_samples += count - free
+            count = free - (free % self.channels)
+
+        if count <= 0:
+            return 0
+
+        start = self._write_index % self.capacity
+        first = min(count, self.capacity - start)
+        ctypes.memmove(self.address + start * FLOAT_SIZE, address, first * FLOAT_SIZE)
+
+        if count > first:
+            ctypes.memmove(self.address, address + first * FLOAT_SIZE, (count - first) * FLOAT_SIZE)
+
+        # Publishing the new write index is the last step so the consumer never sees partial data
+        self._write_index += count
+        self.written_samples += count
+
+        return count
+
+    """Drain complete frames into the preallocated output buffer (consumer side).
+    @param count: the maximum number of samples to drain, all available samples if None
+    @returns a view of the output buffer holding the drained samples
+    """
+    def read(self, count=None):
+        count = self._limit(count)
+
+        if count <= 0:
+            self.underruns += 1
+            return self._output[:0]
+
+        start = self._read_index % self.capacity
+        first = min(count, self.capacity - start)
+        ctypes.memmove(self.output_address, self.address + start * FLOAT_SIZE, first * FLOAT_SIZE)
+
+        if count > first:
+            ctypes.memmove(self.output_address + first * FLOAT_SIZE, self.address, (count - first) * FLOAT_SIZE)
+
+        self._read_index += count
+
+        return self._output[:count]
+
+    """Get complete frames without copying them (consumer side).
+    The samples stay valid until they are released with consume().
+    @param count: the maximum number of samples to get, all available samples if None
+    @returns a tuple of the address of the first sample, the number of samples at that address
+    and the number of samples that wrapped around to the start of the buffer (self.address)
+    """
+    def peek(self, count=None):
+        count = self._limit(count)
+
+        if count <= 0:
+            self.underruns += 1
+            return self.address, 0, 0
+
+        start = self._read_index % self.capacity
+        first = min(count, self.capacity - start)
+
+        return self.address + start * FLOAT_SIZE, first, count - first
+
+    """Number of samples in complete frames available to the consumer, up to count"""
+    def _limit(self, count):
+        available = self._write_index - self._read_index
+        if count is None or count > available:
+            count = available
+
+        return count - count % self.channels
+
+    """Release samples returned by peek() back to the producer (consumer side).
+    @param count: the number of samples to release
+    """
+    def consume(self, count):
+        self._read_index += count
+
+    """Discard any buffered samples (consumer side)"""
+    def clear(self):
+        self._read_index = self._write_index
+
+    def stats(self):
+        return {
+            'capacity': self.capacity,
+            'channels': self.channels,
+            'fill_level': round(self.fill_level(), 3),
+            'written_samples': self.written_samples,
+            'dropped_samples': self.dropped_samples,
+            'overruns': self.overruns,
+            'underruns': self.underruns
+            }
@@ -0,0 +1,140 @@
+import logging
+import os
+import time
+
+from lib.common import load_state, save_state
+
+log = logging.getLogger()
+
+PRESET_INDEX_STATE = 'preset_index'
+PRESET_INDEX_VERSION = 1
+PRESET_EXTENSIONS = ('.milk', '.prjm')
+
+"""Sort key of the playlist order: the preset file name, then the full path"""
+def preset_sort_key(preset):
+    return (os.path.basename(preset), preset)
+
+class PresetIndex:
+    """Persistent index of the preset directories (in general.state_path), so startup does not have to
+    list every directory below the preset paths. Every indexed directory keeps its mtime, its preset files
+    with their size and mtime, and its subdirectories. A directory only changes its mtime when entries are
+    added, removed or renamed, so directories with an unchanged mtime are taken from the index with a
+    single stat and only changed directories are listed again.
+    @param config: the projectMAR configuration
+    """
+    def __init__(self, config):
+        self.config = config
+
+        start = time.perf_counter()
+        index = load_state(config, PRESET_INDEX_STATE, dict())
+        if not isinstance(index, dict) or index.get('version') != PRESET_INDEX_VERSION:
+            index = dict()
+
+        self.directories = index.get('directories', dict())
+        self.load_seconds = time.perf_counter() - start
+
+        self.scanned = 0
+        self.rescanned = 0
+        self.presets = 0
+        self.seconds = 0
+
+    """List a directory.
+    @param directory: the path of the directory
+    @param mtime: the mtime of the directory in nanoseconds
+    @returns the index entry of the directory
+    """
+    def scan_directory(self, directory, mtime):
+        files = list()
+        directories = list()
+
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        directories.append(entry.name)
+                    elif entry.name.lower().endswith(PRESET_EXTENSIONS):
+                        stat = entry.stat()
+                        files.append([entry.name, stat.st_size, int(stat.st_mtime)])
+                except OSError:
+                    continue
+
+        return {'mtime': mtime, 'files': files, 'dirs': directories}
+
+    """Get the sorted preset files below a list of preset files and directories, rescanning only
+    directories which changed since the last run, and persist the updated index.
+    @param paths: preset files and directories to search recursively
+    @returns the preset paths sorted by file name
+    """
+    def scan(self, paths):
+        start = time.perf_counter()
+        self.rescanned = 0
+
+        presets = dict()
+        directories = dict()
+        roots = list()
+        for path in paths:
+            path = os.path.abspath(path)
+            if os.path.isfile(path):
+                presets[path] = None
+                continue
+
+            roots.append(path)
+            pending = [path]
+            while pending:
+                directory = pending.pop()
+                if directory in directories:
+                    continue
+
+                try:
+                    mtime = os.stat(directory).st_mtime_ns
+                    entry = self.directories.get(directory)
+                    if not entry or entry['mtime'] != mtime:
+                        entry = self.scan_directory(directory, mtime)
+                        self.rescanned += 1
+                except OSError as e:
+                    log.warning(f'Unable to scan preset directory {directory}: {e}')
+                    continue
+
+                directories[directory] = entry
+                for name, _, _ in entry['files']:
+                    presets[os.path.join(directory, name)] = None
+                pending.extend(os.path.join(directory, name) for name in entry['dirs'])
+
+        # Only directories below the scanned roots are replaced, the index of other preset paths (used by
+        # other runs, e.g. profile_presets.py or render_offline.py --preset) is kept
+        removed = [directory for directory in self.directories
+                   if directory not in directories and self.is_below(directory, roots)]
+        for directory in removed:
+            del self.directories[directory]
+
+        self.directories.update(directories)
+        if self.rescanned or removed:
+            self.save()
+
+        sorted_presets = sorted(presets, key=preset_sort_key)
+
+        self.scanned = len(directories)
+        self.presets = len(sorted_presets)
+        self.seconds = time.perf_counter() - start
+
+        return sorted_presets
+
+    """Check if a directory is one of the roots or below one of them.
+    @param directory: the absolute path of the directory
+    @param roots: absolute directory paths
+    """
+    @staticmethod
+    def is_below(directory, roots):
+        return any(directory == root or directory.startswith(root.rstrip(os.sep) + os.sep) for root in roots)
+
+    def save(self):
+        save_state(self.config, PRESET_INDEX_STATE, {'version': PRESET_INDEX_VERSION, 'directories': self.directories})
+
+    def stats(self):
+        return {
+            'presets': self.presets,
+            'directories': self.scanned,
+            'directories_rescanned': self.rescanned,
+            'load_milliseconds': round(self.load_seconds * 1000, 1),
+            'scan_milliseconds': round(self.seconds * 1000, 1)
+            }
@@ -0,0 +1,130 @@
+import collections
+import logging
+import os
+import queue
+import threading
+
+log = logging.getLogger()
+
+class PresetPrefetcher:
+    """Read the presets predicted to be loaded next on a worker thread, so the synchronous read libprojectM
+    does on the render thread when switching is served from the page cache instead of the SD card.
+    Files are read completely (after a POSIX_FADV_WILLNEED hint where available), a hint alone returns before
+    the data is there. A bounded LRU of the prefetched presets and their sizes keeps track of what is still
+    expected to be cached, so presets are not read again on every prediction and hits can be counted.
+    @param cache_size: the number of bytes of prefetched presets remembered
+    """
+    def __init__(self, cache_size=16 * 1024 * 1024):
+        self.cache_size = cache_size
+
+        self._cache = collections.OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+
+        self._queue = queue.Queue()
+        self._running = True
+        self._thread = threading.Thread(target=self.worker, name='PresetPrefetcher', daemon=True)
+        self._thread.start()
+
+        self.prefetched = 0
+        self.prefetched_bytes = 0
+        self.read_errors = 0
+        self.hits = 0
+        self.misses = 0
+        self.switches_timed = 0
+        self.stall_ns_total = 0
+        self.stall_ns_max = 0
+
+    """Queue presets to be read ahead of their switch, most likely first.
+    @param presets: the preset paths
+    """
+    def prefetch(self, presets):
+        for preset in presets:
+            if preset and not self.is_cached(preset):
+                self._queue.put(preset)
+
+    def is_cached(self, preset):
+        with self._lock:
+            return preset in self._cache
+
+    def worker(self):
+        while self._running:
+            preset = self._queue.get()
+            if preset is None or self.is_cached(preset):
+                continue
+
+            try:
+                size = self.read_preset(preset)
+            except OSError as e:
+                self.read_errors += 1
+                log.debug(f'Failed to prefetch preset {preset}: {e}')
+                continue
+
+            with self._lock:
+                self._cache[preset] = size
+                self._cached_bytes += size
+
+                while self._cached_bytes > self.cache_size and len(self._cache) > 1:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._cached_bytes -= evicted
+
+            self.prefetched += 1
+            self.prefetched_bytes += size
+
+    """Read a preset file into the page cache.
+    @param preset: the path of the preset
+    @returns the size of the preset
+    """
+    def read_preset(self, preset):
+        size = 0
+        with open(preset, 'rb', buffering=0) as infile:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(infile.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+
+            while True:
+                data = infile.read(65536)
+                if not data:
+                    break
+                size += len(data)
+
+        return size
+
+    """Count a preset switch as hit or miss of the prefetched presets.
+    @param preset: the path of the preset switched to
+    @param stall_ns: the nanoseconds the switch blocked the render thread, None if it was not timed
+    """
+    def preset_switched(self, preset, stall_ns=None):
+        with self._lock:
+            hit = preset in self._cache
+            if hit:
+                self._cache.move_to_end(preset)
+
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+        if stall_ns is not None:
+            self.switches_timed += 1
+            self.stall_ns_total += stall_ns
+            self.stall_ns_max = max(self.stall_ns_max, stall_ns)
+
+    def stats(self):
+        switches = self.hits + self.misses
+
+        return {
+            'switches': switches,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / switches, 2) if switches else 0,
+            'stall_ms_mean': round(self.stall_ns_total / self.switches_timed / 1000000, 2) if self.switches_timed else 0,
+            'stall_ms_max': round(self.stall_ns_max / 1000000, 2),
+            'prefetched': self.prefetched,
+            'prefetched_kb': self.prefetched_bytes // 1024,
+            'read_errors': self.read_errors
+            }
+
+    def close(self):
+        self._running = False
+        self._queue.put(None)
+        self._thread.join(timeout=1)
@@ -0,0 +1,249 @@
+import glob
+import logging
+import os
+import time
+
+import numpy as np
+
+from OpenGL import GL
+
+from lib.common import get_state_path, load_state, save_state
+from lib.projectM.PresetIndex import PRESET_EXTENSIONS
+
+log = logging.getLogger()
+
+PRESET_COST_STATE = 'preset_costs'
+
+"""Name of the state a profiler shard writes its results to, so shards never write the same file.
+@param shard: the index of the shard
+@param shards: the number of shards
+"""
+def preset_cost_state_name(shard=0, shards=1):
+    if shards <= 1:
+        return PRESET_COST_STATE
+
+    return f'{PRESET_COST_STATE}.{shard}of{shards}'
+
+"""Load the preset cost index written by the preset profiler, merging the results of all shards.
+@param config: the projectMAR configuration
+@returns a dict of preset path to its measured costs
+"""
+def load_preset_costs(config):
+    costs = dict()
+
+    for path in sorted(glob.glob(os.path.join(get_state_path(config), f'{PRESET_COST_STATE}*.json'))):
+        name = os.path.basename(path)[:-len('.json')]
+        if name.endswith('.current'):
+            continue
+
+        shard_costs = load_state(config, name, dict())
+        if isinstance(shard_costs, dict):
+            costs.update(shard_costs)
+
+    return costs
+
+"""Find the preset files below a list of files and directories.
+@param paths: preset files and directories to search recursively
+@returns the sorted list of preset paths
+"""
+def find_presets(paths):
+    presets = set()
+
+    for path in paths:
+        if os.path.isfile(path):
+            presets.add(os.path.abspath(path))
+            continue
+
+        for root, _, files in os.walk(path):
+            for name in files:
+                if name.lower().endswith(PRESET_EXTENSIONS):
+                    presets.add(os.path.abspath(os.path.join(root, name)))
+
+    return sorted(presets)
+
+"""Generate a repeatable music-like test signal: a kick every half second, a bass line, a swept tone
+and some noise, so presets reacting to beats, bass and treble all have something to do.
+@param sample_rate: the sample rate of the signal
+@param seconds: the length of the signal
+@returns interleaved stereo float32 samples
+"""
+def generate_test_signal(sample_rate=44100, seconds=8):
+    t = np.arange(int(sample_rate * seconds), dtype=np.float64) / sample_rate
+    rng = np.random.default_rng(0)
+
+    beat = t % 0.5
+    kick = np.sin(2 * np.pi * (60 + 90 * np.exp(-beat * 30)) * beat) * np.exp(-beat * 12)
+    bass = 0.3 * np.sin(2 * np.pi * 55 * (1 + (t // 2) % 4 / 4) * t)
+    sweep = 0.15 * np.sin(2 * np.pi * (400 + 3600 * (t % seconds) / seconds) * t)
+    noise = 0.05 * rng.standard_normal(t.size)
+
+    left = 0.6 * kick + bass + sweep + noise
+    right = 0.6 * kick + bass - sweep + noise
+
+    return np.clip(np.stack((left, right), axis=1), -1, 1).astype(np.float32).ravel()
+
+class PresetProfiler:
+    """Measure the rendering cost of presets loaded through the projectM playlist.
+    Every preset renders frames with the same synthetic audio. The GPU is waited for after every
+    frame, so the frame times are what the preset costs and not the time to queue its commands.
+    The first frame compiles the preset's shaders and is counted as load time.
+    @param projectm_wrapper: the ProjectMWrapper rendering the presets
+    @param sdl_rendering: the SDLRendering holding the OpenGL context
+    @param frames: the number of frames measured per preset
+    @param fps: the frame rate the synthetic audio is fed at
+    @param sample_rate: the sample rate of the synthetic audio
+    """
+    def __init__(self, projectm_wrapper, sdl_rendering, frames=300, fps=60, sample_rate=44100):
+        self.projectm_wrapper = projectm_wrapper
+        self.sdl_rendering = sdl_rendering
+        self.frames = frames
+
+        self._signal = generate_test_signal(sample_rate)
+        self._block_frames = sample_rate // fps
+        self._position = 0
+
+        self._frame_times = np.zeros(frames, dtype=np.float64)
+
+        self._switched_to = None
+        self.projectm_wrapper.on_preset_changed = self.preset_switched
+
+        self.renderer = GL.glGetString(GL.GL_RENDERER).decode('utf-8', 'replace')
+        log.info(f'Profiling presets on {self.renderer}')
+
+    def preset_switched(self, preset):
+        self._switched_to = preset
+
+    """Feed the next block of the synthetic signal to projectM"""
+    def add_audio(self):
+        count = self._block_frames * 2
+        if self._position + count > self._signal.size:
+            self._position = 0
+
+        self.projectm_wrapper.add_pcm_ptr(self._signal.ctypes.data + self._position * 4, self._block_frames, 2)
+        self._position += count
+
+    """Render one frame and wait for the GPU.
+    @returns the frame time in nanoseconds
+    """
+    def render(self):
+        start = time.perf_counter_ns()
+
+        self.add_audio()
+        GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+        self.projectm_wrapper.render_frame()
+        GL.glFinish()
+
+        frame_time = time.perf_counter_ns() - start
+        self.sdl_rendering.swap()
+
+        return frame_time
+
+    """Load a preset through the playlist and measure its costs.
+    @param preset: the path of the preset
+    @returns a dict of the measured costs
+    """
+    def profile(self, preset):
+        stat = os.stat(preset)
+        result = {
+            'mtime': int(stat.st_mtime),
+            'size': stat.st_size,
+            'renderer': self.renderer,
+            'profiled': time.strftime('%Y-%m-%d %H:%M:%S')
+            }
+
+        index = self.projectm_wrapper.add_preset(preset)
+        if index is None:
+            result['failed'] = 'not added to the playlist'
+            return result
+
+        self._switched_to = None
+        start = time.perf_counter_ns()
+        self.projectm_wrapper.set_preset_index(index, softcut=False)
+
+        if self._switched_to != preset:
+            result['failed'] = 'failed to load'
+            return result
+
+        # The first frame compiles the shaders of the preset
+        self.render()
+        result['load_ms'] = round((time.perf_counter_ns() - start) / 1000000, 2)
+
+        for frame in range(self.frames):
+            self._frame_times[frame] = self.render()
+
+        frame_times = self._frame_times / 1000000
+        result.update({
+            'frames': self.frames,
+            'mean_ms': round(float(frame_times.mean()), 2),
+            'p95_ms': round(float(np.percentile(frame_times, 95)), 2),
+            'max_ms': round(float(frame_times.max()), 2)
+            })
+
+        return result
+
+class PresetCostIndex:
+    """The results of one profiler shard, persisted with the shared state helpers.
+    The preset being profiled is saved before it is loaded, so a preset crashing projectM is recorded
+    as crashed when the shard is restarted instead of crashing it again.
+    @param config: the projectMAR configuration
+    @param shard: the index of the shard
+    @param shards: the number of shards
+    """
+    def __init__(self, config, shard=0, shards=1):
+        self.config = config
+        self.name = preset_cost_state_name(shard, shards)
+        self._current_name = f'{self.name}.current'
+
+        self.costs = load_state(config, self.name, dict())
+        self._unsaved = 0
+
+        crashed = load_state(config, self._current_name)
+        if crashed and crashed not in self.costs:
+            log.warning(f'Preset {crashed} crashed the previous run, recording it as crashed')
+            self.costs[crashed] = {'failed': 'crashed', 'profiled': time.strftime('%Y-%m-%d %H:%M:%S')}
+            self.save()
+
+    """Whether a preset was profiled in its current version.
+    @param preset: the path of the preset
+    @param costs: the merged cost index of all shards
+    """
+    @staticmethod
+    def is_profiled(preset, costs):
+        entry = costs.get(preset)
+        if not entry:
+            return False
+
+        if entry.get('failed') == 'crashed':
+            return True
+
+        try:
+            stat = os.stat(preset)
+        except OSError:
+            return True
+
+        return entry.get('mtime') == int(stat.st_mtime) and entry.get('size') == stat.st_size
+
+    """Remember the preset about to be profiled"""
+    def begin(self, preset):
+        save_state(self.config, self._current_name, preset)
+
+    """Record the result of a preset.
+    @param preset: the path of the preset
+    @param result: the measured costs
+    @param save_every: the number of results after which the index is saved
+    """
+    def record(self, preset, result, save_every=20):
+        self.costs[preset] = result
+        self._unsaved += 1
+
+        if self._unsaved >= save_every:
+            self.save()
+
+    def save(self):
+        save_state(self.config, self.name, self.costs)
+        self._unsaved = 0
+
+    """Save the results and forget the preset in progress"""
+    def close(self):
+        self.save()
+        save_state(self.config, self._current_name, None)
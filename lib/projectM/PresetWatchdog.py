@@ -0,0 +1,141 @@
+import logging
+import time
+
+from lib.common import load_state, save_state
+
+log = logging.getLogger()
+
+PRESET_BLACKLIST_STATE = 'preset_blacklist'
+
+"""Load the persisted preset blacklist.
+@param config: the projectMAR configuration
+@returns a dict of preset path to the details recorded when it was blacklisted
+"""
+def load_preset_blacklist(config):
+    blacklist = load_state(config, PRESET_BLACKLIST_STATE, dict())
+    if not isinstance(blacklist, dict):
+        log.warning('Ignoring the malformed preset blacklist')
+        return dict()
+
+    return blacklist
+
+"""Remove presets from the persisted blacklist.
+@param config: the projectMAR configuration
+@param presets: the preset paths to remove, all presets when empty
+@returns the remaining blacklist
+"""
+def clear_preset_blacklist(config, presets=None):
+    blacklist = load_preset_blacklist(config)
+
+    if presets:
+        for preset in presets:
+            if blacklist.pop(preset, None) is None:
+                log.warning(f'Preset {preset} is not blacklisted')
+    else:
+        blacklist = dict()
+
+    save_state(config, PRESET_BLACKLIST_STATE, blacklist)
+    return blacklist
+
+class PresetWatchdog:
+    """Detect presets that bring the frame rate down and skip them.
+    Every rendered frame is checked against max_frame_time. A leaky counter tracks the slow frames of the
+    current preset (+1 per slow frame, -1 per fast one), so occasional hiccups are forgiven while a preset
+    that keeps rendering slowly reaches max_slow_frames and is cut away. Presets cut away strikes times
+    are added to a persistent blacklist, which is applied when the playlist is built. The frame in which a
+    preset switched includes loading it and is not counted.
+    @param config: the projectMAR configuration
+    @param max_frame_time: the frame time in seconds above which a frame is slow
+    @param max_slow_frames: the number of slow frames after which the preset is cut away
+    @param strikes: the number of cuts after which a preset is blacklisted (0 never blacklists)
+    """
+    def __init__(self, config, max_frame_time=0.1, max_slow_frames=60, strikes=0):
+        self.config = config
+
+        self._max_frame_time_ns = int(max_frame_time * 1000000000)
+        self.max_slow_frames = max_slow_frames
+        self.strikes = strikes
+
+        self.blacklist = load_preset_blacklist(config)
+        self._strikes = dict()
+
+        self.preset = None
+        self._switched = False
+        self._slow_frames = 0
+        self._frames = 0
+        self._frame_time_total = 0
+
+        self.cuts = 0
+        self.blacklisted = 0
+
+    """Start watching a new preset, called by the projectM wrapper when the preset switched.
+    @param preset: the path of the new preset
+    """
+    def preset_switched(self, preset):
+        self.preset = preset
+        self._switched = True
+        self._slow_frames = 0
+        self._frames = 0
+        self._frame_time_total = 0
+
+    """Register the time a frame of the current preset took.
+    @param frame_time: the frame time in nanoseconds
+    @returns True if the preset has to be cut away
+    """
+    def frame_rendered(self, frame_time):
+        if self._switched:
+            self._switched = False
+            return False
+
+        self._frames += 1
+        self._frame_time_total += frame_time
+
+        if frame_time > self._max_frame_time_ns:
+            self._slow_frames += 1
+        elif self._slow_frames:
+            self._slow_frames -= 1
+
+        if self._slow_frames < self.max_slow_frames:
+            return False
+
+        average = self._frame_time_total / self._frames / 1000000
+        log.warning(f'Preset {self.preset} keeps rendering frames slower than {self._max_frame_time_ns / 1000000:.0f}ms '
+                    f'(average {average:.1f}ms), cutting to the next preset')
+
+        self.cuts += 1
+        self._slow_frames = 0
+
+        if self.preset and self.strikes > 0:
+            strikes = self._strikes.get(self.preset, 0) + 1
+            self._strikes[self.preset] = strikes
+
+            if strikes >= self.strikes:
+                self.add_to_blacklist(self.preset, average)
+
+        return True
+
+    """Whether the current preset was just blacklisted and should be removed from the playlist"""
+    def preset_blacklisted(self):
+        return self.preset in self.blacklist
+
+    """Add a preset to the persistent blacklist.
+    @param preset: the path of the preset
+    @param average: the average frame time of the preset in milliseconds
+    """
+    def add_to_blacklist(self, preset, average):
+        self.blacklist[preset] = {
+            'average_frame_ms': round(average, 1),
+            'strikes': self._strikes.get(preset, 0),
+            'added': time.strftime('%Y-%m-%d %H:%M:%S')
+            }
+        self.blacklisted += 1
+
+        log.warning(f'Blacklisted preset {preset}, see "projectMAR.py --blacklist"')
+        save_state(self.config, PRESET_BLACKLIST_STATE, self.blacklist)
+
+    def stats(self):
+        return {
+            'preset_cuts': self.cuts,
+            'presets_blacklisted': self.blacklisted,
+            'blacklist_size': len(self.blacklist)
+            }
@@ -1,11 +1,16 @@
 import ctypes
 import logging
 import os
+import random
 import time
 import shutil
 
 import numpy as np
 
+from lib.projectM.PresetIndex import PresetIndex
+from lib.projectM.PresetPrefetcher import PresetPrefetcher
+from lib.projectM.PresetWatchdog import load_preset_blacklist
+
 log = logging.getLogger()
 
 PresetSwitchedCallback = ctypes.CFUNCTYPE(None, ctypes.c_bool, ctypes.c_uint, ctypes.c_void_p)
@@ -41,6 +46,19 @@ class ProjectMWrapper:
         self._current_preset = None
         self._current_preset_start = None
 
+        # Called with the path of the new preset after every preset switch, and after a preset failed to load
+        self.on_preset_changed = None
+        self.on_preset_load_failed = None
+
+        # The presets most likely switched to next are read ahead on a worker thread. With shuffle enabled the
+        # next preset is picked in advance, so it can be prefetched as well
+        self.preset_prefetcher = None
+        self._prefetch_ahead = self.config.projectm.get('projectm.presetprefetchahead', 2)
+        self._next_shuffle_index = None
+        self._switch_start = None
+        if self.config.projectm.get('projectm.presetprefetch', True):
+            self.preset_prefetcher = PresetPrefetcher(self.config.projectm.get('projectm.presetprefetchcachesize', 16) * 1024 * 1024)
+
         # Set up projectm function signatures (examples, adjust as needed)
         self.projectm_lib.projectm_create.restype = ctypes.c_void_p
         self.projectm_lib.projectm_destroy.argtypes = [ctypes.c_void_p]
@@ -58,11 +76,29 @@ class ProjectMWrapper:
         self.projectm_lib.projectm_get_beat_sensitivity.argtypes = [ctypes.c_void_p]
         self.projectm_lib.projectm_get_beat_sensitivity.restype = ctypes.c_float
         self.projectm_lib.projectm_opengl_render_frame.argtypes = [ctypes.c_void_p]
+
+        # Rendering into a framebuffer object needs projectM 4.1, older versions render into the bound framebuffer
+        self._render_frame_fbo = getattr(self.projectm_lib, 'projectm_opengl_render_frame_fbo', None)
+        if self._render_frame_fbo:
+            self._render_frame_fbo.argtypes = [ctypes.c_void_p, ctypes.c_uint32]
+            self._render_frame_fbo.restype = None
+
+        # Fixed timesteps for offline rendering need projectM 4.1 as well, otherwise projectM follows the wall clock
+        self._set_frame_time = getattr(self.projectm_lib, 'projectm_set_frame_time', None)
+        if self._set_frame_time:
+            self._set_frame_time.argtypes = [ctypes.c_void_p, ctypes.c_double]
+            self._set_frame_time.restype = None
         self.projectm_lib.projectm_get_mesh_size.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_size_t), ctypes.POINTER(ctypes.c_size_t)]
         self.projectm_lib.projectm_get_preset_locked.argtypes = [ctypes.c_void_p]
         self.projectm_lib.projectm_get_preset_locked.restype = ctypes.c_bool
         self.projectm_lib.projectm_pcm_add_float.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_float), ctypes.c_uint, ctypes.c_int]
         self.projectm_lib.projectm_pcm_add_float.restype = None
+
+        # Second binding of projectm_pcm_add_float taking a plain address, so callers holding native memory
+        # (SDL streams, the PCM ring buffer) avoid building ctypes pointer objects for every call
+        self._pcm_add_float_ptr = self.projectm_lib['projectm_pcm_add_float']
+        self._pcm_add_float_ptr.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+        self._pcm_add_float_ptr.restype = None
         self.projectm_lib.projectm_set_texture_search_paths.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.POINTER(ctypes.c_char_p)), ctypes.c_int]
         self.projectm_lib.projectm_set_texture_search_paths.restype = None
 
@@ -78,6 +114,9 @@ class ProjectMWrapper:
         self.projectm_playlist_lib.projectm_playlist_destroy.argtypes = [ctypes.c_void_p]
         self.projectm_playlist_lib.projectm_playlist_set_shuffle.argtypes = [ctypes.c_void_p, ctypes.c_bool]
         self.projectm_playlist_lib.projectm_playlist_add_preset.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_bool]
+        self.projectm_playlist_lib.projectm_playlist_add_preset.restype = ctypes.c_bool
+        self.projectm_playlist_lib.projectm_playlist_add_presets.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_char_p), ctypes.c_uint, ctypes.c_bool]
+        self.projectm_playlist_lib.projectm_playlist_add_presets.restype = ctypes.c_uint
         self.projectm_playlist_lib.projectm_playlist_add_path.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_bool, ctypes.c_bool]
         self.projectm_playlist_lib.projectm_playlist_remove_preset.argtypes = [ctypes.c_void_p, ctypes.c_uint]
         self.projectm_playlist_lib.projectm_playlist_remove_preset.restype = ctypes.c_bool
@@ -93,8 +132,14 @@ class ProjectMWrapper:
         self.projectm_playlist_lib.projectm_playlist_get_shuffle.restype = ctypes.c_bool
         self.projectm_playlist_lib.projectm_playlist_item.argtypes = [ctypes.c_void_p, ctypes.c_uint]
         self.projectm_playlist_lib.projectm_playlist_item.restype = ctypes.c_char_p
-        self.projectm_playlist_lib.projectm_playlist_free_string.argtypes = [ctypes.c_char_p]
+        self.projectm_playlist_lib.projectm_playlist_free_string.argtypes = [ctypes.c_void_p]
         self.projectm_playlist_lib.projectm_playlist_free_string.restype = None
+
+        # Second binding of projectm_playlist_item returning the raw pointer, so the string can be freed
+        # when walking the whole playlist
+        self._playlist_item_ptr = self.projectm_playlist_lib['projectm_playlist_item']
+        self._playlist_item_ptr.argtypes = [ctypes.c_void_p, ctypes.c_uint]
+        self._playlist_item_ptr.restype = ctypes.c_void_p
         self.projectm_playlist_lib.projectm_playlist_set_preset_switched_event_callback.argtypes = [ctypes.c_void_p, PresetSwitchedCallback, ctypes.c_void_p]
         self.projectm_playlist_lib.projectm_playlist_set_preset_switch_failed_event_callback.argtypes = [ctypes.c_void_p, PresetSwitchFailedCallback, ctypes.c_void_p]
 
@@ -169,18 +214,27 @@ class ProjectMWrapper:
 
                 preset_path_index += 1
 
-            for preset_path in self.preset_paths:
-                if os.path.isfile(preset_path):
-                    self.projectm_playlist_lib.projectm_playlist_add_preset(self._playlist, preset_path.encode(), False)
-                else:
-                    log.info(f'Adding preset path {preset_path}')
-                    self.projectm_playlist_lib.projectm_playlist_add_path(self._playlist, preset_path.encode(), True, False)
+            start = time.perf_counter()
+            if self.config.projectm.get('projectm.presetindex', True):
+                self.add_indexed_presets()
+            else:
+                for preset_path in self.preset_paths:
+                    if os.path.isfile(preset_path):
+                        self.projectm_playlist_lib.projectm_playlist_add_preset(self._playlist, preset_path.encode(), False)
+                    else:
+                        log.info(f'Adding preset path {preset_path}')
+                        self.projectm_playlist_lib.projectm_playlist_add_path(self._playlist, preset_path.encode(), True, False)
+
+                # Sorting constants (replace with actual values)
+                SORT_PREDICATE_FILENAME_ONLY = 0
+                SORT_ORDER_ASCENDING = 0
+                size = self.projectm_playlist_lib.projectm_playlist_size(self._playlist)
+                self.projectm_playlist_lib.projectm_playlist_sort(self._playlist, 0, size, SORT_PREDICATE_FILENAME_ONLY, SORT_ORDER_ASCENDING)
 
-            # Sorting constants (replace with actual values)
-            SORT_PREDICATE_FILENAME_ONLY = 0
-            SORT_ORDER_ASCENDING = 0
             size = self.projectm_playlist_lib.projectm_playlist_size(self._playlist)
-            self.projectm_playlist_lib.projectm_playlist_sort(self._playlist, 0, size, SORT_PREDICATE_FILENAME_ONLY, SORT_ORDER_ASCENDING)
+            log.info(f'Loaded {size} presets into the playlist in {(time.perf_counter() - start) * 1000:.0f}ms')
+
+            self.apply_preset_blacklist(load_preset_blacklist(self.config))
 
             # Setup callback and userdata
             self._preset_switched_event_callback = on_preset_switched
@@ -202,7 +256,19 @@ class ProjectMWrapper:
                 self._user_data_ptr
             )
 
+    """Add the presets below the preset paths from the persistent preset index, already sorted and in a single call"""
+    def add_indexed_presets(self):
+        preset_index = PresetIndex(self.config)
+        presets = preset_index.scan(self.preset_paths)
+        log.info(f'Preset index statistics: {preset_index.stats()}')
+
+        # The index has no duplicates, so the playlist does not have to check every preset against all others
+        preset_array = (ctypes.c_char_p * len(presets))(*[preset.encode() for preset in presets])
+        self.projectm_playlist_lib.projectm_playlist_add_presets(self._playlist, preset_array, len(presets), True)
+
     def uninitialize(self):
+        if self.preset_prefetcher:
+            self.preset_prefetcher.close()
         if self._projectM:
             self.projectm_lib.projectm_destroy(self._projectM)
             self._projectM = None
@@ -219,9 +285,27 @@ class ProjectMWrapper:
         if self.config.projectm.get("window.displaypresetnameintitle", True):
             self._sdl_rendering.set_sdl_window_title(self._current_preset.rsplit('/', 1)[1].encode())
 
+        if self.preset_prefetcher:
+            # Switches requested through the wrapper are timed, projectM's own switches happen inside render_frame
+            stall_ns = time.perf_counter_ns() - self._switch_start if self._switch_start else None
+            self._switch_start = None
+
+            self.preset_prefetcher.preset_switched(self._current_preset, stall_ns)
+            self.prefetch_next_presets(index)
+
+        if self.on_preset_changed:
+            self.on_preset_changed(self._current_preset)
+
     def on_preset_switch_failed(self, error_msg: str):
         error_string = ctypes.string_at(error_msg).decode("utf-8")
         log.error(f'Failed to switch preset with error {error_string}')
+        self._switch_start = None
+
+        # The pre-picked shuffle index may be the preset that failed, the next switch picks a new one
+        self._next_shuffle_index = None
+
+        if self.on_preset_load_failed:
+            self.on_preset_load_failed()
 
     def get_active_preset_index(self):
         return self.projectm_playlist_lib.projectm_playlist_get_position(self._playlist)
@@ -233,6 +317,46 @@ class ProjectMWrapper:
 
         return item.decode('utf-8')
 
+    """Remove blacklisted presets from the playlist.
+    @param blacklist: the preset paths to remove
+    """
+    def apply_preset_blacklist(self, blacklist):
+        if not blacklist:
+            return
+
+        removed = 0
+        size = self.projectm_playlist_lib.projectm_playlist_size(self._playlist)
+        for index in reversed(range(size)):
+            item = self._playlist_item_ptr(self._playlist, index)
+            if not item:
+                continue
+
+            preset = ctypes.string_at(item).decode('utf-8')
+            self.projectm_playlist_lib.projectm_playlist_free_string(item)
+
+            if preset in blacklist:
+                self.projectm_playlist_lib.projectm_playlist_remove_preset(self._playlist, index)
+                removed += 1
+
+        log.info(f'Removed {removed} blacklisted presets from the playlist, see "projectMAR.py --blacklist"')
+
+    """Append a preset file to the playlist.
+    @param preset_path: the path of the preset
+    @returns the index of the preset in the playlist, or None if it was not added
+    """
+    def add_preset(self, preset_path):
+        index = self.projectm_playlist_lib.projectm_playlist_size(self._playlist)
+        if not self.projectm_playlist_lib.projectm_playlist_add_preset(self._playlist, preset_path.encode(), False):
+            return None
+
+        return index
+
+    """Remove the active preset from the playlist without touching the preset file"""
+    def remove_active_preset(self):
+        preset_index = self.get_active_preset_index()
+        log.info(f'Removing {self.get_preset_item(preset_index)} from the playlist')
+        self.projectm_playlist_lib.projectm_playlist_remove_preset(self._playlist, preset_index)
+
     def display_initial_preset(self):
         if not self.config.projectm.get("projectm.enablesplash", False):
             if self.config.projectm.get("projectm.shuffleenabled", False):
@@ -274,14 +398,76 @@ class ProjectMWrapper:
             self.next_preset()
 
     def next_preset(self, softcut=True):
-        self.projectm_playlist_lib.projectm_playlist_play_next(self._playlist, softcut)
+        self._switch_start = time.perf_counter_ns()
+
+        size = self.projectm_playlist_lib.projectm_playlist_size(self._playlist)
+        if self._next_shuffle_index is not None and self._next_shuffle_index < size and self.get_preset_shuffle():
+            self.projectm_playlist_lib.projectm_playlist_set_position(self._playlist, self._next_shuffle_index, softcut)
+        else:
+            self.projectm_playlist_lib.projectm_playlist_play_next(self._playlist, softcut)
 
     def previous_preset(self, softcut=True):
+        self._switch_start = time.perf_counter_ns()
         self.projectm_playlist_lib.projectm_playlist_play_previous(self._playlist, softcut)
 
     def set_preset_index(self, index, softcut=True):
+        self._switch_start = time.perf_counter_ns()
         self.projectm_playlist_lib.projectm_playlist_set_position(self._playlist, index, softcut)
 
+    """Queue the presets most likely switched to after a preset for prefetching: the following
+    projectM.presetPrefetchAhead presets and the previous one, or with shuffle enabled the randomly
+    picked next preset next_preset will switch to.
+    @param index: the playlist index of the active preset
+    """
+    def prefetch_next_presets(self, index):
+        size = self.projectm_playlist_lib.projectm_playlist_size(self._playlist)
+        if size < 2:
+            return
+
+        if self.get_preset_shuffle():
+            self._next_shuffle_index = (index + 1 + random.randrange(size - 1)) % size
+            indices = [self._next_shuffle_index]
+        else:
+            self._next_shuffle_index = None
+            indices = [(index + offset) % size for offset in range(1, self._prefetch_ahead + 1)] + [(index - 1) % size]
+
+        presets = list()
+        for preset_index in dict.fromkeys(indices):
+            item = self._playlist_item_ptr(self._playlist, preset_index)
+            if not item:
+                continue
+
+            presets.append(ctypes.string_at(item).decode('utf-8'))
+            self.projectm_playlist_lib.projectm_playlist_free_string(item)
+
+        self.preset_prefetcher.prefetch(presets)
+
+    """Get the preset prefetch hit rate and the time preset switches blocked rendering"""
+    def preset_load_stats(self):
+        if not self.preset_prefetcher:
+            return dict()
+
+        return self.preset_prefetcher.stats()
+
+    """Move through the playlist by several positions with a single preset load.
+    With shuffle enabled the next preset is random anyway, so any offset loads one next or previous preset.
+    @param offset: the number of positions, negative to go back
+    @param softcut: soft or hard cut to the preset
+    """
+    def skip_presets(self, offset, softcut=True):
+        size = self.projectm_playlist_lib.projectm_playlist_size(self._playlist)
+        if offset == 0 or size == 0:
+            return
+
+        if abs(offset) == 1 or self.get_preset_shuffle():
+            if offset > 0:
+                self.next_preset(softcut)
+            else:
+                self.previous_preset(softcut)
+            return
+
+        self.set_preset_index((self.get_active_preset_index() + offset) % size, softcut)
+
     def get_preset_shuffle(self):
         return self.projectm_playlist_lib.projectm_playlist_get_shuffle(self._playlist)
 
@@ -315,15 +501,49 @@ class ProjectMWrapper:
             self._projectM, ptr, count_per_channel, channels
         )
 
+    """Add interleaved float32 PCM straight from native memory without any intermediate copy.
+    @param address: the address (int) of the first sample
+    @param frames: the number of samples per channel
+    @param channels: the number of interleaved channels (1 or 2)
+    """
+    def add_pcm_ptr(self, address, frames, channels):
+        if not self._projectM:
+            raise RuntimeError("projectM instance not initialized")
+
+        self._pcm_add_float_ptr(self._projectM, address, frames, channels)
+
     def render_frame(self):
         self.projectm_lib.projectm_opengl_render_frame(self._projectM)
 
+    """Render a frame into a framebuffer object.
+    @param framebuffer: the framebuffer object, which is expected to be bound already
+    """
+    def render_frame_fbo(self, framebuffer):
+        if self._render_frame_fbo:
+            self._render_frame_fbo(self._projectM, framebuffer)
+        else:
+            self.render_frame()
+
+    """Set the time projectM animates the next frame at instead of the wall clock.
+    @param seconds: the time since the first frame in seconds
+    @returns False if the projectM version has no fixed timestep support
+    """
+    def set_frame_time(self, seconds):
+        if not self._set_frame_time:
+            return False
+
+        self._set_frame_time(self._projectM, seconds)
+        return True
+
     def target_fps(self):
         return self.config.projectm.get("projectm.fps", 60)
 
     def update_real_fps(self, fps):
         self.projectm_lib.projectm_set_fps(self._projectM, int(round(fps)))
 
+    def set_mesh_size(self, mesh_x, mesh_y):
+        self.projectm_lib.projectm_set_mesh_size(self._projectM, mesh_x, mesh_y)
+
     def get_mesh_size(self):
         mesh_x = ctypes.c_size_t()
         mesh_y = ctypes.c_size_t()
@@ -19,6 +19,8 @@ class ProjectMWrapperV3:
         self._current_preset_start = None
         self._preset_locked = False
         self._preset_shuffle = False
+        self.on_preset_changed = None
+        self.on_preset_load_failed = None
         
         # Load the projectM library
         self.projectm_lib = None
@@ -103,6 +105,10 @@ class ProjectMWrapperV3:
         except Exception as e:
             logging.error(f"Failed to render frame: {e}")
     
+    def render_frame_fbo(self, framebuffer):
+        """Render a single frame into a framebuffer object"""
+        self.render_frame()
+    
     def reset(self):
         """Reset projectM - SAFE VERSION"""
         try:
@@ -135,6 +141,22 @@ class ProjectMWrapperV3:
         """Add PCM audio data for visualization"""
         logging.debug(f"Audio data received: {len(data)} samples")
     
+    def add_pcm_ptr(self, address, frames, channels=2):
+        """Add PCM audio data from native memory for visualization"""
+        logging.debug(f"Audio data received: {frames * channels} samples")
+    
+    def target_fps(self):
+        """Get the target frame rate"""
+        return self.config.projectm.get("projectm.fps", 60)
+    
+    def update_real_fps(self, fps):
+        """Set the measured frame rate"""
+        logging.debug(f"Real frame rate set to {fps:.1f} FPS")
+    
+    def set_mesh_size(self, mesh_x, mesh_y):
+        """Set the per-pixel mesh size"""
+        logging.debug(f"Mesh size set to {mesh_x}x{mesh_y}")
+    
     def set_window_size(self, width, height):
         """Set window size"""
         logging.debug(f"Window size set to {width}x{height}")
@@ -144,16 +166,27 @@ class ProjectMWrapperV3:
         logging.info("Displaying initial preset")
         self._current_preset_start = time.time()
     
-    def next_preset(self):
+    def next_preset(self, softcut=True):
         """Go to next preset"""
         logging.info("Next preset requested")
-        self._current_preset_start = time.time()
+        self.preset_switched()
     
     def previous_preset(self):
         """Go to previous preset"""
         logging.info("Previous preset requested")
+        self.preset_switched()
+
+    def skip_presets(self, offset, softcut=True):
+        """Move through the playlist by several positions"""
+        logging.info(f"Skip of {offset} presets requested")
+        self.preset_switched()
+
+    def preset_switched(self):
+        """Report a preset switch like the playlist callback does"""
         self._current_preset_start = time.time()
-    
+        if self.on_preset_changed:
+            self.on_preset_changed(self._current_preset)
+
     def get_preset_locked(self):
         """Get preset lock status"""
         return self._preset_locked
@@ -172,14 +205,23 @@ class ProjectMWrapperV3:
         self._preset_shuffle = shuffle
         logging.info(f"Shuffle set to: {shuffle}")
     
+    def remove_active_preset(self):
+        """Remove the active preset from the playlist"""
+        logging.info("Remove preset requested")
+    
     def delete_preset(self, physical=False):
         """Delete preset"""
         logging.info("Delete preset requested")
+        self.preset_switched()
     
     def change_beat_sensitivity(self, delta):
         """Change beat sensitivity"""
         logging.debug(f"Beat sensitivity change: {delta}")
     
+    def preset_load_stats(self):
+        """Get preset prefetch statistics"""
+        return dict()
+    
     def uninitialize(self):
         """Cleanup projectM"""
         logging.info("Uninitializing projectM")
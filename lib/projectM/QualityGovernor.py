@@ -0,0 +1,131 @@
+import logging
+import re
+import time
+
+import numpy as np
+
+log = logging.getLogger()
+
+"""Parse a quality ladder.
+@param ladder: comma separated levels of the form <meshX>x<meshY>@<fps>, e.g. "48x24@60, 32x16@45"
+@returns a list of (mesh_x, mesh_y, fps) tuples
+"""
+def parse_quality_ladder(ladder):
+    levels = list()
+
+    for level in str(ladder or '').split(','):
+        level = level.strip()
+        if not level:
+            continue
+
+        match = re.fullmatch(r'(\d+)\s*x\s*(\d+)\s*@\s*(\d+)', level)
+        if not match:
+            log.error(f'Ignoring invalid quality level "{level}", expected <meshX>x<meshY>@<fps>')
+            continue
+
+        levels.append(tuple(int(value) for value in match.groups()))
+
+    return levels
+
+class QualityGovernor:
+    """Step the per-pixel mesh size and the target frame rate down a ladder of quality levels while
+    frames take longer than the frame budget, and back up once there is headroom again.
+    Frame times are kept in a sliding window; a level change needs a full window above high_load
+    (going down) or a window below low_load lasting up_delay seconds (going up), and the window is
+    cleared after every change so the next decision is only based on frames of the new level.
+    @param levels: list of (mesh_x, mesh_y, fps) tuples, best quality first
+    @param window: the number of frames in the sliding window
+    @param high_load: the fraction of the frame budget above which quality is lowered
+    @param low_load: the fraction of the frame budget below which quality is raised
+    @param up_delay: seconds of headroom needed before quality is raised
+    """
+    def __init__(self, levels, window=120, high_load=0.9, low_load=0.6, up_delay=10):
+        self.levels = levels
+        self.level = 0
+
+        self.high_load = high_load
+        self.low_load = low_load
+        self._up_delay_ns = int(up_delay * 1000000000)
+
+        self._frame_times = np.zeros(window, dtype=np.float64)
+        self._evaluation_interval = max(1, window // 4)
+        self._count = 0
+        self._headroom_since = None
+
+        self.downgrades = 0
+        self.upgrades = 0
+
+    """Register the time a frame took to produce.
+    @param frame_time: the frame time in nanoseconds, excluding the buffer swap and frame pacing waits
+    @returns the new (mesh_x, mesh_y, fps) when the level changed, otherwise None
+    """
+    def frame_rendered(self, frame_time):
+        window = self._frame_times.size
+        self._frame_times[self._count % window] = frame_time
+        self._count += 1
+
+        if self._count < window or self._count % self._evaluation_interval:
+            return None
+
+        _, _, fps = self.levels[self.level]
+        budget = 1000000000 / fps
+        load = np.percentile(self._frame_times, 90) / budget
+
+        if load > self.high_load and self.level < len(self.levels) - 1:
+            return self.change_level(self.level + 1, f'p90 frame time {load * budget / 1000000:.1f}ms is {load:.0%} of the {budget / 1000000:.1f}ms budget')
+
+        if load >= self.low_load or self.level == 0:
+            self._headroom_since = None
+            return None
+
+        now = time.perf_counter_ns()
+        if self._headroom_since is None:
+            self._headroom_since = now
+            return None
+
+        if now - self._headroom_since < self._up_delay_ns:
+            return None
+
+        # The better level has a smaller budget when it renders at a higher frame rate
+        _, _, better_fps = self.levels[self.level - 1]
+        better_load = load * better_fps / fps
+        if better_load >= self.high_load:
+            return None
+
+        return self.change_level(self.level - 1, f'p90 frame time {load * budget / 1000000:.1f}ms is {load:.0%} of the {budget / 1000000:.1f}ms budget '
+                                                 f'for {self._up_delay_ns / 1000000000:.0f}s')
+
+    """Move to another quality level.
+    @param level: the index of the new level
+    @param reason: the measurement that caused the change
+    @returns the new (mesh_x, mesh_y, fps)
+    """
+    def change_level(self, level, reason):
+        old_x, old_y, old_fps = self.levels[self.level]
+        mesh_x, mesh_y, fps = self.levels[level]
+
+        if level > self.level:
+            self.downgrades += 1
+            direction = 'Lowering'
+        else:
+            self.upgrades += 1
+            direction = 'Raising'
+
+        log.info(f'{direction} quality from mesh {old_x}x{old_y} at {old_fps} fps to mesh {mesh_x}x{mesh_y} at {fps} fps: {reason}')
+
+        self.level = level
+        self._count = 0
+        self._headroom_since = None
+
+        return self.levels[level]
+
+    def stats(self):
+        mesh_x, mesh_y, fps = self.levels[self.level]
+
+        return {
+            'quality_level': self.level,
+            'mesh': f'{mesh_x}x{mesh_y}',
+            'fps': fps,
+            'downgrades': self.downgrades,
+            'upgrades': self.upgrades
+            }
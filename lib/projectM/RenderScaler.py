@@ -0,0 +1,225 @@
+import logging
+import time
+
+from OpenGL import GL
+
+log = logging.getLogger()
+
+RENDER_SCALE_STEP = 0.1
+
+"""Create a framebuffer object with a linearly filtered RGBA texture and a depth buffer.
+@param width: the width of the framebuffer
+@param height: the height of the framebuffer
+@returns a tuple of the framebuffer, texture and depth renderbuffer names
+"""
+def create_framebuffer(width, height):
+    framebuffer = GL.glGenFramebuffers(1)
+    GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, framebuffer)
+
+    texture = GL.glGenTextures(1)
+    GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
+    GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA8, width, height, 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, None)
+    GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR)
+    GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
+    GL.glFramebufferTexture2D(GL.GL_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0, GL.GL_TEXTURE_2D, texture, 0)
+
+    depth = GL.glGenRenderbuffers(1)
+    GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, depth)
+    GL.glRenderbufferStorage(GL.GL_RENDERBUFFER, GL.GL_DEPTH_COMPONENT24, width, height)
+    GL.glFramebufferRenderbuffer(GL.GL_FRAMEBUFFER, GL.GL_DEPTH_ATTACHMENT, GL.GL_RENDERBUFFER, depth)
+
+    status = GL.glCheckFramebufferStatus(GL.GL_FRAMEBUFFER)
+
+    GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+    GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, 0)
+    GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
+
+    if status != GL.GL_FRAMEBUFFER_COMPLETE:
+        delete_framebuffer(framebuffer, texture, depth)
+        raise RuntimeError(f'Framebuffer of {width}x{height} is incomplete (status {status:#x})')
+
+    return framebuffer, texture, depth
+
+"""Delete a framebuffer created with create_framebuffer.
+@param framebuffer: the framebuffer name
+@param texture: the texture name
+@param depth: the depth renderbuffer name
+"""
+def delete_framebuffer(framebuffer, texture, depth):
+    GL.glDeleteFramebuffers(1, [framebuffer])
+    GL.glDeleteTextures(1, [texture])
+    GL.glDeleteRenderbuffers(1, [depth])
+
+class RenderScaler:
+    """Render projectM into an offscreen framebuffer at a fraction of the drawable size and blit it with
+    linear filtering to the window, trading sharpness for GPU time on heavy presets.
+    The scale is either fixed or, in automatic mode, follows the measured GPU frame time: it is lowered
+    when the frame time exceeds high_load of the frame budget and raised again below low_load.
+    At a scale of 1.0 projectM renders straight to the window and no framebuffer is used.
+    Only needs framebuffer objects and glBlitFramebuffer, so it also runs on Mesa llvmpipe.
+    @param set_window_size: function telling projectM the size it renders at
+    @param scale: the fixed render scale (0.25 - 1.0), or the initial scale in automatic mode
+    @param automatic: whether to adjust the scale to the measured GPU frame time
+    @param min_scale: the lowest scale used in automatic mode
+    @param fps: the target frame rate, which sets the frame budget
+    @param high_load: the fraction of the frame budget above which the scale is lowered
+    @param low_load: the fraction of the frame budget below which the scale is raised
+    @param interval: seconds between two automatic adjustments
+    """
+    def __init__(self, set_window_size, scale=1.0, automatic=False, min_scale=0.5, fps=60, high_load=0.9, low_load=0.6, interval=2):
+        self._set_window_size = set_window_size
+
+        self.min_scale = min(max(min_scale, 0.25), 1.0)
+        self.scale = min(max(scale, self.min_scale if automatic else 0.25), 1.0)
+        self.automatic = automatic
+
+        self._budget_ns = 1000000000 / fps
+        self._high_load = high_load
+        self._low_load = low_load
+        self._interval_ns = int(interval * 1000000000)
+
+        self.width = 0
+        self.height = 0
+        self.render_width = 0
+        self.render_height = 0
+
+        self._framebuffer = None
+        self._texture = None
+        self._depth = None
+        self._failed = False
+
+        self._frame_start = 0
+        self._gpu_time = None
+        self._last_adjustment = time.perf_counter_ns()
+
+        self.scale_changes = 0
+
+    """Change the target frame rate, which sets the frame budget.
+    @param fps: the new target frame rate
+    """
+    def set_fps(self, fps):
+        self._budget_ns = 1000000000 / fps
+        self._gpu_time = None
+
+    """Set the drawable size of the window, called whenever it changed.
+    @param width: the drawable width
+    @param height: the drawable height
+    """
+    def resize(self, width, height):
+        self.width = width
+        self.height = height
+        self.apply_scale()
+
+    """Resize the framebuffer and projectM to the current scale"""
+    def apply_scale(self):
+        self.render_width = max(1, int(self.width * self.scale))
+        self.render_height = max(1, int(self.height * self.scale))
+
+        if self.scaled():
+            self.create_framebuffer()
+        else:
+            self.delete_framebuffer()
+
+        self._set_window_size(self.render_width, self.render_height)
+
+    """Whether projectM currently renders into the offscreen framebuffer"""
+    def scaled(self):
+        return self.scale < 1.0 and not self._failed and self.width > 0
+
+    def create_framebuffer(self):
+        self.delete_framebuffer()
+
+        try:
+            self._framebuffer, self._texture, self._depth = create_framebuffer(self.render_width, self.render_height)
+        except RuntimeError as e:
+            log.error(f'{e}, rendering at full size')
+            self._failed = True
+            self.render_width = self.width
+            self.render_height = self.height
+            return
+
+        log.info(f'Rendering at {self.render_width}x{self.render_height} (scale {self.scale:.2f}) for a {self.width}x{self.height} window')
+
+    def delete_framebuffer(self):
+        if self._framebuffer is None:
+            return
+
+        delete_framebuffer(self._framebuffer, self._texture, self._depth)
+
+        self._framebuffer = None
+        self._texture = None
+        self._depth = None
+
+    """Bind the framebuffer projectM renders into, called before the frame is cleared.
+    @returns the framebuffer object to render into (0 for the window)
+    """
+    def begin_frame(self):
+        if self.automatic:
+            self._frame_start = time.perf_counter_ns()
+
+        if not self._framebuffer:
+            return 0
+
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self._framebuffer)
+        return self._framebuffer
+
+    """Upscale the rendered frame to the window, called after projectM rendered the frame"""
+    def end_frame(self):
+        if self.automatic:
+            # Wait for the GPU, otherwise only the time to queue the commands is measured
+            GL.glFinish()
+            self.frame_measured(time.perf_counter_ns() - self._frame_start)
+
+        if not self._framebuffer:
+            return
+
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, self._framebuffer)
+        GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, 0)
+        GL.glBlitFramebuffer(
+            0, 0, self.render_width, self.render_height,
+            0, 0, self.width, self.height,
+            GL.GL_COLOR_BUFFER_BIT, GL.GL_LINEAR
+            )
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
+
+    """Adjust the scale to the measured GPU frame time in automatic mode.
+    @param frame_time: the GPU time of the frame in nanoseconds
+    """
+    def frame_measured(self, frame_time):
+        if self._gpu_time is None:
+            self._gpu_time = frame_time
+        else:
+            self._gpu_time += (frame_time - self._gpu_time) * 0.1
+
+        now = time.perf_counter_ns()
+        if now - self._last_adjustment < self._interval_ns or self._failed:
+            return
+
+        self._last_adjustment = now
+
+        load = self._gpu_time / self._budget_ns
+        if load > self._high_load and self.scale > self.min_scale:
+            scale = max(self.min_scale, self.scale - RENDER_SCALE_STEP)
+        elif load < self._low_load and self.scale < 1.0:
+            scale = min(1.0, self.scale + RENDER_SCALE_STEP)
+        else:
+            return
+
+        log.info(f'GPU frame time {self._gpu_time / 1000000:.1f}ms is {load:.0%} of the frame budget, render scale {self.scale:.2f} -> {scale:.2f}')
+        self.scale = round(scale, 2)
+        self.scale_changes += 1
+
+        # The measurement at the previous scale says nothing about the new one
+        self._gpu_time = None
+        self.apply_scale()
+
+    def stats(self):
+        return {
+            'render_scale': self.scale,
+            'render_size': f'{self.render_width}x{self.render_height}',
+            'gpu_frame_ms': round(self._gpu_time / 1000000, 2) if self._gpu_time else None,
+            'scale_changes': self.scale_changes
+            }
+
+    def uninitialize(self):
+        self.delete_framebuffer()
@@ -10,8 +10,17 @@ from OpenGL import GL
 
 from lib.common import get_environment
 from lib.projectM.ProjectMWrapper_v3 import ProjectMWrapperV3  # CHANGED THIS LINE
+from lib.projectM.PresetWatchdog import PresetWatchdog
+from lib.projectM.QualityGovernor import QualityGovernor, parse_quality_ladder
 from lib.projectM.SDLRendering import SDLRendering
 from lib.projectM.AudioCapture import AudioCapture
+from lib.projectM import CommandQueue as commands
+from lib.projectM.FramePacer import FramePacer
+from lib.projectM.RenderScaler import RenderScaler
+from lib.projectM.ViewportTracker import ViewportTracker
+from lib.projectM.FrameTimings import (
+    FrameTimings, STAGE_AUDIO, STAGE_CLEAR, STAGE_PACING, STAGE_POLL_EVENTS, STAGE_RENDER, STAGE_SWAP, STAGE_VIEWPORT
+    )
 
 log = logging.getLogger()
 
@@ -47,8 +56,70 @@ class RenderingLoop:
         self.projectm_wrapper   = ProjectMWrapperV3(self.config, self.sdl_rendering)  # CHANGED THIS LINE
         self.audio_capture      = AudioCapture(self.config, self.projectm_wrapper)
 
-        self._renderWidth = None
-        self._renderHeight = None
+        # projectM renders at a fraction of the drawable size when render.scale is below 1 or automatic
+        self.render_scaler = RenderScaler(
+            self.projectm_wrapper.set_window_size,
+            self.config.projectm.get('render.scale', 1.0),
+            self.config.projectm.get('render.scaleautomatic', False),
+            self.config.projectm.get('render.scalemin', 0.5),
+            self.projectm_wrapper.target_fps()
+            )
+
+        self.viewport = ViewportTracker(
+            self.sdl_rendering.get_drawable_size,
+            self.render_scaler.resize,
+            self.config.projectm.get('window.resizedebounce', 0.1)
+            )
+
+        # While idle, frames are rendered at idleFps (0 keeps the last frame on screen) and the
+        # audio is still drained once per audio block so rendering resumes as soon as sound returns
+        self._idleFps = self.config.projectm.get('audio.idlefps', 5)
+        self._idleWait = max(1, int(1000 / self.config.projectm.get('projectm.fps', 60)))
+        self._lastFrameTime = 0
+
+        # Frame limiting with absolute deadlines, the measured frame rate is fed back into projectM
+        self.frame_pacer = FramePacer(
+            self.projectm_wrapper.target_fps(),
+            self.config.projectm.get('render.spinwait', 1) / 1000,
+            self.sdl_rendering.get_vsync_period()
+            )
+        self._fpsFeedback = self.config.projectm.get('render.fpsfeedback', True)
+
+        # Lowers the mesh size and frame rate along render.governorLadder while frames exceed their budget
+        self.quality_governor = None
+        if self.config.projectm.get('render.governor', False):
+            levels = [(
+                self.config.projectm.get('projectm.meshx', 64),
+                self.config.projectm.get('projectm.meshy', 32),
+                self.projectm_wrapper.target_fps()
+                )]
+            levels += parse_quality_ladder(self.config.projectm.get('render.governorladder', ''))
+
+            if len(levels) > 1:
+                self.quality_governor = QualityGovernor(levels)
+            else:
+                log.warning('The quality governor is enabled but render.governorLadder has no levels')
+
+        # Cuts away presets that keep rendering slower than render.watchdogFrameTime and blacklists repeat offenders
+        self.preset_watchdog = None
+        if self.config.projectm.get('render.watchdog', False):
+            self.preset_watchdog = PresetWatchdog(
+                self.config,
+                self.config.projectm.get('render.watchdogframetime', 100) / 1000,
+                self.config.projectm.get('render.watchdogframes', 60),
+                self.config.projectm.get('render.watchdogstrikes', 0)
+                )
+
+        # Key presses are queued and executed coalesced between frames, with at most one preset load per frame
+        self.command_queue = commands.CommandQueue(self.config.projectm.get('render.presetloadinterval', 0.25))
+        self.projectm_wrapper.on_preset_changed = self.preset_changed
+        self.projectm_wrapper.on_preset_load_failed = self.command_queue.preset_switch_failed
+
+        # Per-stage timing, toggled with Ctrl+T
+        self.frame_timings = FrameTimings(
+            self.config.projectm.get('render.stagetimings', False),
+            report_interval=self.config.projectm.get('render.stagetimingsinterval', 10)
+            )
 
     def run(self):
         if EVDEV_INSTALLED and get_environment() == 'lite':
@@ -58,31 +129,140 @@ class RenderingLoop:
         # Start projectM
         self.projectm_wrapper.display_initial_preset()
 
+        timings = self.frame_timings
         while not self.thread_event.is_set() and not self.signal_event.exit:
+            timings.begin()
+            frame_start = time.perf_counter_ns()
+
             self.poll_events()
+            self.execute_commands()
+            timings.mark(STAGE_POLL_EVENTS)
+
             self.check_viewport_size()
+            timings.mark(STAGE_VIEWPORT)
+
+            # Feed the audio captured since the last frame to projectM
+            self.audio_capture.process_audio()
+            timings.mark(STAGE_AUDIO)
+
+            if self.audio_capture.is_idle() and not self.idle_frame_due():
+                # Sleep until the next audio block is due, waking up early for input events
+                sdl2.SDL_WaitEventTimeout(None, self._idleWait)
+                self.frame_pacer.reset()
+                continue
+
+            self._lastFrameTime = time.perf_counter()
 
             # Clear the OpenGL context
+            framebuffer = self.render_scaler.begin_frame()
             GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
-
-            # Render projectM frame
-            self.projectm_wrapper.render_frame()
+            timings.mark(STAGE_CLEAR)
+
+            # Render projectM frame, upscaled to the window when rendering at a lower resolution
+            if framebuffer:
+                self.projectm_wrapper.render_frame_fbo(framebuffer)
+            else:
+                self.projectm_wrapper.render_frame()
+            self.render_scaler.end_frame()
+            timings.mark(STAGE_RENDER)
+
+            if self.quality_governor:
+                # GL calls return once the commands are queued, wait for the GPU so GPU-bound presets
+                # are measured here instead of disappearing into the buffer swap
+                GL.glFinish()
+                level = self.quality_governor.frame_rendered(time.perf_counter_ns() - frame_start)
+                if level:
+                    self.apply_quality_level(*level)
 
             # Swap buffers
             self.sdl_rendering.swap()
+            timings.mark(STAGE_SWAP)
+
+            # A locked preset is kept however slowly it renders, and collects no strikes
+            if (self.preset_watchdog and not self.projectm_wrapper.get_preset_locked()
+                    and self.preset_watchdog.frame_rendered(time.perf_counter_ns() - frame_start)):
+                self.command_queue.push(commands.COMMAND_CUT_PRESET)
+
+            if self.audio_capture.latency_probe:
+                self.audio_capture.latency_probe.frame_presented()
 
-            # Frame limiting (simple)
-            sdl2.SDL_Delay(int(1000 / self.config.projectm.get("projectm.fps", 60)))
+            self.audio_capture.frame_rendered()
+
+            # Frame limiting
+            fps = self.frame_pacer.wait()
+            if fps and self._fpsFeedback:
+                self.projectm_wrapper.update_real_fps(fps)
+            timings.mark(STAGE_PACING)
+
+            timings.end()
 
             if self.preset_hung() and not self.projectm_wrapper.get_preset_locked():
-                self.simulate_keypress(sdl2.SDLK_n)
+                self.command_queue.push_auto_next()
+
+        log.info(f'Frame pacing statistics: {self.frame_pacer.stats()}')
+        log.info(f'Command queue statistics: {self.command_queue.stats()}')
+        log.info(f'Viewport statistics: {self.viewport.stats()}')
+        log.info(f'Render scale statistics: {self.render_scaler.stats()}')
+        if self.quality_governor:
+            log.info(f'Quality governor statistics: {self.quality_governor.stats()}')
+        if self.preset_watchdog:
+            log.info(f'Preset watchdog statistics: {self.preset_watchdog.stats()}')
+        preset_load_stats = self.projectm_wrapper.preset_load_stats()
+        if preset_load_stats:
+            log.info(f'Preset loading statistics: {preset_load_stats}')
+        if self.frame_timings.enabled:
+            self.frame_timings.log_report()
 
         self.audio_capture.uninitialize()
 
+        self.render_scaler.uninitialize()
+
         self.projectm_wrapper.uninitialize()
 
         self.sdl_rendering.uninitialize()
 
+    """Apply a quality level chosen by the quality governor.
+    @param mesh_x: the per-pixel mesh width
+    @param mesh_y: the per-pixel mesh height
+    @param fps: the target frame rate
+    """
+    def apply_quality_level(self, mesh_x, mesh_y, fps):
+        self.projectm_wrapper.set_mesh_size(mesh_x, mesh_y)
+
+        self.frame_pacer.set_fps(fps)
+        self.render_scaler.set_fps(fps)
+        if not self._fpsFeedback:
+            self.projectm_wrapper.update_real_fps(fps)
+
+    """Called by the projectM wrapper after every preset switch.
+    @param preset: the path of the new preset
+    """
+    def preset_changed(self, preset):
+        self.command_queue.preset_switched()
+
+        if self.preset_watchdog:
+            self.preset_watchdog.preset_switched(preset)
+
+    """Hard cut away from a preset flagged by the preset watchdog, removing it from the playlist once blacklisted.
+    Queued by the watchdog, so it shares the preset load limit of the command queue. A preset locked in the
+    meantime is kept.
+    """
+    def cut_slow_preset(self):
+        if self.projectm_wrapper.get_preset_locked():
+            return
+
+        if self.preset_watchdog.preset_blacklisted():
+            self.projectm_wrapper.remove_active_preset()
+
+        self.projectm_wrapper.next_preset(softcut=False)
+
+    """Check if a frame is due at the idle frame rate"""
+    def idle_frame_due(self):
+        if self._idleFps <= 0:
+            return False
+
+        return time.perf_counter() - self._lastFrameTime >= 1 / self._idleFps
+
     """Simulate a keypress
     @param sdl_key: the key to emit
     """
@@ -126,57 +306,95 @@ class RenderingLoop:
         match event.key.keysym.sym:
             case sdl2.SDLK_f:
                 if modifier_pressed:
-                    self.sdl_rendering.toggle_fullscreen()
+                    self.command_queue.push(commands.COMMAND_TOGGLE_FULLSCREEN)
 
             case sdl2.SDLK_i:
                 if modifier_pressed:
-                    self.audio_capture.next_audio_device()
+                    self.command_queue.push(commands.COMMAND_NEXT_AUDIO_DEVICE)
 
             case sdl2.SDLK_n:
                 log.debug('User has requested the next preset')
-                self.projectm_wrapper.next_preset()
+                self.command_queue.push(commands.COMMAND_NEXT_PRESET)
 
             case sdl2.SDLK_p:
-                self.projectm_wrapper.previous_preset()
                 log.debug('User has requested the previous preset')
+                self.command_queue.push(commands.COMMAND_PREVIOUS_PRESET)
 
             case sdl2.SDLK_q:
                 if modifier_pressed:
-                    log.info('User initiated exit!')
-                    self.thread_event.set()
+                    self.command_queue.push(commands.COMMAND_QUIT)
+
+            case sdl2.SDLK_t:
+                if modifier_pressed:
+                    self.command_queue.push(commands.COMMAND_TOGGLE_TIMINGS)
 
             case sdl2.SDLK_y:
                 if modifier_pressed:
-                    if self.projectm_wrapper.get_preset_shuffle():
-                        self.projectm_wrapper.shuffle_playlist(False)
-                    else:
-                        log.info('User has initiated playlist shuffling')
-                        self.projectm_wrapper.shuffle_playlist(True)
+                    self.command_queue.push(commands.COMMAND_TOGGLE_SHUFFLE)
 
             case sdl2.SDLK_DELETE:
-                log.warning(f'User has opted to remove preset {self.projectm_wrapper._current_preset}')
-                self.projectm_wrapper.delete_preset(physical=True)
+                self.command_queue.push(commands.COMMAND_DELETE_PRESET)
 
             case sdl2.SDLK_SPACE:
-                log.info(f'Preset lock status: {self.projectm_wrapper.get_preset_locked()}')
-                if self.projectm_wrapper.get_preset_locked():
-                    self.projectm_wrapper.lock_preset(False)
-                else:
-                    log.info('User has initiated a preset lock')
-                    self.projectm_wrapper.lock_preset(True)
+                self.command_queue.push(commands.COMMAND_TOGGLE_PRESET_LOCK)
             
             case sdl2.SDLK_ESCAPE:
-                self.sdl_rendering.toggle_fullscreen()
+                self.command_queue.push(commands.COMMAND_TOGGLE_FULLSCREEN)
             
             case sdl2.SDLK_UP:
-                self.projectm_wrapper.change_beat_sensitivity(.1)
+                self.command_queue.push(commands.COMMAND_BEAT_SENSITIVITY, .1)
 
             case sdl2.SDLK_DOWN:
-                self.projectm_wrapper.change_beat_sensitivity(-.1)
+                self.command_queue.push(commands.COMMAND_BEAT_SENSITIVITY, -.1)
 
             case _:
                 pass
 
+    """Execute the commands queued since the last frame, coalesced by the command queue"""
+    def execute_commands(self):
+        for command, value in self.command_queue.take():
+            match command:
+                case commands.COMMAND_QUIT:
+                    log.info('User initiated exit!')
+                    self.thread_event.set()
+
+                case commands.COMMAND_TOGGLE_FULLSCREEN:
+                    self.sdl_rendering.toggle_fullscreen()
+
+                case commands.COMMAND_TOGGLE_TIMINGS:
+                    self.frame_timings.set_enabled(not self.frame_timings.enabled)
+
+                case commands.COMMAND_TOGGLE_SHUFFLE:
+                    if self.projectm_wrapper.get_preset_shuffle():
+                        self.projectm_wrapper.shuffle_playlist(False)
+                    else:
+                        log.info('User has initiated playlist shuffling')
+                        self.projectm_wrapper.shuffle_playlist(True)
+
+                case commands.COMMAND_TOGGLE_PRESET_LOCK:
+                    log.info(f'Preset lock status: {self.projectm_wrapper.get_preset_locked()}')
+                    if self.projectm_wrapper.get_preset_locked():
+                        self.projectm_wrapper.lock_preset(False)
+                    else:
+                        log.info('User has initiated a preset lock')
+                        self.projectm_wrapper.lock_preset(True)
+
+                case commands.COMMAND_BEAT_SENSITIVITY:
+                    self.projectm_wrapper.change_beat_sensitivity(value)
+
+                case commands.COMMAND_NEXT_AUDIO_DEVICE:
+                    self.audio_capture.next_audio_device()
+
+                case commands.COMMAND_DELETE_PRESET:
+                    log.warning(f'User has opted to remove preset {self.projectm_wrapper._current_preset}')
+                    self.projectm_wrapper.delete_preset(physical=True)
+
+                case commands.COMMAND_CUT_PRESET:
+                    self.cut_slow_preset()
+
+                case commands.COMMAND_SKIP_PRESETS:
+                    self.projectm_wrapper.skip_presets(value)
+
     def poll_events(self):
         event = sdl2.SDL_Event()
         while sdl2.SDL_PollEvent(ctypes.byref(event)) != 0:
@@ -191,7 +409,7 @@ class RenderingLoop:
                     
                 case sdl2.SDL_MOUSEBUTTONDOWN:
                     if event.button.button == sdl2.SDL_BUTTON_RIGHT:
-                        self.sdl_rendering.toggle_fullscreen()
+                        self.command_queue.push(commands.COMMAND_TOGGLE_FULLSCREEN)
                         
                 case sdl2.SDL_WINDOWEVENT:
                     if event.window.event == sdl2.SDL_WINDOWEVENT_CLOSE:
@@ -199,12 +417,8 @@ class RenderingLoop:
                         break
 
                     if event.window.event == sdl2.SDL_WINDOWEVENT_RESIZED or event.window.event == sdl2.SDL_WINDOWEVENT_SIZE_CHANGED:
-
-                        w, h = ctypes.c_int(), ctypes.c_int()
-                        sdl2.SDL_GetWindowSize(self.sdl_rendering.rendering_window, ctypes.byref(w), ctypes.byref(h))
-                        width, height = w.value, h.value
-
-                        self.projectm_wrapper.set_window_size(width, height)
+                        # Applied by check_viewport_size once the resize settled
+                        self.viewport.size_changed()
 
                     if event.window.event == sdl2.SDL_WINDOWEVENT_HIDDEN or event.window.event == sdl2.SDL_WINDOWEVENT_MINIMIZED:
 
@@ -222,14 +436,7 @@ class RenderingLoop:
                     pass
 
     def check_viewport_size(self):
-        renderWidth = ctypes.c_int()
-        renderHeight = ctypes.c_int()
-
-        self.sdl_rendering.get_drawable_size(renderWidth, renderHeight)
-        if (renderWidth != self._renderWidth or renderHeight != self._renderHeight):
-            self.projectm_wrapper.set_window_size(renderWidth, renderHeight)
-            self._renderWidth = renderWidth
-            self._renderHeight = renderHeight
+        self.viewport.update()
 
     def get_keyboard_devices_by_name(self):
         devices = [evdev.InputDevice(path) for path in evdev.list_devices()]
@@ -263,6 +470,7 @@ class RenderingLoop:
             evdev.ecodes.KEY_N: sdl2.SDLK_n,
             evdev.ecodes.KEY_P: sdl2.SDLK_p,
             evdev.ecodes.KEY_Q: sdl2.SDLK_q,
+            evdev.ecodes.KEY_T: sdl2.SDLK_t,
             evdev.ecodes.KEY_Y: sdl2.SDLK_y,
             evdev.ecodes.KEY_DELETE: sdl2.SDLK_DELETE,
             evdev.ecodes.KEY_SPACE: sdl2.SDLK_SPACE,
@@ -74,6 +74,19 @@ class SDLRendering:
     def swap(self):
         sdl2.SDL_GL_SwapWindow(self.rendering_window)
 
+    """Refresh period of the display when the buffer swap waits for vsync.
+    @returns the refresh period in seconds, or None when vsync is off
+    """
+    def get_vsync_period(self):
+        if sdl2.SDL_GL_GetSwapInterval() == 0:
+            return None
+
+        mode = sdl2.SDL_DisplayMode()
+        if sdl2.SDL_GetWindowDisplayMode(self.rendering_window, ctypes.byref(mode)) != 0 or mode.refresh_rate <= 0:
+            return 1 / 60
+
+        return 1 / mode.refresh_rate
+
     def set_sdl_window_title(self, title):
         sdl2.SDL_SetWindowTitle(self.rendering_window, title)
 
@@ -95,9 +108,14 @@ class SDLRendering:
         left = self.config.projectm.get('window.left', 0)
         top = self.config.projectm.get('window.top', 0)
 
+        flags = sdl2.SDL_WINDOW_OPENGL | sdl2.SDL_WINDOW_RESIZABLE | sdl2.SDL_WINDOW_ALLOW_HIGHDPI
+
+        # Headless tools (e.g. the preset profiler) render into a window that is never shown
+        if self.config.projectm.get('window.hidden', False):
+            flags |= sdl2.SDL_WINDOW_HIDDEN
+
         self.rendering_window = sdl2.SDL_CreateWindow(
-            b"projectM Python SDL2", left, top, width, height, 
-            sdl2.SDL_WINDOW_OPENGL | sdl2.SDL_WINDOW_RESIZABLE | sdl2.SDL_WINDOW_ALLOW_HIGHDPI
+            b"projectM Python SDL2", left, top, width, height, flags
         )
         if not self.rendering_window:
             log.error("SDL_CreateWindow Error:", sdl2.SDL_GetError())
@@ -0,0 +1,211 @@
+import logging
+import mmap
+import os
+import struct
+import time
+
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+log = logging.getLogger()
+
+DEFAULT_SHARED_MEMORY_NAME = 'projectmar_audio'
+
+SHARED_MEMORY_MAGIC = b'PMAR'
+SHARED_MEMORY_VERSION = 1
+
+# magic, version, sequence, frame, timestamp (perf_counter_ns), total samples, sample rate,
+# window size, window index (oldest sample), band count, rms, peak, flux, onset
+HEADER = struct.Struct('<4sIQQQQIIIIfffI')
+HEADER_SIZE = 128
+SEQUENCE = struct.Struct('<Q')
+SEQUENCE_OFFSET = 8
+
+"""A consistent copy of one published frame.
+frame: the number of the analysed frame
+timestamp: perf_counter_ns timestamp of the analysis (CLOCK_MONOTONIC, comparable between processes)
+total_samples: the number of samples published since the export started
+sample_rate: the sample rate of the PCM window
+rms, peak, flux, onset: see AudioFeatures
+pcm: float32 array of the latest mono PCM window, oldest sample first
+bands: float32 array of the band energies
+"""
+SharedAudioFrame = namedtuple('SharedAudioFrame', ['frame', 'timestamp', 'total_samples', 'sample_rate', 'rms', 'peak', 'flux', 'onset', 'pcm', 'bands'])
+
+"""Size in bytes of the shared memory block.
+@param window_size: the number of samples in the PCM window
+@param band_count: the number of band energies
+"""
+def shared_memory_size(window_size, band_count):
+    return HEADER_SIZE + (window_size + band_count) * 4
+
+class SharedAudioWriter:
+    """Publish the analysed PCM window and band energies of every frame into shared memory, so local
+    processes (LED strips, lighting controllers) can use the captured audio without capturing it again.
+    The header holds a sequence number which is odd while a frame is being written (seqlock), readers
+    retry when it is odd or changed during their copy. There is a single writer, so no lock is needed.
+    @param name: the name of the shared memory block (/dev/shm/<name>)
+    @param window_size: the number of samples in the PCM window
+    @param band_count: the number of band energies
+    """
+    def __init__(self, name=DEFAULT_SHARED_MEMORY_NAME, window_size=1024, band_count=16):
+        self.name = name
+        self.window_size = window_size
+        self.band_count = band_count
+
+        size = shared_memory_size(window_size, band_count)
+        try:
+            self._shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            # Left over from a previous run that did not exit cleanly
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self._shm = shared_memory.SharedMemory(name, create=True, size=size)
+
+        self._buffer = self._shm.buf
+        self._pcm = np.ndarray(window_size, dtype=np.float32, buffer=self._buffer, offset=HEADER_SIZE)
+        self._bands = np.ndarray(band_count, dtype=np.float32, buffer=self._buffer, offset=HEADER_SIZE + window_size * 4)
+
+        self._sequence = 0
+        self._frame = 0
+        self._total_samples = 0
+        self.published = 0
+
+        HEADER.pack_into(self._buffer, 0, SHARED_MEMORY_MAGIC, SHARED_MEMORY_VERSION, 0, 0, 0, 0, 0, window_size, 0, band_count, 0.0, 0.0, 0.0, 0)
+
+        log.info(f'Publishing audio analysis to shared memory /dev/shm/{name} ({size} bytes)')
+
+    """Publish the features of the current frame.
+    @param analyzer: the AudioAnalyzer holding the PCM window
+    @param features: the AudioFeatures of the current frame
+    """
+    def publish(self, analyzer, features):
+        if features.frame == self._frame or analyzer.sample_rate is None:
+            return
+
+        self._frame = features.frame
+
+        self._sequence += 1
+        SEQUENCE.pack_into(self._buffer, SEQUENCE_OFFSET, self._sequence)
+
+        self._total_samples += analyzer.window_samples
+        HEADER.pack_into(
+            self._buffer, 0,
+            SHARED_MEMORY_MAGIC, SHARED_MEMORY_VERSION, self._sequence,
+            features.frame, features.timestamp, self._total_samples, analyzer.sample_rate,
+            self.window_size, analyzer.window_index, self.band_count,
+            features.rms, features.peak, features.flux, features.onset
+            )
+
+        self._pcm[:] = analyzer.window
+        self._bands[:] = features.bands
+
+        self._sequence += 1
+        SEQUENCE.pack_into(self._buffer, SEQUENCE_OFFSET, self._sequence)
+
+        self.published += 1
+
+    def close(self):
+        if self._shm:
+            self._pcm = None
+            self._bands = None
+            self._buffer = None
+
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+class SharedAudioReader:
+    """Read the audio analysis published by projectMAR (see SharedAudioWriter) from another process.
+    The block is mapped read-only, so a misbehaving consumer cannot corrupt what other consumers see.
+    Only the standard library and numpy are needed, so it can be copied into external tools.
+
+        reader = SharedAudioReader()
+        while True:
+            frame = reader.read()
+            if frame:
+                update_leds(frame.bands, frame.onset)
+
+    @param name: the name of the shared memory block
+    @param retries: the number of attempts to get a consistent copy while a frame is being written
+    """
+    def __init__(self, name=DEFAULT_SHARED_MEMORY_NAME, retries=100):
+        self.retries = retries
+
+        # Mapped directly instead of through SharedMemory, which can only map read-write and (before
+        # Python 3.13) registers the block with the resource tracker that unlinks it when the reader exits
+        fd = os.open(os.path.join('/dev/shm', name), os.O_RDONLY)
+        try:
+            self._mmap = mmap.mmap(fd, 0, prot=mmap.PROT_READ)
+        finally:
+            os.close(fd)
+
+        self._buffer = memoryview(self._mmap)
+
+        magic, version, _, _, _, _, _, window_size, _, band_count, _, _, _, _ = HEADER.unpack_from(self._buffer, 0)
+        if magic != SHARED_MEMORY_MAGIC or version != SHARED_MEMORY_VERSION:
+            self.close()
+            raise ValueError(f'/dev/shm/{name} is not a projectMAR audio export (version {SHARED_MEMORY_VERSION})')
+
+        self.window_size = window_size
+        self.band_count = band_count
+
+        # Zero copy read-only views, only consistent when checked with the sequence number
+        self.pcm_view = np.ndarray(window_size, dtype=np.float32, buffer=self._buffer, offset=HEADER_SIZE)
+        self.bands_view = np.ndarray(band_count, dtype=np.float32, buffer=self._buffer, offset=HEADER_SIZE + window_size * 4)
+
+        self._pcm = np.zeros(window_size, dtype=np.float32)
+        self._bands = np.zeros(band_count, dtype=np.float32)
+
+        self._last_sequence = None
+        self.retried = 0
+
+    """Current sequence number, odd while a frame is being written"""
+    def sequence(self):
+        return SEQUENCE.unpack_from(self._buffer, SEQUENCE_OFFSET)[0]
+
+    """Copy the latest published frame.
+    The returned arrays are reused by the next call.
+    @param wait_new: return None instead of the same frame again
+    @returns a SharedAudioFrame, or None if no (new) frame is available
+    """
+    def read(self, wait_new=True):
+        for _ in range(self.retries):
+            sequence = self.sequence()
+            if sequence & 1:
+                self.retried += 1
+                time.sleep(0)
+                continue
+
+            if sequence == 0 or (wait_new and sequence == self._last_sequence):
+                return None
+
+            _, _, _, frame, timestamp, total_samples, sample_rate, _, index, _, rms, peak, flux, onset = HEADER.unpack_from(self._buffer, 0)
+
+            # Unroll the window so the oldest sample comes first
+            split = self.window_size - index
+            self._pcm[:split] = self.pcm_view[index:]
+            self._pcm[split:] = self.pcm_view[:index]
+            self._bands[:] = self.bands_view
+
+            if self.sequence() != sequence:
+                self.retried += 1
+                continue
+
+            self._last_sequence = sequence
+            return SharedAudioFrame(frame, timestamp, total_samples, sample_rate, rms, peak, flux, bool(onset), self._pcm, self._bands)
+
+        return None
+
+    def close(self):
+        self.pcm_view = None
+        self.bands_view = None
+
+        if self._buffer is not None:
+            self._buffer.release()
+            self._buffer = None
+
+            self._mmap.close()
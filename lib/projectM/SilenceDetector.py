@@ -0,0 +1,81 @@
+import ctypes
+import logging
+import math
+import time
+
+import numpy as np
+
+log = logging.getLogger()
+
+"""Convert a dBFS level to a linear amplitude"""
+def db_to_amplitude(db):
+    return 10 ** (db / 20)
+
+class SilenceDetector:
+    """RMS/peak detector on the PCM handed to projectM.
+    The input is considered silent when neither the RMS nor the peak level of any block exceeded
+    its threshold for the hold time. Sound in a single block ends the silence immediately.
+    @param rms_threshold: the RMS level in dBFS below which a block is silent
+    @param peak_threshold: the peak level in dBFS below which a block is silent
+    @param hold: the number of seconds without sound before the input is considered silent
+    """
+    def __init__(self, rms_threshold=-60, peak_threshold=-40, hold=10):
+        self._rms_threshold = db_to_amplitude(rms_threshold)
+        self._peak_threshold = db_to_amplitude(peak_threshold)
+        self._hold_ns = int(hold * 1000000000)
+
+        self._last_sound = time.perf_counter_ns()
+        self._idle_start = None
+
+        self.idle = False
+        self.idle_entered = 0
+        self.idle_seconds = 0.0
+        self.peak = 0.0
+        self.rms = 0.0
+
+    """Measure a block of float32 samples.
+    @param address: the address of the interleaved samples
+    @param frames: the number of frames at the address
+    @param channels: the number of interleaved channels
+    """
+    def update(self, address, frames, channels):
+        count = frames * channels
+        if not count:
+            return
+
+        samples = np.ctypeslib.as_array(ctypes.cast(address, ctypes.POINTER(ctypes.c_float)), shape=(count,))
+
+        self.peak = max(float(samples.max()), -float(samples.min()))
+        self.rms = math.sqrt(float(np.dot(samples, samples)) / count)
+
+        if self.rms >= self._rms_threshold or self.peak >= self._peak_threshold:
+            self._last_sound = time.perf_counter_ns()
+
+            if self.idle:
+                self.idle = False
+                self.idle_seconds += (self._last_sound - self._idle_start) / 1000000000
+                log.info(f'Audio detected after {(self._last_sound - self._idle_start) / 1000000000:.1f}s of silence, leaving idle mode')
+
+    """Check whether the input has been silent for the hold time, entering idle mode if so"""
+    def is_idle(self):
+        if not self.idle:
+            now = time.perf_counter_ns()
+            if now - self._last_sound >= self._hold_ns:
+                self.idle = True
+                self.idle_entered += 1
+                self._idle_start = now
+                log.info(f'No audio for {self._hold_ns / 1000000000:.0f}s, entering idle mode')
+
+        return self.idle
+
+    def stats(self):
+        idle_seconds = self.idle_seconds
+        if self.idle:
+            idle_seconds += (time.perf_counter_ns() - self._idle_start) / 1000000000
+
+        return {
+            'idle': self.idle,
+            'idle_entered': self.idle_entered,
+            'idle_seconds': round(idle_seconds, 1),
+            'peak_dbfs': round(20 * math.log10(self.peak), 1) if self.peak > 0 else None
+            }
@@ -0,0 +1,74 @@
+import ctypes
+import logging
+import time
+
+log = logging.getLogger()
+
+class ViewportTracker:
+    """Keep projectM's viewport in sync with the drawable size of the window.
+    The drawable size is only queried after SDL reported a window size change, and only once the
+    events stopped arriving for debounce seconds, so an interactive resize does not make projectM
+    rebuild its framebuffers for every intermediate size. projectM is only told about the size when
+    it actually changed.
+    @param get_drawable_size: function filling two ctypes.c_int with the drawable width and height
+    @param set_window_size: function receiving the new width and height
+    @param debounce: seconds without size change events before the new size is applied
+    """
+    def __init__(self, get_drawable_size, set_window_size, debounce=0.1):
+        self._get_drawable_size = get_drawable_size
+        self._set_window_size = set_window_size
+        self._debounce_ns = int(debounce * 1000000000)
+
+        self._width = ctypes.c_int()
+        self._height = ctypes.c_int()
+
+        self.width = None
+        self.height = None
+
+        # The initial size has to be applied without waiting for an event
+        self._dirty = True
+        self._last_event = 0
+
+        self.size_events = 0
+        self.checks = 0
+        self.resizes = 0
+
+    """Register a window size change event"""
+    def size_changed(self):
+        self._dirty = True
+        self._last_event = time.perf_counter_ns()
+        self.size_events += 1
+
+    """Apply the drawable size once a size change has settled, called once per frame.
+    @returns True if projectM was resized
+    """
+    def update(self):
+        if not self._dirty:
+            return False
+
+        if time.perf_counter_ns() - self._last_event < self._debounce_ns:
+            return False
+
+        self._dirty = False
+        self.checks += 1
+
+        self._get_drawable_size(self._width, self._height)
+        width, height = self._width.value, self._height.value
+        if width == self.width and height == self.height:
+            return False
+
+        log.debug(f'Viewport resized from {self.width}x{self.height} to {width}x{height}')
+        self.width = width
+        self.height = height
+        self.resizes += 1
+
+        self._set_window_size(width, height)
+        return True
+
+    def stats(self):
+        return {
+            'viewport': f'{self.width}x{self.height}',
+            'size_events': self.size_events,
+            'checks': self.checks,
+            'resizes': self.resizes
+            }
@@ -0,0 +1,135 @@
+import argparse
+import logging
+import os
+import sys
+import time
+
+from lib.config import Config, APP_ROOT
+from lib.log import log_init
+
+log = logging.getLogger()
+
+"""Parse command line arguments for the preset profiler"""
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Render every preset offscreen with a synthetic audio signal and record its frame times '
+                    'and load time in the preset cost index (in general.state_path). Interrupted runs resume '
+                    'where they stopped, presets are only profiled again when their file changed.'
+        )
+
+    parser.add_argument('paths', nargs='*', metavar='PATH', help='Preset files or directories (default: projectM.presetPath*)')
+    parser.add_argument('--frames', type=int, default=300, help='Frames measured per preset')
+    parser.add_argument('--width', type=int, default=1280, help='Render width')
+    parser.add_argument('--height', type=int, default=720, help='Render height')
+    parser.add_argument('--shard', type=int, default=0, help='Index of this process when profiling with several processes')
+    parser.add_argument('--shards', type=int, default=1, help='Number of processes the presets are split across')
+    parser.add_argument('--offscreen', action='store_true', help='Use the SDL offscreen (EGL) video driver, no display server needed')
+    parser.add_argument('--software', action='store_true', help='Render with Mesa llvmpipe instead of the GPU')
+    parser.add_argument('--restart', action='store_true', help='Profile every preset again')
+
+    args = parser.parse_args()
+    if not 0 <= args.shard < args.shards:
+        parser.error('--shard has to be between 0 and --shards - 1')
+
+    return args
+
+"""Get the configured preset paths.
+@param config: the projectMAR configuration
+"""
+def get_preset_paths(config):
+    paths = list()
+
+    index = 0
+    while True:
+        config_key = 'projectm.presetpath'
+        if index > 0:
+            config_key += f'.{index}'
+
+        if not config.projectm.get(config_key, None):
+            break
+
+        paths.append(config.projectm[config_key])
+        index += 1
+
+    return paths
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    # Must be set before SDL and Mesa are loaded
+    if args.offscreen:
+        os.environ['SDL_VIDEODRIVER'] = 'offscreen'
+    if args.software:
+        os.environ['LIBGL_ALWAYS_SOFTWARE'] = '1'
+        os.environ['GALLIUM_DRIVER'] = 'llvmpipe'
+
+    import sdl2
+
+    from lib.projectM.PresetProfiler import PresetCostIndex, PresetProfiler, find_presets, load_preset_costs
+    from lib.projectM.ProjectMWrapper import ProjectMWrapper
+    from lib.projectM.SDLRendering import SDLRendering
+
+    config = Config(os.path.join(APP_ROOT, 'conf', 'projectMAR.conf'))
+
+    log_level = config.general.get('log_level', logging.INFO)
+    log_init(os.path.join(APP_ROOT, f'profile_presets.{args.shard}.log'), log_level)
+    log_init('console', log_level)
+
+    presets = find_presets(args.paths or get_preset_paths(config))[args.shard::args.shards]
+
+    index = PresetCostIndex(config, args.shard, args.shards)
+    if not args.restart:
+        costs = load_preset_costs(config)
+        presets = [preset for preset in presets if not PresetCostIndex.is_profiled(preset, costs)]
+
+    log.info(f'Profiling {len(presets)} presets (shard {args.shard + 1} of {args.shards}) at {args.width}x{args.height}, {args.frames} frames each')
+    if not presets:
+        sys.exit(0)
+
+    # A hidden window of the profiled size, no preset paths (presets are added one by one) and nothing
+    # switching presets on its own while they are measured
+    for key in [key for key in config.projectm if key.startswith('projectm.presetpath')]:
+        del config.projectm[key]
+
+    config.projectm.update({
+        'window.hidden': True,
+        'window.fullscreen': False,
+        'window.width': args.width,
+        'window.height': args.height,
+        'window.displaypresetnameintitle': False,
+        'projectm.presetlocked': True,
+        'projectm.hardcutsenabled': False,
+        'projectm.shuffleenabled': False
+        })
+
+    sdl_rendering = SDLRendering(config)
+    sdl2.SDL_GL_SetSwapInterval(0)
+
+    projectm_wrapper = ProjectMWrapper(config, sdl_rendering)
+    projectm_wrapper.set_window_size(args.width, args.height)
+
+    profiler = PresetProfiler(projectm_wrapper, sdl_rendering, args.frames, projectm_wrapper.target_fps())
+
+    start = time.perf_counter()
+    try:
+        for count, preset in enumerate(presets, 1):
+            index.begin(preset)
+            result = profiler.profile(preset)
+            index.record(preset, result)
+
+            if 'failed' in result:
+                log.warning(f'[{count}/{len(presets)}] {preset}: {result["failed"]}')
+            else:
+                log.info(f'[{count}/{len(presets)}] {preset}: mean {result["mean_ms"]}ms, p95 {result["p95_ms"]}ms, '
+                         f'max {result["max_ms"]}ms, load {result["load_ms"]}ms')
+
+    except KeyboardInterrupt:
+        log.info('Profiling interrupted, run again to resume')
+
+    finally:
+        index.close()
+
+        projectm_wrapper.uninitialize()
+        sdl_rendering.uninitialize()
+
+    log.info(f'Profiled for {time.perf_counter() - start:.0f}s, the results are in {index.name}.json')
@@ -10,6 +10,7 @@ from lib.config import Config, APP_ROOT
 from lib.common import get_environment
 from lib.log import log_init
 
+from lib.projectM.PresetWatchdog import clear_preset_blacklist, load_preset_blacklist
 from lib.projectM.RenderingLoop import RenderingLoop
 
 from controllers.audio import AudioCtrl
@@ -72,6 +73,42 @@ def parse_args():
         help='Output diagnostics report for issue debugging'
         )
 
+    parser.add_argument(
+        '-l','--latency',
+        action='store_true',
+        dest='latency',
+        help='Measure audio-to-visual latency using a synthetic impulse train instead of the capture device'
+        )
+
+    parser.add_argument(
+        '-b','--blacklist',
+        action='store_true',
+        dest='blacklist',
+        help='List the presets blacklisted by the render watchdog'
+        )
+
+    parser.add_argument(
+        '--clear-blacklist',
+        nargs='*',
+        dest='clear_blacklist',
+        metavar='PRESET',
+        help='Remove the given presets (all presets if none are given) from the render watchdog blacklist'
+        )
+
+    parser.add_argument(
+        '-r','--replay',
+        dest='replay',
+        metavar='JOURNAL',
+        help='Replay an audio journal (see audio.journalPath) instead of capturing audio'
+        )
+
+    parser.add_argument(
+        '-f','--fast',
+        action='store_true',
+        dest='fast',
+        help='Replay the audio journal one recorded frame per rendered frame instead of in real time'
+        )
+
     return parser.parse_args()
 
 if __name__ == "__main__":
@@ -120,6 +157,26 @@ if __name__ == "__main__":
         display.close()
         sys.exit(0)
 
+    if args.blacklist or args.clear_blacklist is not None:
+        if args.clear_blacklist is not None:
+            blacklist = clear_preset_blacklist(config, args.clear_blacklist)
+        else:
+            blacklist = load_preset_blacklist(config)
+
+        print(f'{len(blacklist)} blacklisted presets')
+        for preset, details in sorted(blacklist.items()):
+            print(f'{preset}: {details}')
+
+        sys.exit(0)
+
+    if args.latency:
+        config.projectm['audio.latencyprobe'] = True
+
+    if args.replay:
+        config.projectm['audio.backend'] = 'journal'
+        config.projectm['audio.journalreplay'] = args.replay
+        config.projectm['audio.journalrealtime'] = not args.fast
+
     pm = ProjectMAR(config)
     pm.run()
     pm.close()
@@ -0,0 +1,143 @@
+import argparse
+import logging
+import os
+import subprocess
+import sys
+
+from lib.config import Config, APP_ROOT
+from lib.log import log_init
+
+log = logging.getLogger()
+
+"""Parse command line arguments for offline rendering"""
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Render an audio file through projectM into raw RGBA frames as fast as the GPU allows, '
+                    'with a fixed timestep so every run renders the same frames.'
+        )
+
+    parser.add_argument('audio', help='The audio file to render (.wav, anything else is read as raw float32)')
+    parser.add_argument('-o', '--output', default='-',
+                        help='Raw RGBA output: a file, "-" for stdout, or a pattern like frames/%%06d.rgba for one file per frame')
+    parser.add_argument('--pipe', metavar='COMMAND',
+                        help='Pipe the raw RGBA frames into an encoder, e.g. '
+                             '"ffmpeg -f rawvideo -pix_fmt rgba -s 1280x720 -r 60 -i - out.mp4"')
+    parser.add_argument('--preset', action='append', metavar='PATH', help='Preset files or directories to use instead of projectM.presetPath*')
+    parser.add_argument('--width', type=int, default=1280, help='Frame width')
+    parser.add_argument('--height', type=int, default=720, help='Frame height')
+    parser.add_argument('--fps', type=int, default=60, help='Output frame rate')
+    parser.add_argument('--duration', type=float, help='Seconds of audio to render (default: all of it)')
+    parser.add_argument('--channels', type=int, default=2, help='Channels of a raw float32 audio file')
+    parser.add_argument('--sample-rate', type=int, default=44100, help='Sample rate of a raw float32 audio file')
+    parser.add_argument('--offscreen', action='store_true', help='Use the SDL offscreen (EGL) video driver, no display server needed')
+    parser.add_argument('--software', action='store_true', help='Render with Mesa llvmpipe instead of the GPU')
+
+    return parser.parse_args()
+
+"""Open the destination of the rendered frames.
+@param args: the parsed command line arguments
+@returns a tuple of a function writing a frame and a function closing the destination
+"""
+def open_output(args):
+    if args.pipe:
+        process = subprocess.Popen(args.pipe, shell=True, stdin=subprocess.PIPE)
+
+        def close():
+            process.stdin.close()
+            process.wait()
+
+        return lambda index, frame: process.stdin.write(frame.data), close
+
+    if '%' in args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        def write_file(index, frame):
+            with open(args.output % index, 'wb') as outfile:
+                outfile.write(frame.data)
+
+        return write_file, lambda: None
+
+    outfile = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+    return lambda index, frame: outfile.write(frame.data), outfile.flush if args.output == '-' else outfile.close
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    # Must be set before SDL and Mesa are loaded
+    if args.offscreen:
+        os.environ['SDL_VIDEODRIVER'] = 'offscreen'
+    if args.software:
+        os.environ['LIBGL_ALWAYS_SOFTWARE'] = '1'
+        os.environ['GALLIUM_DRIVER'] = 'llvmpipe'
+
+    import numpy as np
+
+    from lib.projectM.AudioCaptureImpl_File import load_wav
+    from lib.projectM.OfflineRenderer import OfflineRenderer
+    from lib.projectM.ProjectMWrapper import ProjectMWrapper
+    from lib.projectM.SDLRendering import SDLRendering
+
+    config = Config(os.path.join(APP_ROOT, 'conf', 'projectMAR.conf'))
+
+    # Frames may go to stdout, so only log to the file and stderr
+    log_level = config.general.get('log_level', logging.INFO)
+    log_init(os.path.join(APP_ROOT, 'render_offline.log'), log_level)
+    logging.getLogger().addHandler(logging.StreamHandler(sys.stderr))
+
+    if args.audio.lower().endswith('.wav'):
+        samples, channels, sample_rate = load_wav(args.audio)
+    else:
+        channels, sample_rate = args.channels, args.sample_rate
+        samples = np.fromfile(args.audio, dtype='<f4').astype(np.float32)
+        samples = samples[:samples.size - samples.size % channels]
+
+    if args.duration:
+        samples = samples[:int(args.duration * sample_rate) * channels]
+
+    if args.preset:
+        for key in [key for key in config.projectm if key.startswith('projectm.presetpath')]:
+            del config.projectm[key]
+
+        for index, path in enumerate(args.preset):
+            config.projectm['projectm.presetpath' + (f'.{index}' if index else '')] = path
+
+    # The window is never shown, frames are rendered into a framebuffer of the requested size and presets
+    # are switched on the audio timeline instead of projectM's own timer
+    config.projectm.update({
+        'window.hidden': True,
+        'window.fullscreen': False,
+        'window.width': args.width,
+        'window.height': args.height,
+        'window.displaypresetnameintitle': False,
+        'projectm.presetlocked': True,
+        'projectm.fps': args.fps
+        })
+
+    sdl_rendering = SDLRendering(config)
+    projectm_wrapper = ProjectMWrapper(config, sdl_rendering)
+    projectm_wrapper.display_initial_preset()
+
+    renderer = OfflineRenderer(
+        projectm_wrapper, np.ascontiguousarray(samples), channels, sample_rate, args.width, args.height,
+        args.fps, config.projectm.get('projectm.displayduration', 60)
+        )
+
+    write_frame, close_output = open_output(args)
+
+    log.info(f'Rendering {renderer.total_frames} frames of {args.audio} at {args.width}x{args.height}, {args.fps} fps')
+    try:
+        renderer.run(write_frame, int(args.duration * args.fps) if args.duration else None)
+
+    except (KeyboardInterrupt, BrokenPipeError):
+        log.info('Rendering interrupted')
+
+    finally:
+        close_output()
+
+        renderer.uninitialize()
+        projectm_wrapper.uninitialize()
+        sdl_rendering.uninitialize()
+
+    log.info(f'Offline rendering statistics: {renderer.stats()}')
@@ -0,0 +1,53 @@
+from lib.projectM import CommandQueue as commands
+from lib.projectM.CommandQueue import CommandQueue
+
+def test_navigation_is_coalesced_into_one_skip():
+    queue = CommandQueue(0)
+    for _ in range(5):
+        queue.push(commands.COMMAND_NEXT_PRESET)
+    queue.push(commands.COMMAND_PREVIOUS_PRESET)
+
+    assert queue.take() == [(commands.COMMAND_SKIP_PRESETS, 4)]
+    assert queue.take() == []
+
+def test_toggles_pressed_twice_cancel_out():
+    queue = CommandQueue(0)
+    queue.push(commands.COMMAND_TOGGLE_FULLSCREEN)
+    queue.push(commands.COMMAND_TOGGLE_FULLSCREEN)
+    queue.push(commands.COMMAND_TOGGLE_SHUFFLE)
+
+    assert queue.take() == [(commands.COMMAND_TOGGLE_SHUFFLE, None)]
+
+def test_auto_next_waits_for_the_switch_report():
+    queue = CommandQueue(0)
+
+    queue.push_auto_next()
+    assert queue.take() == [(commands.COMMAND_SKIP_PRESETS, 1)]
+
+    # The preset is still hung until the wrapper reports the switch
+    queue.push_auto_next()
+    assert queue.take() == []
+
+    queue.preset_switched()
+    queue.push_auto_next()
+    assert queue.take() == [(commands.COMMAND_SKIP_PRESETS, 1)]
+
+def test_auto_next_retries_after_a_failed_switch():
+    queue = CommandQueue(0)
+
+    queue.push_auto_next()
+    queue.take()
+    queue.preset_switch_failed()
+
+    queue.push_auto_next()
+    assert queue.take() == [(commands.COMMAND_SKIP_PRESETS, 1)]
+
+def test_preset_loads_respect_the_interval():
+    queue = CommandQueue(60)
+    queue.push(commands.COMMAND_NEXT_PRESET)
+    assert queue.take() == [(commands.COMMAND_SKIP_PRESETS, 1)]
+
+    queue.push(commands.COMMAND_NEXT_PRESET)
+    queue.push(commands.COMMAND_BEAT_SENSITIVITY, .1)
+    assert queue.take() == [(commands.COMMAND_BEAT_SENSITIVITY, .1)]
+    assert queue.pending()
@@ -0,0 +1,63 @@
+import os
+
+from types import SimpleNamespace
+
+from lib.projectM.PresetIndex import PresetIndex
+
+def create_presets(directory, names):
+    os.makedirs(directory, exist_ok=True)
+    for name in names:
+        with open(os.path.join(directory, name), 'w') as outfile:
+            outfile.write('[preset00]\n')
+
+def test_warm_scan_lists_no_directories(tmp_path):
+    config = SimpleNamespace(general={'state_path': str(tmp_path / 'state')})
+    library = tmp_path / 'library'
+    create_presets(library / 'a', ['b.milk', 'a.milk'])
+    create_presets(library / 'b', ['c.prjm', 'ignored.txt'])
+
+    cold = PresetIndex(config)
+    presets = cold.scan([str(library)])
+    assert [os.path.basename(preset) for preset in presets] == ['a.milk', 'b.milk', 'c.prjm']
+    assert cold.stats()['directories_rescanned'] == 3
+
+    warm = PresetIndex(config)
+    assert warm.scan([str(library)]) == presets
+    assert warm.stats()['directories_rescanned'] == 0
+
+def test_scan_of_other_paths_keeps_existing_entries(tmp_path):
+    config = SimpleNamespace(general={'state_path': str(tmp_path / 'state')})
+    library = tmp_path / 'library'
+    other = tmp_path / 'other'
+    create_presets(library / 'a', ['a.milk'])
+    create_presets(other, ['o.milk'])
+
+    PresetIndex(config).scan([str(library)])
+    indexed = dict(PresetIndex(config).directories)
+
+    # profile_presets.py scans no paths, render_offline.py --preset scans others
+    PresetIndex(config).scan([])
+    PresetIndex(config).scan([str(other)])
+
+    preset_index = PresetIndex(config)
+    for directory, entry in indexed.items():
+        assert preset_index.directories[directory] == entry
+
+    preset_index.scan([str(library)])
+    assert preset_index.stats()['directories_rescanned'] == 0
+
+def test_removed_directory_is_dropped(tmp_path):
+    config = SimpleNamespace(general={'state_path': str(tmp_path / 'state')})
+    library = tmp_path / 'library'
+    create_presets(library / 'a', ['a.milk'])
+    create_presets(library / 'b', ['b.milk'])
+
+    PresetIndex(config).scan([str(library)])
+
+    os.remove(library / 'b' / 'b.milk')
+    os.rmdir(library / 'b')
+
+    preset_index = PresetIndex(config)
+    presets = preset_index.scan([str(library)])
+    assert [os.path.basename(preset) for preset in presets] == ['a.milk']
+    assert str(library / 'b') not in PresetIndex(config).directories
@@ -0,0 +1,83 @@
+from lib.projectM.ViewportTracker import ViewportTracker
+
+class FakeWindow:
+    """Drawable size source and projectM stand-in recording every resize"""
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.resized = list()
+
+    def get_drawable_size(self, width, height):
+        width.value = self.width
+        height.value = self.height
+
+    def set_window_size(self, width, height):
+        self.resized.append((width, height))
+
+def create_tracker(window):
+    return ViewportTracker(window.get_drawable_size, window.set_window_size, debounce=0)
+
+def test_initial_size_is_applied_once():
+    window = FakeWindow(1280, 720)
+    tracker = create_tracker(window)
+
+    assert tracker.update()
+    for _ in range(100):
+        assert not tracker.update()
+
+    assert tracker.resizes == 1
+    assert tracker.checks == 1
+    assert window.resized == [(1280, 720)]
+
+def test_size_event_without_size_change_does_not_resize():
+    window = FakeWindow(1280, 720)
+    tracker = create_tracker(window)
+    tracker.update()
+
+    for _ in range(10):
+        tracker.size_changed()
+        assert not tracker.update()
+
+    assert tracker.size_events == 10
+    assert tracker.checks == 11
+    assert tracker.resizes == 1
+    assert window.resized == [(1280, 720)]
+
+def test_size_event_with_size_change_resizes():
+    window = FakeWindow(1280, 720)
+    tracker = create_tracker(window)
+    tracker.update()
+
+    window.width, window.height = 1920, 1080
+    tracker.size_changed()
+    assert tracker.update()
+    assert not tracker.update()
+
+    assert tracker.resizes == 2
+    assert window.resized == [(1280, 720), (1920, 1080)]
+
+def test_size_change_without_event_is_not_checked():
+    window = FakeWindow(1280, 720)
+    tracker = create_tracker(window)
+    tracker.update()
+
+    window.width, window.height = 800, 600
+    for _ in range(10):
+        assert not tracker.update()
+
+    assert tracker.checks == 1
+    assert tracker.resizes == 1
+
+def test_resize_waits_for_events_to_settle():
+    window = FakeWindow(1280, 720)
+    tracker = ViewportTracker(window.get_drawable_size, window.set_window_size, debounce=60)
+    tracker.update()
+
+    # Intermediate sizes of an interactive resize arrive within the debounce period
+    for width in range(1300, 1400, 10):
+        window.width = width
+        tracker.size_changed()
+        assert not tracker.update()
+
+    assert tracker.resizes == 1
+    assert window.resized == [(1280, 720)]